@@ -3,6 +3,8 @@
 from __future__ import annotations
 
 import argparse
+import dataclasses
+import functools
 import logging
 import os
 import socket
@@ -43,12 +45,12 @@ class _ScanProgressPrinter(threading.Thread):
 
     def _render(self, final: bool = False) -> None:
         snapshot = self.progress.snapshot()
-        total = snapshot.get("total") or 0
-        processed = snapshot.get("processed") or 0
-        errors = snapshot.get("errors") or 0
-        state = snapshot.get("state") or "idle"
-        rate = snapshot.get("rate_per_min") or 0.0
-        eta = snapshot.get("eta_seconds")
+        total = snapshot.total
+        processed = snapshot.processed
+        errors = snapshot.errors
+        state = snapshot.state
+        rate = snapshot.rate_per_min
+        eta = snapshot.eta_seconds
         percent = (processed / total * 100.0) if total else 0.0
         if rate > 0.1:
             rate_display = f"{rate:.1f}/min"
@@ -57,8 +59,8 @@ class _ScanProgressPrinter(threading.Thread):
         else:
             rate_display = ""
         eta_display = ""
-        if isinstance(eta, (float, int)) and eta and eta > 0:
-            eta_display = _format_eta(float(eta))
+        if eta and eta > 0:
+            eta_display = _format_eta(eta)
         parts = [
             "Scanning",
             f"{processed}/{total}" if total else str(processed),
@@ -86,8 +88,12 @@ class _ScanProgressPrinter(threading.Thread):
 
 
 def _format_eta(seconds: float) -> str:
-    seconds = max(0.0, seconds)
-    minutes, sec = divmod(int(seconds + 0.5), 60)
+    return _format_eta_int(int(max(0.0, seconds) + 0.5))
+
+
+@functools.lru_cache(maxsize=256)
+def _format_eta_int(seconds: int) -> str:
+    minutes, sec = divmod(seconds, 60)
     hours, minutes = divmod(minutes, 60)
     if hours:
         return f"{hours}h{minutes:02d}m"
@@ -96,6 +102,19 @@ def _format_eta(seconds: float) -> str:
     return f"{sec}s"
 
 
+def _home_dir() -> str:
+    """Return the user's home directory, preferring the environment over pwd."""
+    home = os.environ.get("HOME") or os.environ.get("USERPROFILE")
+    if home:
+        return home
+    return str(Path.home())
+
+
+def _ensure_dir(path: "str | os.PathLike[str]") -> None:
+    if not os.path.isdir(path):
+        os.makedirs(path, exist_ok=True)
+
+
 def _run_scan(
     scanner: "Scanner",
     scan_progress: "ScanProgress",
@@ -115,177 +134,221 @@ def _run_scan(
             printer.join()
 
 
+# (flags, add_argument kwargs) in --help order. For on/off pairs sharing a dest,
+# the first entry supplies the default, so the ``default=None`` flag comes first.
+_ARG_SPECS: tuple[tuple[tuple[str, ...], dict], ...] = (
+    (
+        ("--root",),
+        {"help": "Root directory to scan for NovelAI PNGs (overrides config file)"},
+    ),
+    (("--db",), {"help": "Path to SQLite database (overrides config file)"}),
+    (
+        ("--thumb-cache",),
+        {"help": "Path for thumbnail cache (default: XDG cache)", "default": None},
+    ),
+    (
+        ("--thumb-size",),
+        {
+            "type": int,
+            "default": None,
+            "help": "Maximum thumbnail size in pixels (default: 512)",
+        },
+    ),
+    (("--watch",), {"action": "store_true", "help": "Enable background rescanner"}),
+    (
+        ("--rescan-interval",),
+        {
+            "type": int,
+            "default": None,
+            "help": "Interval for rescans when watch mode enabled (seconds, default: 600)",
+        },
+    ),
+    (
+        ("--no-thumbs",),
+        {"action": "store_true", "help": "Disable thumbnail generation"},
+    ),
+    (
+        ("--host",),
+        {"help": "Host to bind HTTP server (default: 127.0.0.1)", "default": None},
+    ),
+    (
+        ("--port",),
+        {
+            "type": int,
+            "default": None,
+            "help": "Port to bind HTTP server (default: 8000)",
+        },
+    ),
+    (
+        ("--clip-device",),
+        {"help": "Device string for CLIP model (default: cpu)", "default": None},
+    ),
+    (
+        ("--clip-batch-size",),
+        {
+            "type": int,
+            "default": None,
+            "help": "Image batch size for CLIP embedding computation (default: 8)",
+        },
+    ),
+    (
+        ("--no-clip",),
+        {
+            "action": "store_true",
+            "help": "Disable CLIP indexing and search features",
+        },
+    ),
+    (
+        ("--clip-model-name",),
+        {
+            "help": "OpenCLIP model name (default: ViT-B-32-quickgelu)",
+            "default": None,
+        },
+    ),
+    (
+        ("--clip-checkpoint",),
+        {"help": "OpenCLIP checkpoint name (default: openai)", "default": None},
+    ),
+    (
+        ("--auto-tag-missing",),
+        {
+            "dest": "auto_tag_missing",
+            "action": "store_true",
+            "default": None,
+            "help": "Enable WD14 auto-tagging integration (default: enabled)",
+        },
+    ),
+    (
+        ("--no-auto-tag",),
+        {
+            "dest": "auto_tag_missing",
+            "action": "store_false",
+            "help": "Disable WD14 auto-tagging integration",
+        },
+    ),
+    (
+        ("--auto-tag-model",),
+        {
+            "help": "WD14 model to load when auto-tagging is enabled (default: ConvNextV2)",
+            "default": None,
+        },
+    ),
+    (
+        ("--auto-tag-general-threshold",),
+        {
+            "type": float,
+            "default": None,
+            "help": "Confidence threshold for WD14 general tags (default: 0.35)",
+        },
+    ),
+    (
+        ("--auto-tag-character-threshold",),
+        {
+            "type": float,
+            "default": None,
+            "help": "Confidence threshold for WD14 character tags (default: 0.85)",
+        },
+    ),
+    (
+        ("--auto-tag-mode",),
+        {
+            "choices": ["missing", "augment"],
+            "default": None,
+            "help": "Control whether WD14 tags only fill gaps or also augment embedded metadata (default: augment)",
+        },
+    ),
+    (
+        ("--auto-tag-background",),
+        {
+            "dest": "auto_tag_background",
+            "action": "store_true",
+            "default": None,
+            "help": "Queue auto-tagging jobs for background processing (default: enabled)",
+        },
+    ),
+    (
+        ("--no-auto-tag-background",),
+        {
+            "dest": "auto_tag_background",
+            "action": "store_false",
+            "help": "Run auto-tagging inline during ingestion",
+        },
+    ),
+    (
+        ("--auto-tag-batch-size",),
+        {
+            "type": int,
+            "default": None,
+            "help": "Number of auto-tagging jobs to process per batch when background mode is enabled (default: 4)",
+        },
+    ),
+    (
+        ("--webview",),
+        {
+            "action": "store_true",
+            "help": "Launch the embedded pywebview window instead of opening the default browser",
+        },
+    ),
+    (
+        ("--no-ui",),
+        {"action": "store_true", "help": "Run without opening a browser window"},
+    ),
+    (("--log-level",), {"help": "Logging level (default: INFO)", "default": None}),
+    (
+        ("--extra-root",),
+        {
+            "action": "append",
+            "help": "Additional directories to include in scans",
+        },
+    ),
+    (
+        ("--scan-only",),
+        {"action": "store_true", "help": "Run a single scan and exit"},
+    ),
+    (
+        ("--clip-only",),
+        {"action": "store_true", "help": "Rebuild CLIP embeddings and exit"},
+    ),
+    (
+        ("--config",),
+        {
+            "help": "Path to configuration file (JSON/TOML/YAML). Overrides may be provided by CLI flags.",
+        },
+    ),
+    (
+        ("--cwd",),
+        {
+            "action": "store_true",
+            "help": "Use legacy cwd-relative defaults (ignore config files unless explicitly provided).",
+        },
+    ),
+    (
+        ("--print-config",),
+        {
+            "action": "store_true",
+            "help": "Print an annotated configuration template (TOML) and exit.",
+        },
+    ),
+    (
+        ("--service",),
+        {
+            "action": "store_true",
+            "help": "Service mode: enable watch, disable UI launch, and prefer config defaults.",
+        },
+    ),
+    (
+        ("--status",),
+        {"action": "store_true", "help": "Print CLIP/scan status and exit"},
+    ),
+)
+
+
 def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(
         description="LocalBooru – NovelAI browser with CLIP search"
     )
-    parser.add_argument(
-        "--root",
-        help="Root directory to scan for NovelAI PNGs (overrides config file)",
-    )
-    parser.add_argument(
-        "--db",
-        help="Path to SQLite database (overrides config file)",
-    )
-    parser.add_argument(
-        "--thumb-cache",
-        help="Path for thumbnail cache (default: XDG cache)",
-        default=None,
-    )
-    parser.add_argument(
-        "--thumb-size",
-        type=int,
-        default=None,
-        help="Maximum thumbnail size in pixels (default: 512)",
-    )
-    parser.add_argument(
-        "--watch", action="store_true", help="Enable background rescanner"
-    )
-    parser.add_argument(
-        "--rescan-interval",
-        type=int,
-        default=None,
-        help="Interval for rescans when watch mode enabled (seconds, default: 600)",
-    )
-    parser.add_argument(
-        "--no-thumbs", action="store_true", help="Disable thumbnail generation"
-    )
-    parser.add_argument(
-        "--host",
-        help="Host to bind HTTP server (default: 127.0.0.1)",
-        default=None,
-    )
-    parser.add_argument(
-        "--port",
-        type=int,
-        default=None,
-        help="Port to bind HTTP server (default: 8000)",
-    )
-    parser.add_argument(
-        "--clip-device",
-        help="Device string for CLIP model (default: cpu)",
-        default=None,
-    )
-    parser.add_argument(
-        "--clip-batch-size",
-        type=int,
-        default=None,
-        help="Image batch size for CLIP embedding computation (default: 8)",
-    )
-    parser.add_argument(
-        "--no-clip",
-        action="store_true",
-        help="Disable CLIP indexing and search features",
-    )
-    parser.add_argument(
-        "--clip-model-name",
-        help="OpenCLIP model name (default: ViT-B-32-quickgelu)",
-        default=None,
-    )
-    parser.add_argument(
-        "--clip-checkpoint",
-        help="OpenCLIP checkpoint name (default: openai)",
-        default=None,
-    )
-    parser.add_argument(
-        "--auto-tag-missing",
-        dest="auto_tag_missing",
-        action="store_true",
-        default=None,
-        help="Enable WD14 auto-tagging integration (default: enabled)",
-    )
-    parser.add_argument(
-        "--no-auto-tag",
-        dest="auto_tag_missing",
-        action="store_false",
-        help="Disable WD14 auto-tagging integration",
-    )
-    parser.add_argument(
-        "--auto-tag-model",
-        help="WD14 model to load when auto-tagging is enabled (default: ConvNextV2)",
-        default=None,
-    )
-    parser.add_argument(
-        "--auto-tag-general-threshold",
-        type=float,
-        default=None,
-        help="Confidence threshold for WD14 general tags (default: 0.35)",
-    )
-    parser.add_argument(
-        "--auto-tag-character-threshold",
-        type=float,
-        default=None,
-        help="Confidence threshold for WD14 character tags (default: 0.85)",
-    )
-    parser.add_argument(
-        "--auto-tag-mode",
-        choices=["missing", "augment"],
-        default=None,
-        help="Control whether WD14 tags only fill gaps or also augment embedded metadata (default: augment)",
-    )
-    parser.add_argument(
-        "--auto-tag-background",
-        dest="auto_tag_background",
-        action="store_true",
-        default=None,
-        help="Queue auto-tagging jobs for background processing (default: enabled)",
-    )
-    parser.add_argument(
-        "--no-auto-tag-background",
-        dest="auto_tag_background",
-        action="store_false",
-        help="Run auto-tagging inline during ingestion",
-    )
-    parser.add_argument(
-        "--auto-tag-batch-size",
-        type=int,
-        default=None,
-        help="Number of auto-tagging jobs to process per batch when background mode is enabled (default: 4)",
-    )
-    parser.add_argument(
-        "--webview",
-        action="store_true",
-        help="Launch the embedded pywebview window instead of opening the default browser",
-    )
-    parser.add_argument(
-        "--no-ui", action="store_true", help="Run without opening a browser window"
-    )
-    parser.add_argument(
-        "--log-level", help="Logging level (default: INFO)", default=None
-    )
-    parser.add_argument(
-        "--extra-root",
-        action="append",
-        help="Additional directories to include in scans",
-    )
-    parser.add_argument(
-        "--scan-only", action="store_true", help="Run a single scan and exit"
-    )
-    parser.add_argument(
-        "--clip-only", action="store_true", help="Rebuild CLIP embeddings and exit"
-    )
-    parser.add_argument(
-        "--config",
-        help="Path to configuration file (JSON/TOML/YAML). Overrides may be provided by CLI flags.",
-    )
-    parser.add_argument(
-        "--cwd",
-        action="store_true",
-        help="Use legacy cwd-relative defaults (ignore config files unless explicitly provided).",
-    )
-    parser.add_argument(
-        "--print-config",
-        action="store_true",
-        help="Print an annotated configuration template (TOML) and exit.",
-    )
-    parser.add_argument(
-        "--service",
-        action="store_true",
-        help="Service mode: enable watch, disable UI launch, and prefer config defaults.",
-    )
-    parser.add_argument(
-        "--status", action="store_true", help="Print CLIP/scan status and exit"
-    )
+    for names, kwargs in _ARG_SPECS:
+        parser.add_argument(*names, **kwargs)
     return parser
 
 
@@ -309,7 +372,7 @@ def main(argv: Optional[list[str]] = None) -> int:
     args = parser.parse_args(argv)
 
     if getattr(args, "print_config", False):
-        print(render_default_config_template())
+        sys.stdout.write(render_default_config_template() + "\n")
         return 0
 
     use_cwd_mode = bool(getattr(args, "cwd", False))
@@ -324,9 +387,9 @@ def main(argv: Optional[list[str]] = None) -> int:
             return 2
     else:
         if not config_path_input:
-            default_config = Path.home() / ".localbooru.toml"
-            if default_config.exists():
-                config_path_input = str(default_config)
+            default_config = os.path.join(_home_dir(), ".localbooru.toml")
+            if os.path.isfile(default_config):
+                config_path_input = default_config
         config_path = config_path_input
 
     config_data = None
@@ -358,7 +421,7 @@ def main(argv: Optional[list[str]] = None) -> int:
     )
     setup_logging(config.log_level)
 
-    config.port = find_free_port(config.host, config.port)
+    config = dataclasses.replace(config, port=find_free_port(config.host, config.port))
 
     LOGGER.info(
         "localbooru starting",
@@ -378,9 +441,8 @@ def main(argv: Optional[list[str]] = None) -> int:
     from .clip import ClipIndexer, ClipProgress
     from .watchers import create_directory_watcher
 
-
-    Path(config.db_path).parent.mkdir(parents=True, exist_ok=True)
-    Path(config.thumb_cache).mkdir(parents=True, exist_ok=True)
+    _ensure_dir(os.path.dirname(config.db_path))
+    _ensure_dir(config.thumb_cache)
 
     db = database.LocalBooruDatabase(config.db_path)
 
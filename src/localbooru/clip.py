@@ -1,12 +1,17 @@
 """CLIP embedding management for localbooru."""
 from __future__ import annotations
 
+import contextlib
 import logging
+import os
 import threading
 import time
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import asdict, dataclass, field
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Deque, Dict, List, Optional, Tuple
 
 from PIL import Image, UnidentifiedImageError
 
@@ -16,21 +21,90 @@ from .database import LocalBooruDatabase
 LOGGER = logging.getLogger(__name__)
 
 _MODEL_CACHE: Dict[str, "_OpenClipModel"] = {}
+_MODEL_CACHE_LOCK = threading.Lock()
 
 
 def get_clip_model(config: LocalBooruConfig) -> "_OpenClipModel":
     key = config.clip_model_key
     model = _MODEL_CACHE.get(key)
-    if model is None:
-        model = _OpenClipModel(
-            model_name=config.clip_model_name,
-            checkpoint=config.clip_checkpoint,
-            device=config.clip_device,
-        )
-        _MODEL_CACHE[key] = model
+    if model is not None:
+        return model
+    # Double-checked so concurrent first callers wait instead of loading a second copy.
+    with _MODEL_CACHE_LOCK:
+        model = _MODEL_CACHE.get(key)
+        if model is None:
+            model = _OpenClipModel(
+                model_name=config.clip_model_name,
+                checkpoint=config.clip_checkpoint,
+                device=config.clip_device,
+            )
+            _MODEL_CACHE[key] = model
     return model
 
 
+def quantize_clip_vectors(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Quantize ``(N, D)`` float vectors to int8 codes with one scale per row."""
+    import numpy as np
+
+    matrix = np.asarray(matrix, dtype=np.float32)
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.rint(matrix / scales[:, None]).astype(np.int8)
+    return np.ascontiguousarray(codes), scales
+
+
+def decode_clip_vector(blob: bytes, scale: Optional[float]) -> np.ndarray:
+    """Return a stored vector as float32; a ``None`` scale marks a legacy float32 blob."""
+    import numpy as np
+
+    if scale is None:
+        return np.frombuffer(blob, dtype=np.float32)
+    return np.frombuffer(blob, dtype=np.int8).astype(np.float32) * np.float32(scale)
+
+
+_TURBOJPEG_SUFFIXES = (".jpg", ".jpeg")
+_TURBOJPEG_LOCK = threading.Lock()
+_TURBOJPEG: object = None  # None = not probed yet, False = unavailable
+
+
+def _get_turbojpeg():
+    """Return a shared ``TurboJPEG`` decoder, or ``None`` when PyTurboJPEG is unusable."""
+    global _TURBOJPEG
+    if _TURBOJPEG is None:
+        with _TURBOJPEG_LOCK:
+            if _TURBOJPEG is None:
+                try:
+                    from turbojpeg import TurboJPEG
+
+                    _TURBOJPEG = TurboJPEG()
+                except Exception as exc:  # ImportError, or OSError when libturbojpeg is missing
+                    LOGGER.debug("PyTurboJPEG unavailable, decoding JPEGs with PIL: %s", exc)
+                    _TURBOJPEG = False
+    return _TURBOJPEG or None
+
+
+def _open_rgb(path: Path) -> Image.Image:
+    if path.suffix.lower() in _TURBOJPEG_SUFFIXES:
+        turbo = _get_turbojpeg()
+        if turbo is not None:
+            try:
+                from turbojpeg import TJPF_RGB
+
+                with open(path, "rb") as handle:
+                    pixels = turbo.decode(handle.read(), pixel_format=TJPF_RGB)
+                return Image.fromarray(pixels, "RGB")
+            except FileNotFoundError:
+                raise
+            except Exception:
+                # CMYK, progressive edge cases or corrupt data: let PIL decide.
+                pass
+    with Image.open(path) as img:
+        return img.convert("RGB")
+
+
+_HISTORY_LIMIT = 60
+
+
 @dataclass
 class ClipProgress:
     model_key: str
@@ -43,11 +117,24 @@ class ClipProgress:
     started_at: Optional[float] = None
     last_update: Optional[float] = None
     paused: bool = False
+    # Set by the indexer when CLIP has to be switched off at runtime (e.g. torchvision
+    # missing); the configuration itself is immutable.
+    disabled: bool = False
     errors: list[str] = field(default_factory=list)
-    history: List[Tuple[float, int]] = field(default_factory=list)
+
+    def __post_init__(self) -> None:
+        # Parallel bounded columns rather than a dataclass field, so asdict() in
+        # snapshot() does not deep-copy the samples on every poll.
+        self._history_times: Deque[float] = deque(maxlen=_HISTORY_LIMIT)
+        self._history_counts: Deque[int] = deque(maxlen=_HISTORY_LIMIT)
+
+    @property
+    def history(self) -> List[Tuple[float, int]]:
+        return list(zip(self._history_times, self._history_counts))
 
     def snapshot(self, db: Optional[LocalBooruDatabase] = None) -> Dict[str, object]:
         data = asdict(self)
+        data["history"] = self.history
         if db is not None and self.model_key:
             total, completed, processing, errors = db.clip_progress_counts(self.model_key)
             effective_total = max(total - errors, 0)
@@ -77,25 +164,34 @@ class ClipProgress:
 
     def _record_history(self, completed: int) -> None:
         now = time.time()
-        if self.history and self.history[-1][1] == completed:
-            self.history[-1] = (now, completed)
+        if self._history_counts and self._history_counts[-1] == completed:
+            self._history_times[-1] = now
         else:
-            self.history.append((now, completed))
-        if len(self.history) > 60:
-            self.history = self.history[-60:]
+            self._history_times.append(now)
+            self._history_counts.append(completed)
 
     def _compute_rate_eta(self) -> Tuple[float, Optional[float]]:
-        if not self.history:
+        times = self._history_times
+        counts = self._history_counts
+        if not times:
             return 0.0, None
-        latest_time, latest_completed = self.history[-1]
+        latest_time = times[-1]
+        latest_completed = counts[-1]
         rate_per_min = 0.0
         eta_seconds = None
-        for past_time, past_completed in reversed(self.history[:-1]):
-            delta_count = latest_completed - past_completed
-            delta_time = latest_time - past_time
-            if delta_count > 0 and delta_time >= 1.0:
-                rate_per_min = (delta_count / delta_time) * 60.0
-                break
+        # Newest sample at least a second old; with a rising count it is the answer
+        # the backwards scan would find, so the scan only runs after a count reset.
+        index = min(bisect_right(times, latest_time - 1.0), len(times) - 1) - 1
+        if index >= 0 and counts[index] < latest_completed:
+            delta_time = latest_time - times[index]
+            rate_per_min = ((latest_completed - counts[index]) / delta_time) * 60.0
+        else:
+            for index in range(len(times) - 2, -1, -1):
+                delta_count = latest_completed - counts[index]
+                delta_time = latest_time - times[index]
+                if delta_count > 0 and delta_time >= 1.0:
+                    rate_per_min = (delta_count / delta_time) * 60.0
+                    break
         remaining = max(self.queued, 0)
         if rate_per_min > 0 and remaining > 0:
             eta_seconds = (remaining / rate_per_min) * 60.0
@@ -112,66 +208,48 @@ class ClipIndexer(threading.Thread):
         self._pause_event = threading.Event()
         self._pause_event.set()  # running by default
         self._model = None
+        self._decode_pool = ThreadPoolExecutor(
+            max_workers=min(8, os.cpu_count() or 4), thread_name_prefix="clip-decode"
+        )
+        # A single worker keeps at most one prefetched batch alongside the current one.
+        self._prefetch_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="clip-prefetch")
+        self._next_batch: Optional[Future] = None
 
     def run(self) -> None:  # pragma: no cover - background thread
         while not self._stop_event.is_set():
             if not self._pause_event.is_set():
                 self.progress.paused = True
+                self._release_prefetched()
                 time.sleep(0.5)
                 continue
             self.progress.paused = False
             processed_any = self._process_batch()
             if not processed_any:
                 time.sleep(2.0)
+        self._release_prefetched()
+        self._prefetch_pool.shutdown(wait=False)
+        self._decode_pool.shutdown(wait=False)
 
     def process_until_empty(self) -> None:
         while self._process_batch():
             continue
 
     def _process_batch(self) -> bool:
-        if not self.config.clip_enabled:
+        if not self.config.clip_enabled or self.progress.disabled:
             return False
-        batch = self.db.reserve_clip_batch(self.progress.model_key, self.config.clip_batch_size)
-        if not batch:
+        if self._next_batch is not None:
+            prepared = self._next_batch.result()
+            self._next_batch = None
+        else:
+            prepared = self._prepare_batch()
+        if prepared is None:
             self._refresh_progress()
             self.progress.processing = 0
             if self.progress.started_at and self.progress.completed >= self.progress.total:
                 self.progress.current_path = None
             return False
 
-        self.progress.started_at = self.progress.started_at or time.time()
-        images = []
-        image_ids = []
-        paths: list[str] = []
-
-        for row in batch:
-            rel_path = row["path"]
-            abs_path = (self.config.root / rel_path) if not Path(rel_path).is_absolute() else Path(rel_path)
-            try:
-                img = Image.open(abs_path).convert("RGB")
-            except FileNotFoundError:
-                LOGGER.warning("Missing file for CLIP embedding: %s", abs_path)
-                self.db.mark_clip_error(row["image_id"], "file missing")
-                self._record_error(f"Missing file: {abs_path}")
-                continue
-            except UnidentifiedImageError:
-                LOGGER.warning("Unidentified image for CLIP embedding: %s", abs_path)
-                self.db.mark_clip_error(row["image_id"], "cannot identify image")
-                self._record_error(f"Unidentified image: {abs_path}")
-                continue
-            except OSError as exc:
-                LOGGER.warning("Truncated image for CLIP embedding: %s (%s)", abs_path, exc)
-                self.db.mark_clip_error(row["image_id"], "file truncated")
-                self._record_error(f"Truncated image: {abs_path}")
-                continue
-            except Exception as exc:
-                LOGGER.exception("Error opening %s: %s", abs_path, exc)
-                self.db.mark_clip_error(row["image_id"], str(exc))
-                self._record_error(f"Open error: {abs_path}: {exc}")
-                continue
-            images.append(img)
-            image_ids.append(row["image_id"])
-            paths.append(str(abs_path))
+        images, image_ids, paths = prepared
 
         if not images:
             self._refresh_progress()
@@ -187,7 +265,7 @@ class ClipIndexer(threading.Thread):
                 LOGGER.error(
                     "torchvision is not available; disabling CLIP indexing until the dependency is installed."
                 )
-                self.config.clip_enabled = False
+                self.progress.disabled = True
                 for image_id in image_ids:
                     self.db.mark_clip_error(image_id, "torchvision missing")
                 self._record_error("torchvision missing")
@@ -200,6 +278,10 @@ class ClipIndexer(threading.Thread):
             self._refresh_progress()
             return True
 
+        if not self._stop_event.is_set():
+            # Reserve and decode the next batch while this one is being stored.
+            self._next_batch = self._prefetch_pool.submit(self._prepare_batch)
+
         try:
             import numpy as np  # local import to keep dependency optional when CLIP disabled
         except ImportError as exc:
@@ -210,15 +292,37 @@ class ClipIndexer(threading.Thread):
             self._refresh_progress()
             return True
 
-        for image_id, vec, path in zip(image_ids, vectors, paths):
-            self.progress.current_path = path
-            try:
-                vector_bytes = np.asarray(vec, dtype=np.float32).tobytes()
-                self.db.store_clip_vector(image_id, self.progress.model_key, vector_bytes)
-            except Exception as exc:
-                LOGGER.exception("Failed to store CLIP vector for %s: %s", path, exc)
-                self.db.mark_clip_error(image_id, "db failure")
-                self._record_error(f"DB failure {path}: {exc}")
+        matrix = np.ascontiguousarray(vectors, dtype=np.float32).reshape(len(image_ids), -1)
+        codes, scales = quantize_clip_vectors(matrix)
+        row_nbytes = codes.shape[1] * codes.itemsize
+        buffer = memoryview(codes).cast("B")
+        rows = [
+            (
+                image_id,
+                buffer[index * row_nbytes : (index + 1) * row_nbytes],
+                float(scales[index]),
+            )
+            for index, image_id in enumerate(image_ids)
+        ]
+        self.progress.current_path = paths[-1]
+        try:
+            self.db.store_clip_vectors(self.progress.model_key, rows)
+        except Exception as exc:
+            LOGGER.warning(
+                "Batched CLIP vector store failed (%s); retrying per image", exc
+            )
+            for (image_id, vector_bytes, scale), path in zip(rows, paths):
+                self.progress.current_path = path
+                try:
+                    self.db.store_clip_vector(
+                        image_id, self.progress.model_key, vector_bytes, scale
+                    )
+                except Exception as row_exc:
+                    LOGGER.exception(
+                        "Failed to store CLIP vector for %s: %s", path, row_exc
+                    )
+                    self.db.mark_clip_error(image_id, "db failure")
+                    self._record_error(f"DB failure {path}: {row_exc}")
 
         for img in images:
             try:
@@ -229,6 +333,79 @@ class ClipIndexer(threading.Thread):
         self._refresh_progress()
         return True
 
+    def _release_prefetched(self) -> None:
+        """Hand a prefetched batch's reserved rows back to the queue.
+
+        Without this, rows reserved ahead of a stop or pause would stay
+        ``processing`` (and count as in flight) until the next startup reset.
+        """
+        future, self._next_batch = self._next_batch, None
+        if future is None:
+            return
+        try:
+            prepared = future.result()
+        except Exception as exc:  # pragma: no cover - defensive
+            LOGGER.warning("Prefetched CLIP batch failed: %s", exc)
+            return
+        if prepared is None:
+            return
+        images, image_ids, _ = prepared
+        for img in images:
+            try:
+                img.close()
+            except Exception:  # pragma: no cover - best effort cleanup
+                pass
+        if image_ids:
+            self.db.release_clip_jobs(image_ids)
+        self._refresh_progress()
+
+    def _prepare_batch(self) -> Optional[Tuple[list, list, list[str]]]:
+        """Reserve the next pending batch and decode it; ``None`` when the queue is empty."""
+        batch = self.db.reserve_clip_batch(self.progress.model_key, self.config.clip_batch_size)
+        if not batch:
+            return None
+        self.progress.started_at = self.progress.started_at or time.time()
+        return self._decode_batch(batch)
+
+    def _decode_batch(self, batch) -> Tuple[list, list, list[str]]:
+        """Decode a reserved batch on the decode pool, preserving row order."""
+        pending = []
+        for row in batch:
+            rel_path = row["path"]
+            abs_path = (self.config.root / rel_path) if not Path(rel_path).is_absolute() else Path(rel_path)
+            pending.append((row, abs_path, self._decode_pool.submit(_open_rgb, abs_path)))
+
+        images = []
+        image_ids = []
+        paths: list[str] = []
+        for row, abs_path, future in pending:
+            try:
+                img = future.result()
+            except FileNotFoundError:
+                LOGGER.warning("Missing file for CLIP embedding: %s", abs_path)
+                self.db.mark_clip_error(row["image_id"], "file missing")
+                self._record_error(f"Missing file: {abs_path}")
+                continue
+            except UnidentifiedImageError:
+                LOGGER.warning("Unidentified image for CLIP embedding: %s", abs_path)
+                self.db.mark_clip_error(row["image_id"], "cannot identify image")
+                self._record_error(f"Unidentified image: {abs_path}")
+                continue
+            except OSError as exc:
+                LOGGER.warning("Truncated image for CLIP embedding: %s (%s)", abs_path, exc)
+                self.db.mark_clip_error(row["image_id"], "file truncated")
+                self._record_error(f"Truncated image: {abs_path}")
+                continue
+            except Exception as exc:
+                LOGGER.exception("Error opening %s: %s", abs_path, exc)
+                self.db.mark_clip_error(row["image_id"], str(exc))
+                self._record_error(f"Open error: {abs_path}: {exc}")
+                continue
+            images.append(img)
+            image_ids.append(row["image_id"])
+            paths.append(str(abs_path))
+        return images, image_ids, paths
+
     def _get_model(self):
         if self._model is None:
             self._model = get_clip_model(self.config)
@@ -294,22 +471,101 @@ class _OpenClipModel:
             device=device,
         )
         self._tokenizer = open_clip.get_tokenizer(model_name)
+        # torchvision transforms are stateless, so one pool can serve every batch.
+        self._preprocess_pool = ThreadPoolExecutor(
+            max_workers=os.cpu_count() or 4, thread_name_prefix="clip-preprocess"
+        )
         text_projection = getattr(self._model, "text_projection", None)
         if text_projection is not None and hasattr(text_projection, "shape"):
             self._feature_dim = int(text_projection.shape[1])
         else:
             self._feature_dim = 0
+        self._model.eval()
+        # Pinned staging buffers are per thread: the indexer and upload
+        # handlers share this model and would otherwise overwrite each other's
+        # batch while its asynchronous upload is still reading it.
+        self._pinned = threading.local()
+        # Guards the first compiled call and the switch to eager mode.
+        self._compile_lock = threading.Lock()
+        self._compiled_warm = False
+        self._encode_image = self._compile_image_encoder()
+
+    def _compile_image_encoder(self):
+        """``torch.compile`` the image tower, or return it unchanged when unavailable.
+
+        Compilation is lazy and happens on the first batch (see ``_encode``), so
+        loading the model for a text search never waits for it. Shapes are
+        dynamic so partial tail batches do not recompile, and CUDA graphs
+        ("reduce-overhead") are avoided because the indexer and server threads
+        share this model.
+        """
+        import torch
+
+        eager = self._model.encode_image
+        if not hasattr(torch, "compile"):
+            return eager
+        try:
+            return torch.compile(eager, dynamic=True, fullgraph=False)
+        except Exception as exc:
+            LOGGER.info("torch.compile unavailable for CLIP image encoder, using eager mode: %s", exc)
+            return eager
+
+    def _encode(self, tensors):
+        """Run the image tower, dropping to eager mode if the compiled one fails.
+
+        The indexer and server threads share this model, so the first compiled
+        call (where Dynamo traces) and the switch to eager mode run under
+        ``_compile_lock``; later calls go through without it.
+        """
+        eager = self._model.encode_image
+        encoder = self._encode_image
+        if encoder is not eager and not self._compiled_warm:
+            with self._compile_lock:
+                encoder = self._encode_image
+                if encoder is not eager and not self._compiled_warm:
+                    try:
+                        features = encoder(tensors)
+                    except Exception as exc:
+                        LOGGER.warning(
+                            "Compiled CLIP image encoder failed, using eager mode: %s", exc
+                        )
+                        self._encode_image = eager
+                        return eager(tensors)
+                    self._compiled_warm = True
+                    return features
+        try:
+            return encoder(tensors)
+        except Exception as exc:
+            if encoder is eager:
+                raise
+            with self._compile_lock:
+                if self._encode_image is encoder:
+                    LOGGER.warning(
+                        "Compiled CLIP image encoder failed, using eager mode: %s", exc
+                    )
+                    self._encode_image = eager
+            return eager(tensors)
 
     def compute_image_features(self, images: list[Image.Image]) -> np.ndarray:
         import torch
-        import numpy as np
 
-        tensors = torch.stack([self._preprocess(img) for img in images]).to(self._device)
-        with torch.no_grad():
-            image_features = self._model.encode_image(tensors)
-            image_features /= image_features.norm(dim=-1, keepdim=True)
-        result = image_features.cpu().numpy().astype(np.float32)
-        return result
+        if len(images) > 1:
+            processed = list(self._preprocess_pool.map(self._preprocess, images))
+        else:
+            processed = [self._preprocess(img) for img in images]
+        if str(self._device).startswith("cuda"):
+            # Stack straight into pinned host memory so the upload can be asynchronous.
+            # Reusing this thread's buffer is safe: .cpu() below synchronizes
+            # before we return.
+            staging = self._pinned_buffer(torch, (len(processed), *processed[0].shape))
+            torch.stack(processed, out=staging)
+            tensors = staging.to(self._device, non_blocking=True)
+        else:
+            tensors = torch.stack(processed).to(self._device)
+        with torch.no_grad(), self._autocast(torch):
+            image_features = self._encode(tensors).float()
+            image_features = torch.nn.functional.normalize(image_features, dim=-1)
+        return image_features.cpu().numpy()
 
     def compute_text_features(self, queries: list[str]) -> np.ndarray:
         import torch
@@ -319,10 +575,24 @@ class _OpenClipModel:
             return np.zeros((1, self.feature_dim or 512), dtype=np.float32)
         tokens = self._tokenizer(queries)
         tokens = tokens.to(self._device)
-        with torch.no_grad():
-            text_features = self._model.encode_text(tokens)
-            text_features /= text_features.norm(dim=-1, keepdim=True)
-        return text_features.cpu().numpy().astype(np.float32)
+        with torch.no_grad(), self._autocast(torch):
+            text_features = self._model.encode_text(tokens).float()
+            text_features = torch.nn.functional.normalize(text_features, dim=-1)
+        return text_features.cpu().numpy()
+
+    def _pinned_buffer(self, torch, shape):
+        """Return this thread's pinned host tensor view of ``shape``, growing it as needed."""
+        buffer = getattr(self._pinned, "buffer", None)
+        if buffer is None or buffer.shape[0] < shape[0] or tuple(buffer.shape[1:]) != tuple(shape[1:]):
+            buffer = torch.empty(shape, pin_memory=True)
+            self._pinned.buffer = buffer
+        return buffer[: shape[0]]
+
+    def _autocast(self, torch):
+        """FP16 autocast on CUDA; weights stay fp32 so outputs match the stored vectors."""
+        if str(self._device).startswith("cuda"):
+            return torch.autocast(device_type="cuda", dtype=torch.float16)
+        return contextlib.nullcontext()
 
     @property
     def feature_dim(self) -> int:
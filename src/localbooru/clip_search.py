@@ -1,24 +1,241 @@
 """CLIP similarity search helpers for LocalBooru."""
 from __future__ import annotations
 
+import hashlib
+import json
 import logging
-from typing import Iterable, List, Sequence, Tuple
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 
-from .clip import get_clip_model
+from .clip import decode_clip_vector, get_clip_model
 from .config import LocalBooruConfig
 from .database import LocalBooruDatabase
 
 LOGGER = logging.getLogger(__name__)
 
+_MATRIX_FILES = ("ids", "codes", "scales")
+
+# Rows merged in from deltas before the on-disk copy is rewritten: at least this
+# many, or one eighth of the matrix, whichever is larger.
+_MATRIX_SAVE_MIN_ROWS = 1024
+
+# Rows dequantized at a time when (re)filling the FAISS index.
+_FAISS_ADD_CHUNK = 65536
+
+
+class ClipMatrixCache:
+    """Memory-mapped copy of the int8 CLIP matrix for one model, kept next to the DB.
+
+    The cache is keyed by :meth:`LocalBooruDatabase.clip_matrix_fingerprint`. When it
+    changes, only rows updated since the cached fingerprint are read back and merged
+    in; a full reload from SQLite happens only when the merge does not add up (rows
+    deleted or re-queued). The files on disk are rewritten once enough rows changed.
+    """
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = Path(directory)
+        self._lock = threading.Lock()
+        self._fingerprint: Optional[list] = None
+        self._arrays = None
+        self._unsaved_rows = 0
+        self._faiss_index = None
+
+    @classmethod
+    def for_database(cls, db: LocalBooruDatabase, model: str) -> "ClipMatrixCache":
+        digest = hashlib.sha1(model.encode("utf-8")).hexdigest()[:16]
+        return cls(db.path.with_name(f"{db.path.name}.clip-cache") / digest)
+
+    def load(self, db: LocalBooruDatabase, model: str):
+        """Return ``(ids, codes, scales, legacy_count)`` for the ready int8 vectors."""
+        import numpy as np
+
+        fingerprint = list(db.clip_matrix_fingerprint(model))
+        legacy_count = fingerprint[3]
+        with self._lock:
+            if self._arrays is None:
+                # A stale copy on disk is still a good base for a delta.
+                opened = self._open()
+                if opened is not None:
+                    self._fingerprint, self._arrays = opened
+                    self._faiss_index = None
+            if self._arrays is None or self._fingerprint != fingerprint:
+                merged = None
+                if self._arrays is not None:
+                    merged = self._merge_delta(db, model, fingerprint)
+                if merged is None:
+                    # Drop our own mappings first so the files can be replaced on Windows.
+                    self._arrays = None
+                    self._faiss_index = None
+                    ids, codes, scales = db.load_clip_matrix(model, quantized=True)
+                    if scales is None:
+                        scales = np.empty(0, dtype=np.float32)
+                    self._arrays = self._write(fingerprint, ids, codes, scales)
+                    self._unsaved_rows = 0
+                else:
+                    self._arrays = merged
+                    if self._unsaved_rows >= max(
+                        _MATRIX_SAVE_MIN_ROWS, merged[0].size // 8
+                    ):
+                        self._arrays = self._write(fingerprint, *merged)
+                        self._unsaved_rows = 0
+                self._fingerprint = fingerprint
+            ids, codes, scales = self._arrays
+        return ids, codes, scales, legacy_count
+
+    def faiss_index(self):
+        """Return an exact inner-product FAISS index over the loaded matrix, or ``None``.
+
+        Requires ``faiss`` (the ``faiss`` extra) and a prior :meth:`load`; the index is
+        built once and then kept in step with the merged deltas.
+        """
+        try:
+            import faiss
+        except ImportError:
+            return None
+
+        with self._lock:
+            if self._arrays is None:
+                return None
+            if self._faiss_index is None:
+                ids, codes, scales = self._arrays
+                if not ids.size:
+                    return None
+                index = faiss.IndexIDMap2(faiss.IndexFlatIP(codes.shape[1]))
+                _faiss_add(index, ids, codes, scales)
+                self._faiss_index = index
+            return self._faiss_index
+
+    def _merge_delta(self, db: LocalBooruDatabase, model: str, fingerprint: list):
+        """Fold rows updated since the cached fingerprint into the cached arrays.
+
+        Returns the merged ``(ids, codes, scales)``, or ``None`` when they would not
+        match ``fingerprint`` and the matrix has to be reloaded in full.
+        """
+        import numpy as np
+
+        ids, codes, scales = self._arrays
+        new_ids, new_codes, new_scales = db.load_clip_matrix(
+            model, quantized=True, updated_since=self._fingerprint[1]
+        )
+        if new_ids.size and (not ids.size or new_codes.shape[1] != codes.shape[1]):
+            return None
+        keep = ~np.isin(ids, new_ids)
+        expected_count, expected_sum = fingerprint[0], fingerprint[2]
+        if int(keep.sum()) + new_ids.size != expected_count:
+            # Some cached rows are no longer ready; drop them by id.
+            keep &= np.isin(ids, np.asarray(db.load_clip_ready_ids(model), dtype=np.int64))
+        if (
+            int(keep.sum()) + new_ids.size != expected_count
+            or int(ids[keep].sum()) + int(new_ids.sum()) != expected_sum
+        ):
+            return None
+        if new_scales is None:
+            new_scales = np.empty(0, dtype=np.float32)
+        changed = int(ids.size - keep.sum()) + int(new_ids.size)
+        if self._faiss_index is not None:
+            stale = ids[~keep]
+            if stale.size:
+                self._faiss_index.remove_ids(np.ascontiguousarray(stale, dtype=np.int64))
+            if new_ids.size:
+                _faiss_add(self._faiss_index, new_ids, new_codes, new_scales)
+        self._unsaved_rows += changed
+        if keep.all() and not new_ids.size:
+            return ids, codes, scales
+        return (
+            np.concatenate([ids[keep], new_ids]),
+            np.concatenate([codes[keep], new_codes]),
+            np.concatenate([scales[keep], new_scales]),
+        )
+
+    def _open(self):
+        """Return ``(fingerprint, arrays)`` from the on-disk copy, or ``None``."""
+        import numpy as np
+
+        try:
+            with open(self.directory / "fingerprint.json", "r", encoding="utf-8") as handle:
+                fingerprint = json.load(handle)
+            arrays = tuple(
+                np.load(self.directory / f"{name}.npy", mmap_mode="r")
+                for name in _MATRIX_FILES
+            )
+        except (OSError, ValueError):
+            return None
+        if not isinstance(fingerprint, list) or len(fingerprint) != 4:
+            return None
+        return fingerprint, arrays
+
+    def _write(self, fingerprint: list, ids, codes, scales):
+        import numpy as np
+
+        arrays = (ids, codes, scales)
+        if not ids.size:
+            return arrays
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            marker = self.directory / "fingerprint.json"
+            if marker.exists():
+                marker.unlink()
+            for name, array in zip(_MATRIX_FILES, arrays):
+                tmp_path = self.directory / f"{name}.tmp.npy"
+                np.save(tmp_path, array)
+                os.replace(tmp_path, self.directory / f"{name}.npy")
+            with open(marker, "w", encoding="utf-8") as handle:
+                json.dump(fingerprint, handle)
+            return tuple(
+                np.load(self.directory / f"{name}.npy", mmap_mode="r")
+                for name in _MATRIX_FILES
+            )
+        except (OSError, ValueError) as exc:
+            LOGGER.warning("Could not write CLIP matrix cache in %s: %s", self.directory, exc)
+            return arrays
+
+
+def _faiss_add(index, ids, codes, scales) -> None:
+    """Dequantize and add rows in chunks instead of materializing one float32 copy."""
+    import numpy as np
+
+    for start in range(0, ids.size, _FAISS_ADD_CHUNK):
+        stop = start + _FAISS_ADD_CHUNK
+        matrix = np.ascontiguousarray(
+            codes[start:stop].astype(np.float32) * scales[start:stop, None],
+            dtype=np.float32,
+        )
+        index.add_with_ids(matrix, np.ascontiguousarray(ids[start:stop], dtype=np.int64))
+
+
+_MATRIX_CACHES: Dict[Tuple[Path, str], ClipMatrixCache] = {}
+_MATRIX_CACHES_LOCK = threading.Lock()
+
+
+def get_clip_matrix_cache(db: LocalBooruDatabase, model: str) -> ClipMatrixCache:
+    key = (db.path, model)
+    with _MATRIX_CACHES_LOCK:
+        cache = _MATRIX_CACHES.get(key)
+        if cache is None:
+            cache = ClipMatrixCache.for_database(db, model)
+            _MATRIX_CACHES[key] = cache
+    return cache
+
 
 def _normalize_ids(values: Sequence[int | str]) -> List[int]:
     normalized: List[int] = []
     for value in values:
+        if isinstance(value, int):
+            normalized.append(int(value))
+            continue
+        if isinstance(value, str):
+            text = value.strip()
+            digits = text[1:] if text[:1] in ("+", "-") else text
+            if digits.isdecimal():
+                normalized.append(int(text))
+            continue
+        # Rare non-int/str inputs (e.g. floats) keep the int() coercion.
         try:
-            num = int(value)  # type: ignore[arg-type]
+            normalized.append(int(value))  # type: ignore[arg-type]
         except (TypeError, ValueError):
             continue
-        normalized.append(num)
     return normalized
 
 
@@ -71,14 +288,20 @@ def perform_clip_search(
         if getattr(neg_features, "size", 0):
             vectors_negative.append(neg_features.mean(axis=0))
 
+    reference_vectors = (
+        db.fetch_clip_vectors(positive_ids + negative_ids, config.clip_model_key)
+        if positive_ids or negative_ids
+        else {}
+    )
+
     if positive_ids:
         pos_vectors: List[np.ndarray] = []
         for image_id in positive_ids:
-            blob = db.fetch_clip_vector(image_id, config.clip_model_key)
-            if not blob:
+            record = reference_vectors.get(image_id)
+            if not record or not record[0]:
                 LOGGER.debug("No CLIP vector for image %s", image_id)
                 continue
-            vec = np.frombuffer(blob, dtype=np.float32)
+            vec = decode_clip_vector(*record)
             if vec.size:
                 pos_vectors.append(vec)
         if pos_vectors:
@@ -99,10 +322,10 @@ def perform_clip_search(
     if negative_ids:
         neg_vectors: List[np.ndarray] = []
         for image_id in negative_ids:
-            blob = db.fetch_clip_vector(image_id, config.clip_model_key)
-            if not blob:
+            record = reference_vectors.get(image_id)
+            if not record or not record[0]:
                 continue
-            vec = np.frombuffer(blob, dtype=np.float32)
+            vec = decode_clip_vector(*record)
             if vec.size:
                 neg_vectors.append(vec)
         if neg_vectors:
@@ -126,37 +349,57 @@ def perform_clip_search(
     feature_dim = model.feature_dim
 
     combination = np.zeros(feature_dim, dtype=np.float32)
-    if vectors_positive:
-        combination += np.sum(np.stack(vectors_positive, axis=0), axis=0)
-    if vectors_negative:
-        combination -= np.sum(np.stack(vectors_negative, axis=0), axis=0)
+    for vector in vectors_positive:
+        combination += vector
+    for vector in vectors_negative:
+        combination -= vector
 
     norm = np.linalg.norm(combination)
     if not np.isfinite(norm) or norm == 0:
         return []
     combination /= norm
 
-    allowed_ids = set(int(i) for i in restrict_to_ids) if restrict_to_ids is not None else None
-
-    image_ids: List[int] = []
-    matrix: List[np.ndarray] = []
-    for image_id, blob in db.iter_clip_vectors(config.clip_model_key):
-        image_id = int(image_id)
-        if allowed_ids is not None and image_id not in allowed_ids:
-            continue
-        vec = np.frombuffer(blob, dtype=np.float32)
-        if vec.size == 0:
-            continue
-        matrix.append(vec)
-        image_ids.append(image_id)
+    allowed_ids = [int(i) for i in restrict_to_ids] if restrict_to_ids is not None else None
 
-    if not matrix:
+    # int8 rows are scored without dequantizing; legacy float32 rows (NULL scale)
+    # are scored separately and the two score vectors concatenated.
+    cache = get_clip_matrix_cache(db, config.clip_model_key)
+    quant_ids, codes, scales, legacy_count = cache.load(db, config.clip_model_key)
+    if allowed_ids is None and legacy_count == 0 and quant_ids.size:
+        index = cache.faiss_index()
+        if index is not None:
+            k = limit if limit and 0 < limit < quant_ids.size else int(quant_ids.size)
+            distances, labels = index.search(combination[None, :].astype(np.float32), k)
+            return [
+                (int(image_id), float(score))
+                for image_id, score in zip(labels[0], distances[0])
+                if image_id >= 0
+            ]
+    if allowed_ids is not None:
+        allowed_arr = np.unique(np.fromiter(allowed_ids, dtype=np.int64))
+        mask = np.isin(quant_ids, allowed_arr, assume_unique=True)
+        quant_ids, codes, scales = quant_ids[mask], codes[mask], scales[mask]
+    if legacy_count == 0:
+        float_ids = np.empty(0, dtype=np.int64)
+        float_matrix = np.empty((0, 0), dtype=np.float32)
+    else:
+        float_ids, float_matrix, _ = db.load_clip_matrix(
+            config.clip_model_key, allowed_ids, quantized=False
+        )
+    if not quant_ids.size and not float_ids.size:
         return []
 
-    matrix_np = np.stack(matrix)
-    scores = matrix_np @ combination
-    order = np.argsort(scores)[::-1]
-    if limit and limit > 0:
-        order = order[:limit]
+    score_parts: List[np.ndarray] = []
+    if quant_ids.size:
+        score_parts.append((codes @ combination) * scales)
+    if float_ids.size:
+        score_parts.append(float_matrix @ combination)
+    scores = np.concatenate(score_parts)
+    image_ids = np.concatenate([quant_ids, float_ids]).tolist()
+    if limit and 0 < limit < len(scores):
+        order = np.argpartition(-scores, limit)[:limit]
+        order = order[np.argsort(-scores[order], kind="stable")]
+    else:
+        order = np.argsort(scores)[::-1]
     results = [(image_ids[i], float(scores[i])) for i in order]
     return results
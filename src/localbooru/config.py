@@ -2,9 +2,11 @@
 
 from __future__ import annotations
 
+import functools
 import json
 import os
 from dataclasses import dataclass, field
+from enum import Enum
 from pathlib import Path
 from textwrap import dedent
 from typing import Any, Mapping, Optional
@@ -12,16 +14,54 @@ from typing import Any, Mapping, Optional
 
 def _default_state_dir() -> Path:
     state_root = Path(
-        os.getenv("XDG_STATE_HOME", Path.home() / ".local" / "state")
+        os.getenv("XDG_STATE_HOME") or Path.home() / ".local" / "state"
     ).expanduser()
     return (state_root / "localbooru").resolve()
 
 
 def _default_cache_dir() -> Path:
-    cache_root = Path(os.getenv("XDG_CACHE_HOME", Path.home() / ".cache")).expanduser()
+    return _resolve_cache_dir(os.getenv("XDG_CACHE_HOME"), os.getenv("HOME"))
+
+
+@functools.lru_cache(maxsize=8)
+def _resolve_cache_dir(xdg_cache_home: Optional[str], home: Optional[str]) -> Path:
+    # Keyed on the inputs so environment changes (tests, service reloads) still apply.
+    # Path.home() is only consulted when neither variable is set.
+    if xdg_cache_home:
+        cache_root = Path(xdg_cache_home).expanduser()
+    else:
+        cache_root = (Path(home) if home else Path.home()) / ".cache"
     return (cache_root / "localbooru" / "thumbs").resolve()
 
 
+def _real_path(value: str | os.PathLike[str]) -> Path:
+    """``Path(value).expanduser().resolve()`` via the C-level ``os.path`` helpers."""
+    return Path(os.path.realpath(os.path.expanduser(value)))
+
+
+class AutoTagMode(str, Enum):
+    """How WD14 tags combine with embedded metadata tags."""
+
+    MISSING = "missing"
+    AUGMENT = "augment"
+
+    @classmethod
+    def parse(cls, value: Any) -> "AutoTagMode":
+        # Anything unrecognised gets the conservative behaviour, so a typo in
+        # a config file does not queue auto-tag jobs for every changed image.
+        if isinstance(value, cls):
+            return value
+        try:
+            return cls(str(value).lower())
+        except ValueError:
+            return cls.MISSING
+
+
+def _positive_int(value: Any) -> int:
+    number = int(value)
+    return number if number > 0 else 1
+
+
 def load_config_file(config_path: Path) -> Mapping[str, Any]:
     config_path = config_path.expanduser().resolve()
     if not config_path.exists():
@@ -53,7 +93,7 @@ def load_config_file(config_path: Path) -> Mapping[str, Any]:
     return json.loads(config_path.read_text(encoding="utf-8"))
 
 
-@dataclass
+@dataclass(frozen=True)
 class LocalBooruConfig:
     root: Path
     db_path: Path
@@ -73,35 +113,42 @@ class LocalBooruConfig:
     auto_tag_model: str = "ConvNextV2"
     auto_tag_general_threshold: float = 0.35
     auto_tag_character_threshold: float = 0.85
-    auto_tag_mode: str = "augment"
+    auto_tag_mode: AutoTagMode = AutoTagMode.AUGMENT
     auto_tag_background: bool = True
     auto_tag_batch_size: int = 4
     webview: bool = False
     no_ui: bool = False
     log_level: str = "INFO"
-    extra_roots: list[Path] = field(default_factory=list)
+    extra_roots: tuple[Path, ...] = ()
     config_file: Optional[Path] = None
     service_mode: bool = False
-    image_patterns: list[str] = field(
-        default_factory=lambda: [
-            "*.png",
-            "*.PNG",
-            "*.jpg",
-            "*.JPG",
-            "*.jpeg",
-            "*.JPEG",
-            "*.webp",
-            "*.WEBP",
-            "*.gif",
-            "*.GIF",
-            "*.bmp",
-            "*.BMP",
-            "*.tiff",
-            "*.TIFF",
-            "*.tga",
-            "*.TGA",
-        ]
+    image_patterns: tuple[str, ...] = (
+        "*.png",
+        "*.PNG",
+        "*.jpg",
+        "*.JPG",
+        "*.jpeg",
+        "*.JPEG",
+        "*.webp",
+        "*.WEBP",
+        "*.gif",
+        "*.GIF",
+        "*.bmp",
+        "*.BMP",
+        "*.tiff",
+        "*.TIFF",
+        "*.tga",
+        "*.TGA",
     )
+    clip_model_key: str = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        # Frozen dataclass: derived values are written once through object.__setattr__.
+        object.__setattr__(
+            self, "clip_model_key", f"{self.clip_model_name}:{self.clip_checkpoint}"
+        )
+        # Direct construction may pass the mode as a plain string.
+        object.__setattr__(self, "auto_tag_mode", AutoTagMode.parse(self.auto_tag_mode))
 
     @classmethod
     def from_sources(
@@ -162,7 +209,7 @@ class LocalBooruConfig:
         cli_root = getattr(args, "root", None)
         root_path: Path
         if cli_root:
-            root_path = Path(cli_root).expanduser().resolve()
+            root_path = _real_path(cli_root)
         elif config_primary:
             root_path = resolve_config_path(config_primary)
         else:
@@ -181,7 +228,7 @@ class LocalBooruConfig:
                 extra_paths.append(path)
                 seen_paths.add(path)
         for value in getattr(args, "extra_root", []) or []:
-            path = Path(value).expanduser().resolve()
+            path = _real_path(value)
             if path not in seen_paths:
                 extra_paths.append(path)
                 seen_paths.add(path)
@@ -189,9 +236,9 @@ class LocalBooruConfig:
         db_cli = getattr(args, "db", None)
         db_option = option("db_path", "db", "database")
         if db_cli:
-            db_path = Path(db_cli).expanduser().resolve()
+            db_path = _real_path(db_cli)
         elif db_option:
-            db_path = Path(str(db_option)).expanduser().resolve()
+            db_path = _real_path(str(db_option))
         elif file_options is not None:
             db_path = (_default_state_dir() / "gallery.db").resolve()
         else:
@@ -200,19 +247,17 @@ class LocalBooruConfig:
         thumb_cli = getattr(args, "thumb_cache", None)
         thumb_option = option("thumb_cache", "thumbnail_cache")
         if thumb_cli:
-            thumb_cache = Path(thumb_cli).expanduser().resolve()
+            thumb_cache = _real_path(thumb_cli)
         elif thumb_option:
-            thumb_cache = Path(str(thumb_option)).expanduser().resolve()
+            thumb_cache = _real_path(str(thumb_option))
         else:
             thumb_cache = _default_cache_dir()
 
-        auto_tag_missing = getattr(args, "auto_tag_missing", None)
-        if auto_tag_missing is None:
-            auto_tag_missing = bool(option("auto_tag_missing", default=True))
-
-        auto_tag_background = getattr(args, "auto_tag_background", None)
-        if auto_tag_background is None:
-            auto_tag_background = bool(option("auto_tag_background", default=True))
+        # On/off flag pairs leave None when neither flag was passed.
+        auto_tag_missing, auto_tag_background = (
+            bool(resolve(name, default=True))
+            for name in ("auto_tag_missing", "auto_tag_background")
+        )
 
         webview = getattr(args, "webview", False)
         webview_option = option("webview")
@@ -239,7 +284,7 @@ class LocalBooruConfig:
         host_value = str(resolve("host", default="127.0.0.1"))
         port_value = int(resolve("port", default=8000))
         clip_device_value = str(resolve("clip_device", default="cpu"))
-        clip_batch_size_value = int(resolve("clip_batch_size", default=8))
+        clip_batch_size_value = _positive_int(resolve("clip_batch_size", default=8))
         clip_model_name_value = str(
             resolve("clip_model_name", default="ViT-B-32-quickgelu")
         )
@@ -251,37 +296,20 @@ class LocalBooruConfig:
         auto_tag_character_threshold_value = float(
             resolve("auto_tag_character_threshold", default=0.85)
         )
-        auto_tag_mode_value = str(
+        auto_tag_mode_value = AutoTagMode.parse(
             resolve("auto_tag_mode", default="augment") or "augment"
-        ).lower()
-        auto_tag_batch_size_value = max(
-            1, int(resolve("auto_tag_batch_size", default=4))
+        )
+        auto_tag_batch_size_value = _positive_int(
+            resolve("auto_tag_batch_size", default=4)
         )
         log_level_value = str(resolve("log_level", default="INFO")).upper()
 
         # Handle image patterns configuration
         patterns_option = option("image_patterns", "supported_formats", default=None)
         if patterns_option and isinstance(patterns_option, (list, tuple)):
-            image_patterns_value = [str(p) for p in patterns_option if p]
+            image_patterns_value = tuple(str(p) for p in patterns_option if p)
         else:
-            image_patterns_value = [
-                "*.png",
-                "*.PNG",
-                "*.jpg",
-                "*.JPG",
-                "*.jpeg",
-                "*.JPEG",
-                "*.webp",
-                "*.WEBP",
-                "*.gif",
-                "*.GIF",
-                "*.bmp",
-                "*.BMP",
-                "*.tiff",
-                "*.TIFF",
-                "*.tga",
-                "*.TGA",
-            ]
+            image_patterns_value = cls.image_patterns
 
         return cls(
             root=root_path,
@@ -316,16 +344,12 @@ class LocalBooruConfig:
             webview=bool(webview),
             no_ui=bool(no_ui or option("no_ui", default=False)),
             log_level=log_level_value,
-            extra_roots=extra_paths,
+            extra_roots=tuple(extra_paths),
             config_file=config_path,
             service_mode=service_mode,
             image_patterns=image_patterns_value,
         )
 
-    @property
-    def clip_model_key(self) -> str:
-        return f"{self.clip_model_name}:{self.clip_checkpoint}"
-
     @property
     def roots(self) -> list[Path]:
         return [self.root, *self.extra_roots]
@@ -343,74 +367,77 @@ class LocalBooruConfig:
         return 600
 
 
+_DEFAULT_CONFIG_TEMPLATE = dedent(
+    """\
+    # LocalBooru configuration template
+    # Save as ~/.localbooru.toml or point --config / LOCALBOORU_CONFIG here.
+
+    # --- Filesystem roots --------------------------------------------------
+    # Primary NovelAI directory (required).
+    root = "/path/to/novelai"
+
+    # Optional additional directories to index alongside the primary root.
+    # You can also replace `root` entirely with an ordered `roots = [...]` list.
+    extra_roots = []  # e.g. ["/srv/archives/novelai-b"]
+
+    # --- Storage paths -----------------------------------------------------
+    # SQLite database for image metadata. Default follows XDG_STATE_HOME.
+    db_path = "{state_db}"
+    # Thumbnail cache directory (XDG_CACHE_HOME/localbooru/thumbs by default).
+    thumb_cache = "{thumb_cache}"
+    thumb_size = 512
+    no_thumbs = false
+
+    # --- Watch/service behaviour ------------------------------------------
+    watch = false
+    rescan_interval = 600  # seconds; set 0 to rely solely on watchdog events
+    service = false
+
+    # --- HTTP server & UI --------------------------------------------------
+    host = "127.0.0.1"
+    port = 8000
+    no_ui = false
+    webview = false
+    log_level = "INFO"
+
+    # --- CLIP indexer ------------------------------------------------------
+    clip_enabled = true
+    clip_device = "cpu"  # change to "cuda" or "mps" if your torch build supports it
+    clip_batch_size = 8
+    clip_model_name = "ViT-B-32-quickgelu"
+    clip_checkpoint = "openai"
+
+    # --- Auto-tagging ------------------------------------------------------
+    auto_tag_missing = true
+    auto_tag_background = true
+    auto_tag_mode = "augment"  # or "missing"
+    auto_tag_model = "ConvNextV2"
+    auto_tag_general_threshold = 0.35
+    auto_tag_character_threshold = 0.85
+    auto_tag_batch_size = 4
+
+    # --- Supported image formats ------------------------------------------
+    # Customize which image file types to scan and index
+    image_patterns = [
+        "*.png", "*.PNG",           # Primary: NovelAI PNGs with metadata
+        "*.jpg", "*.JPG",           # JPEG formats
+        "*.jpeg", "*.JPEG",         # Alternative JPEG extension
+        "*.webp", "*.WEBP",         # Modern WebP format
+        "*.gif", "*.GIF",           # GIF format
+        "*.bmp", "*.BMP",           # Bitmap format
+        "*.tiff", "*.TIFF",         # TIFF format
+        "*.tga", "*.TGA",           # TGA format
+    ]
+
+    # Install extras:
+    #   pip install localbooru[clip,tagging,watch,ui]
+    # watcher support falls back to interval scans when `watchdog` is missing.
+    """
+)
+
+
 def render_default_config_template() -> str:
     """Return an annotated TOML configuration template."""
     state_db = (_default_state_dir() / "gallery.db").expanduser()
     thumb_cache = _default_cache_dir().expanduser()
-    return dedent(
-        f"""\
-        # LocalBooru configuration template
-        # Save as ~/.localbooru.toml or point --config / LOCALBOORU_CONFIG here.
-
-        # --- Filesystem roots --------------------------------------------------
-        # Primary NovelAI directory (required).
-        root = "/path/to/novelai"
-
-        # Optional additional directories to index alongside the primary root.
-        # You can also replace `root` entirely with an ordered `roots = [...]` list.
-        extra_roots = []  # e.g. ["/srv/archives/novelai-b"]
-
-        # --- Storage paths -----------------------------------------------------
-        # SQLite database for image metadata. Default follows XDG_STATE_HOME.
-        db_path = "{state_db}"
-        # Thumbnail cache directory (XDG_CACHE_HOME/localbooru/thumbs by default).
-        thumb_cache = "{thumb_cache}"
-        thumb_size = 512
-        no_thumbs = false
-
-        # --- Watch/service behaviour ------------------------------------------
-        watch = false
-        rescan_interval = 600  # seconds; set 0 to rely solely on watchdog events
-        service = false
-
-        # --- HTTP server & UI --------------------------------------------------
-        host = "127.0.0.1"
-        port = 8000
-        no_ui = false
-        webview = false
-        log_level = "INFO"
-
-        # --- CLIP indexer ------------------------------------------------------
-        clip_enabled = true
-        clip_device = "cpu"  # change to "cuda" or "mps" if your torch build supports it
-        clip_batch_size = 8
-        clip_model_name = "ViT-B-32-quickgelu"
-        clip_checkpoint = "openai"
-
-        # --- Auto-tagging ------------------------------------------------------
-        auto_tag_missing = true
-        auto_tag_background = true
-        auto_tag_mode = "augment"  # or "missing"
-        auto_tag_model = "ConvNextV2"
-        auto_tag_general_threshold = 0.35
-        auto_tag_character_threshold = 0.85
-        auto_tag_batch_size = 4
-
-        # --- Supported image formats ------------------------------------------
-        # Customize which image file types to scan and index
-        image_patterns = [
-            "*.png", "*.PNG",           # Primary: NovelAI PNGs with metadata
-            "*.jpg", "*.JPG",           # JPEG formats
-            "*.jpeg", "*.JPEG",         # Alternative JPEG extension
-            "*.webp", "*.WEBP",         # Modern WebP format
-            "*.gif", "*.GIF",           # GIF format
-            "*.bmp", "*.BMP",           # Bitmap format
-            "*.tiff", "*.TIFF",         # TIFF format
-            "*.tga", "*.TGA",           # TGA format
-        ]
-
-        # Install extras:
-        #   pip install localbooru[clip,tagging,watch,ui]
-        # watcher support falls back to interval scans when `watchdog` is missing.
-        """
-    )
+    return _DEFAULT_CONFIG_TEMPLATE.format(state_db=state_db, thumb_cache=thumb_cache)
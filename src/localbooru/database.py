@@ -4,22 +4,63 @@ from __future__ import annotations
 
 import json
 import logging
+import os
 import sqlite3
+import threading
 import time
-from contextlib import closing
+from contextlib import closing, contextmanager
 from pathlib import Path
-from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
 
 from .tags import TagRecord
 
+# sqlite3 binds any buffer as a BLOB, so callers may pass views into a larger
+# array instead of copying each vector out to ``bytes`` first.
+BlobLike = Union[bytes, memoryview]
+
 LOGGER = logging.getLogger(__name__)
 
 BUSY_TIMEOUT_MS = 5000
 
+# Applied to every connection; these settings are per-connection in SQLite.
+# synchronous=NORMAL under WAL can lose the last commits on an OS crash or
+# power loss, never on an application crash, and the database stays consistent.
+CONNECTION_PRAGMAS = (
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-65536",
+)
+
+# Room for every fixed SQL string the ingest and worker loops cycle through,
+# so they stay prepared instead of being evicted by one-off queries.
+STATEMENT_CACHE_SIZE = 256
+
+# UPDATE ... RETURNING lets queue reservations claim rows in one statement.
+_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# Bump when _migrate_schema gains a step; stored in PRAGMA user_version so
+# the column probes and backfills run once per database, not on every start.
+SCHEMA_VERSION = 5
+
 SCHEMA_STATEMENTS = [
     "PRAGMA journal_mode=WAL;",
-    "PRAGMA synchronous=NORMAL;",
-    "PRAGMA foreign_keys = ON;",
+    # Small key/value state that must not live in PRAGMA user_version.
+    "CREATE TABLE IF NOT EXISTS localbooru_meta (\n"
+    "    key TEXT PRIMARY KEY,\n"
+    "    value TEXT NOT NULL\n"
+    ");",
     "CREATE TABLE IF NOT EXISTS images (\n"
     "    id INTEGER PRIMARY KEY,\n"
     "    path TEXT UNIQUE NOT NULL,\n"
@@ -46,16 +87,20 @@ SCHEMA_STATEMENTS = [
     "    source TEXT NOT NULL DEFAULT 'embedded',\n"
     "    FOREIGN KEY(image_id) REFERENCES images(id) ON DELETE CASCADE\n"
     ");",
-    "CREATE INDEX IF NOT EXISTS tags_kind_norm_idx ON tags(kind, norm);",
     "CREATE INDEX IF NOT EXISTS tags_kind_norm_image_idx ON tags(kind, norm, image_id);",
     "CREATE INDEX IF NOT EXISTS tags_image_id_idx ON tags(image_id);",
     "CREATE INDEX IF NOT EXISTS tags_facets_idx ON tags(image_id, norm, kind, tag);",
     "CREATE INDEX IF NOT EXISTS images_mtime_id_idx ON images(mtime DESC, id DESC);",
+    # Only auto-tagger rows: serves load_auto_tagged_ids/has_auto_tags without
+    # scanning every tag, and costs nothing on embedded-tag writes.
+    "CREATE INDEX IF NOT EXISTS tags_auto_image_idx ON tags(image_id, source) WHERE source='auto';",
     "CREATE VIRTUAL TABLE IF NOT EXISTS tag_index USING fts5(\n"
     "    norm,\n"
     "    tag,\n"
     "    kind UNINDEXED,\n"
     "    image_id UNINDEXED,\n"
+    "    content='tags',\n"
+    "    content_rowid='id',\n"
     "    tokenize=\"unicode61 tokenchars '_.:-'\"\n"
     ");",
     "CREATE TABLE IF NOT EXISTS clip_embeddings (\n"
@@ -63,6 +108,7 @@ SCHEMA_STATEMENTS = [
     "    model TEXT NOT NULL,\n"
     "    status TEXT NOT NULL,\n"
     "    vector BLOB,\n"
+    "    vector_scale REAL,\n"
     "    error TEXT,\n"
     "    queued_at REAL NOT NULL,\n"
     "    updated_at REAL NOT NULL,\n"
@@ -89,6 +135,23 @@ SCHEMA_STATEMENTS = [
     "    updated_at REAL NOT NULL,\n"
     "    FOREIGN KEY(image_id) REFERENCES images(id) ON DELETE CASCADE\n"
     ");",
+    # Partial index over the clip queue: only pending rows are indexed, so
+    # reservations walk queued_at order without sorting the whole table.
+    "CREATE INDEX IF NOT EXISTS clip_pending_idx ON clip_embeddings(model, queued_at) WHERE status='pending';",
+    # Progress counters aggregate status per model; these let them scan a
+    # narrow index instead of table pages that also carry the vector blobs.
+    # (status, queued_at) also serves the auto-tag reservation walk in order.
+    # clip_ready_idx is created in _migrate_schema, once vector_scale exists.
+    "CREATE INDEX IF NOT EXISTS auto_tag_status_idx ON auto_tag_jobs(status, queued_at);",
+    # Queue position for the detail view counts pending rows queued earlier;
+    # with this index that is a covering range scan that stops at the image.
+    "CREATE INDEX IF NOT EXISTS rating_status_idx ON rating_jobs(status, queued_at);",
+]
+
+# Trigger definitions are replaced only from _migrate_schema: re-creating them
+# on every start would bump the schema cookie and force every other open
+# connection to re-prepare its statements.
+TRIGGER_STATEMENTS = [
     "DROP TRIGGER IF EXISTS tags_ai;",
     "DROP TRIGGER IF EXISTS tags_ad;",
     "DROP TRIGGER IF EXISTS tags_au;",
@@ -96,25 +159,86 @@ SCHEMA_STATEMENTS = [
     "    INSERT INTO tag_index(rowid, norm, tag, kind, image_id)\n"
     "    VALUES (new.id, new.norm, new.tag, new.kind, new.image_id);\n"
     "END;",
+    # tag_index is external-content over tags: a 'delete' must replay the old
+    # indexed values, and only norm/tag edits change the tokens at all.
     "CREATE TRIGGER IF NOT EXISTS tags_ad AFTER DELETE ON tags BEGIN\n"
-    "    DELETE FROM tag_index WHERE rowid = old.id;\n"
+    "    INSERT INTO tag_index(tag_index, rowid, norm, tag, kind, image_id)\n"
+    "    VALUES ('delete', old.id, old.norm, old.tag, old.kind, old.image_id);\n"
     "END;",
-    "CREATE TRIGGER IF NOT EXISTS tags_au AFTER UPDATE ON tags BEGIN\n"
-    "    DELETE FROM tag_index WHERE rowid = old.id;\n"
+    "CREATE TRIGGER IF NOT EXISTS tags_au AFTER UPDATE OF norm, tag ON tags BEGIN\n"
+    "    INSERT INTO tag_index(tag_index, rowid, norm, tag, kind, image_id)\n"
+    "    VALUES ('delete', old.id, old.norm, old.tag, old.kind, old.image_id);\n"
     "    INSERT INTO tag_index(rowid, norm, tag, kind, image_id)\n"
     "    VALUES (new.id, new.norm, new.tag, new.kind, new.image_id);\n"
     "END;",
 ]
 
 
+# localbooru_meta key holding the pid of a process inside bulk_import(); while
+# set, the tag_index sync triggers are intentionally absent.
+BULK_IMPORT_KEY = "bulk_import_pid"
+
+
+def _process_alive(pid: int) -> bool:
+    """Best-effort check that ``pid`` still names a running process."""
+    if pid <= 0:
+        return False
+    if pid == os.getpid():
+        return True
+    if os.name == "nt":  # pragma: no cover - Windows only
+        import ctypes
+
+        # os.kill(pid, 0) would terminate the process on Windows.
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)
+        if not handle:
+            return False
+        ctypes.windll.kernel32.CloseHandle(handle)
+        return True
+    try:
+        os.kill(pid, 0)
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
 class LocalBooruDatabase:
     def __init__(self, path: str | Path) -> None:
         self.path = Path(path)
         self._connection = self.new_connection()
+        # path -> id, loaded on the first upsert; entries may go stale when rows
+        # are deleted elsewhere, so writes verify them (see upsert_image_record).
+        self._path_to_id: Optional[Dict[str, int]] = None
+        # Background workers share one lazily opened writer connection instead
+        # of opening (and re-parsing the schema on) a new one per write.
+        self._writer: Optional[sqlite3.Connection] = None
+        self._write_lock = threading.Lock()
+        # batch() runs on its own connection so commits made by other threads
+        # on the main connection cannot end it early; the lock admits one
+        # batch at a time and the thread-local marks its owner.
+        self._batch_connection: Optional[sqlite3.Connection] = None
+        self._batch_lock = threading.Lock()
+        self._batch_state = threading.local()
         self._ensure_schema()
         self._ensure_tag_index_schema()
 
     def close(self) -> None:
+        try:
+            # Refresh planner statistics so the partial queue indexes get used;
+            # analysis_limit bounds the per-index sampling on large tables.
+            self._connection.execute("PRAGMA analysis_limit=400")
+            self._connection.execute("PRAGMA optimize")
+        except sqlite3.Error:
+            LOGGER.debug("PRAGMA optimize failed", exc_info=True)
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        with self._batch_lock:
+            if self._batch_connection is not None:
+                self._batch_connection.close()
+                self._batch_connection = None
         self._connection.close()
 
     @property
@@ -129,61 +253,228 @@ class LocalBooruDatabase:
             self.path,
             check_same_thread=False,
             timeout=max(BUSY_TIMEOUT_MS / 1000.0, 5.0),
+            cached_statements=STATEMENT_CACHE_SIZE,
         )
         self._configure_connection(conn)
         return conn
 
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """Group the calling thread's writes into one transaction.
+
+        The block runs on a dedicated connection: the calling thread's reads
+        and writes go through it, each write method in its own savepoint so a
+        failing call only undoes itself, and the commit (and WAL sync) happens
+        once on exit. Other threads keep using the main connection and wait on
+        SQLite's write lock meanwhile, so do no slow work inside the block.
+        """
+        if self._in_batch():
+            yield
+            return
+        with self._batch_lock:
+            if self._batch_connection is None:
+                self._batch_connection = self.new_connection()
+            conn = self._batch_connection
+            conn.execute("BEGIN IMMEDIATE")
+            self._batch_state.connection = conn
+            try:
+                yield
+            except BaseException:
+                self._batch_state.connection = None
+                conn.rollback()
+                raise
+            self._batch_state.connection = None
+            conn.commit()
+
+    @contextmanager
+    def bulk_import(self) -> Iterator[None]:
+        """Suspend incremental tag_index upkeep while loading many tags.
+
+        The sync triggers are dropped for the duration and the FTS index is
+        rebuilt in a single pass on exit, which is far cheaper than one FTS
+        write per tag row. A ``localbooru_meta`` marker records the importing
+        process meanwhile: other opens leave the triggers alone while it runs,
+        and the first open after it died restores them and rebuilds.
+        Tag searches do not see rows written inside the block until it exits.
+        """
+        with self._connection:
+            for name in ("tags_ai", "tags_ad", "tags_au"):
+                self._connection.execute(f"DROP TRIGGER IF EXISTS {name}")
+            self._connection.execute(
+                "INSERT OR REPLACE INTO localbooru_meta(key, value) VALUES (?, ?)",
+                (BULK_IMPORT_KEY, str(os.getpid())),
+            )
+        try:
+            yield
+        finally:
+            with self._connection, closing(self._connection.cursor()) as cur:
+                self._restore_tag_triggers(cur)
+
+    def has_images(self) -> bool:
+        row = self._connection.execute(
+            "SELECT EXISTS(SELECT 1 FROM images)"
+        ).fetchone()
+        return bool(row[0])
+
+    def _tuple_cursor(self) -> sqlite3.Cursor:
+        """Cursor on the calling thread's connection yielding plain tuples.
+
+        Bulk readers unpack rows positionally; skipping ``sqlite3.Row``
+        construction keeps per-row overhead down on large tables.
+        """
+        cur = self._conn().cursor()
+        cur.row_factory = None
+        return cur
+
+    def _in_batch(self) -> bool:
+        return getattr(self._batch_state, "connection", None) is not None
+
+    def _conn(self) -> sqlite3.Connection:
+        """The calling thread's open batch() connection, else the main one."""
+        return getattr(self._batch_state, "connection", None) or self._connection
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Commit on exit, or just scope a savepoint inside an open batch()."""
+        conn = self._conn()
+        if conn is self._connection:
+            with conn:
+                yield conn
+            return
+        conn.execute("SAVEPOINT batch_item")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK TO batch_item")
+            conn.execute("RELEASE batch_item")
+            raise
+        conn.execute("RELEASE batch_item")
+
+    @contextmanager
+    def _writer_transaction(self) -> Iterator[sqlite3.Connection]:
+        """Run one transaction on the shared background writer connection."""
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = self.new_connection()
+            conn = self._writer
+            with conn:
+                yield conn
+
     def _configure_connection(self, conn: sqlite3.Connection) -> None:
         conn.row_factory = sqlite3.Row
         try:
             conn.execute(f"PRAGMA busy_timeout={int(BUSY_TIMEOUT_MS)}")
         except sqlite3.Error:
             pass
+        for pragma in CONNECTION_PRAGMAS:
+            try:
+                conn.execute(pragma)
+            except sqlite3.Error:
+                LOGGER.debug("SQLite rejected %s", pragma)
+
+    def _restore_tag_triggers(self, cur: sqlite3.Cursor) -> None:
+        """Recreate the tag_index triggers, rebuild the index, clear the marker."""
+        for stmt in TRIGGER_STATEMENTS:
+            cur.execute(stmt)
+        cur.execute("INSERT INTO tag_index(tag_index) VALUES ('rebuild')")
+        cur.execute("DELETE FROM localbooru_meta WHERE key=?", (BULK_IMPORT_KEY,))
+
+    def _bulk_import_owner(self, cur: sqlite3.Cursor) -> Optional[int]:
+        row = cur.execute(
+            "SELECT value FROM localbooru_meta WHERE key=?", (BULK_IMPORT_KEY,)
+        ).fetchone()
+        try:
+            return int(row[0]) if row is not None else None
+        except ValueError:
+            return 0
 
     def _ensure_schema(self) -> None:
         with closing(self._connection.cursor()) as cur:
             for stmt in SCHEMA_STATEMENTS:
                 cur.execute(stmt)
-            cols = {row[1] for row in cur.execute("PRAGMA table_info(images)")}
-            if "description" not in cols:
-                cur.execute("ALTER TABLE images ADD COLUMN description TEXT")
-            if "rating" not in cols:
-                cur.execute("ALTER TABLE images ADD COLUMN rating TEXT")
-            if "rating_confidence" not in cols:
-                cur.execute("ALTER TABLE images ADD COLUMN rating_confidence REAL")
-            if "rating_updated" not in cols:
-                cur.execute("ALTER TABLE images ADD COLUMN rating_updated REAL")
-
-            # Enhanced metadata fields for AI generation info
-            if "generator" not in cols:
-                cur.execute("ALTER TABLE images ADD COLUMN generator TEXT")
-            if "prompt" not in cols:
-                cur.execute("ALTER TABLE images ADD COLUMN prompt TEXT")
-            if "negative_prompt" not in cols:
-                cur.execute("ALTER TABLE images ADD COLUMN negative_prompt TEXT")
-            if "steps" not in cols:
-                cur.execute("ALTER TABLE images ADD COLUMN steps INTEGER")
-            if "cfg_scale" not in cols:
-                cur.execute("ALTER TABLE images ADD COLUMN cfg_scale REAL")
-            if "sampler" not in cols:
-                cur.execute("ALTER TABLE images ADD COLUMN sampler TEXT")
-            if "scheduler" not in cols:
-                cur.execute("ALTER TABLE images ADD COLUMN scheduler TEXT")
-            tag_cols = {row[1] for row in cur.execute("PRAGMA table_info(tags)")}
-            if "source" not in tag_cols:
-                cur.execute(
-                    "ALTER TABLE tags ADD COLUMN source TEXT NOT NULL DEFAULT 'embedded'"
-                )
-            # Normalize legacy rating tag norms from 'rating:explicit' -> 'explicit'
+            owner = self._bulk_import_owner(cur)
+            if owner is not None and not _process_alive(owner):
+                # The importing process died inside bulk_import().
+                self._restore_tag_triggers(cur)
+            version = cur.execute("PRAGMA user_version").fetchone()[0]
+            if version < SCHEMA_VERSION:
+                self._migrate_schema(cur)
+                cur.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+            self._connection.commit()
+
+    def _migrate_schema(self, cur: sqlite3.Cursor) -> None:
+        """Bring databases created by older releases up to the current columns."""
+        cols = {row[1] for row in cur.execute("PRAGMA table_info(images)")}
+        if "description" not in cols:
+            cur.execute("ALTER TABLE images ADD COLUMN description TEXT")
+        if "rating" not in cols:
+            cur.execute("ALTER TABLE images ADD COLUMN rating TEXT")
+        if "rating_confidence" not in cols:
+            cur.execute("ALTER TABLE images ADD COLUMN rating_confidence REAL")
+        if "rating_updated" not in cols:
+            cur.execute("ALTER TABLE images ADD COLUMN rating_updated REAL")
+
+        # Enhanced metadata fields for AI generation info
+        if "generator" not in cols:
+            cur.execute("ALTER TABLE images ADD COLUMN generator TEXT")
+        if "prompt" not in cols:
+            cur.execute("ALTER TABLE images ADD COLUMN prompt TEXT")
+        if "negative_prompt" not in cols:
+            cur.execute("ALTER TABLE images ADD COLUMN negative_prompt TEXT")
+        if "steps" not in cols:
+            cur.execute("ALTER TABLE images ADD COLUMN steps INTEGER")
+        if "cfg_scale" not in cols:
+            cur.execute("ALTER TABLE images ADD COLUMN cfg_scale REAL")
+        if "sampler" not in cols:
+            cur.execute("ALTER TABLE images ADD COLUMN sampler TEXT")
+        if "scheduler" not in cols:
+            cur.execute("ALTER TABLE images ADD COLUMN scheduler TEXT")
+        tag_cols = {row[1] for row in cur.execute("PRAGMA table_info(tags)")}
+        if "source" not in tag_cols:
             cur.execute(
-                "UPDATE tags SET norm=substr(norm, 8) WHERE kind='rating' AND norm LIKE 'rating:%'"
+                "ALTER TABLE tags ADD COLUMN source TEXT NOT NULL DEFAULT 'embedded'"
             )
-            rating_job_cols = {
-                row[1] for row in cur.execute("PRAGMA table_info(rating_jobs)")
-            }
-            if "scores_json" not in rating_job_cols:
-                cur.execute("ALTER TABLE rating_jobs ADD COLUMN scores_json TEXT")
-            self._connection.commit()
+        # Normalize legacy rating tag norms from 'rating:explicit' -> 'explicit'
+        cur.execute(
+            "UPDATE tags SET norm=substr(norm, 8) WHERE kind='rating' AND norm LIKE 'rating:%'"
+        )
+        rating_job_cols = {
+            row[1] for row in cur.execute("PRAGMA table_info(rating_jobs)")
+        }
+        if "scores_json" not in rating_job_cols:
+            cur.execute("ALTER TABLE rating_jobs ADD COLUMN scores_json TEXT")
+        clip_cols = {
+            row[1] for row in cur.execute("PRAGMA table_info(clip_embeddings)")
+        }
+        if "vector_scale" not in clip_cols:
+            # NULL scale marks legacy float32 blobs; set rows hold int8 codes.
+            cur.execute("ALTER TABLE clip_embeddings ADD COLUMN vector_scale REAL")
+        # Triggers are absent on a new database, and deliberately so while a
+        # bulk_import() runs elsewhere; that import restores them on exit.
+        if self._bulk_import_owner(cur) is None:
+            triggers_missing = (
+                cur.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type='trigger' AND name='tags_ai'"
+                ).fetchone()
+                is None
+            )
+            for stmt in TRIGGER_STATEMENTS:
+                cur.execute(stmt)
+            if triggers_missing:
+                cur.execute("INSERT INTO tag_index(tag_index) VALUES ('rebuild')")
+        # (kind, norm) is a prefix of tags_kind_norm_image_idx; the extra index
+        # only cost a write per tag row.
+        cur.execute("DROP INDEX IF EXISTS tags_kind_norm_idx")
+        # Superseded by auto_tag_status_idx(status, queued_at).
+        cur.execute("DROP INDEX IF EXISTS auto_tag_pending_idx")
+        # Serves the clip progress counters; the trailing columns make the
+        # matrix fingerprint and its updated_at delta lookups index-only too.
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS clip_ready_idx "
+            "ON clip_embeddings(model, status, updated_at, image_id, vector_scale)"
+        )
+        # (model, status) is a prefix of clip_ready_idx.
+        cur.execute("DROP INDEX IF EXISTS clip_model_status_idx")
 
     def _ensure_tag_index_schema(self) -> None:
         """Ensure the tag_index FTS table matches the expected schema."""
@@ -195,13 +486,16 @@ class LocalBooruDatabase:
             LOGGER.warning("Unable to inspect tag_index schema: %s", exc)
             return
 
-        expected_fragment = "norm,\n    tag,\n    kind UNINDEXED,\n    image_id UNINDEXED"
         needs_rebuild = False
         if row is None or not row["sql"]:
             needs_rebuild = True
         else:
             sql_definition = row["sql"]
-            if "kind" not in sql_definition or "image_id" not in sql_definition:
+            if (
+                "kind" not in sql_definition
+                or "image_id" not in sql_definition
+                or "content='tags'" not in sql_definition
+            ):
                 needs_rebuild = True
 
         if not needs_rebuild:
@@ -216,22 +510,40 @@ class LocalBooruDatabase:
                 "    tag,\n"
                 "    kind UNINDEXED,\n"
                 "    image_id UNINDEXED,\n"
+                "    content='tags',\n"
+                "    content_rowid='id',\n"
                 "    tokenize=\"unicode61 tokenchars '_.:-'\"\n"
                 ");"
             )
             self._connection.execute(
-                "INSERT INTO tag_index(rowid, norm, tag, kind, image_id)\n"
-                "SELECT id, norm, tag, kind, image_id FROM tags"
+                "INSERT INTO tag_index(tag_index) VALUES ('rebuild')"
             )
 
     # --- Image + tag operations ---------------------------------------------------------
 
     def lookup_image(self, rel_path: str) -> Optional[sqlite3.Row]:
-        return self._connection.execute(
+        return self._conn().execute(
             "SELECT * FROM images WHERE path = ?",
             (rel_path,),
         ).fetchone()
 
+    def load_image_stats(self) -> Dict[str, Tuple[float, int, int]]:
+        """Map every stored path to ``(mtime, size, id)`` for rescan checks."""
+        return {
+            path: (mtime, size, image_id)
+            for path, mtime, size, image_id in self._tuple_cursor().execute(
+                "SELECT path, mtime, size, id FROM images"
+            )
+        }
+
+    def _cached_image_id(self, rel_path: str) -> Optional[int]:
+        if self._path_to_id is None:
+            self._path_to_id = {
+                row["path"]: int(row["id"])
+                for row in self._conn().execute("SELECT path, id FROM images")
+            }
+        return self._path_to_id.get(rel_path)
+
     def upsert_image_record(
         self,
         rel_path: str,
@@ -258,8 +570,8 @@ class LocalBooruDatabase:
 
         Returns (image_id, changed) where `changed` indicates metadata or tags were refreshed.
         """
-        with self._connection:  # transactional
-            existing = self.lookup_image(rel_path)
+        with self._transaction():  # transactional
+            image_id = self._cached_image_id(rel_path)
             row = (
                 rel_path,
                 name,
@@ -280,41 +592,58 @@ class LocalBooruDatabase:
                 sampler,
                 scheduler,
             )
-            if existing is None:
-                cur = self._connection.execute(
-                    "INSERT INTO images "
-                    "(path, name, mtime, size, width, height, seed, model, source, description, metadata_json, "
-                    "generator, prompt, negative_prompt, steps, cfg_scale, sampler, scheduler) "
-                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                    row,
-                )
-                image_id = cur.lastrowid
-                changed = True
-            else:
-                cur = self._connection.execute(
-                    "UPDATE images SET "
-                    "name=?, mtime=?, size=?, width=?, height=?, seed=?, model=?, source=?, description=?, metadata_json=?, "
-                    "generator=?, prompt=?, negative_prompt=?, steps=?, cfg_scale=?, sampler=?, scheduler=? "
-                    "WHERE path=?",
-                    (*row[1:], rel_path),
+            update_sql = (
+                "UPDATE images SET "
+                "name=?, mtime=?, size=?, width=?, height=?, seed=?, model=?, source=?, description=?, metadata_json=?, "
+                "generator=?, prompt=?, negative_prompt=?, steps=?, cfg_scale=?, sampler=?, scheduler=? "
+                "WHERE path=?"
+            )
+            changed = False
+            if image_id is not None:
+                cur = self._conn().execute(
+                    update_sql + " AND id=?", (*row[1:], rel_path, image_id)
                 )
-                image_id = existing["id"]
                 changed = cur.rowcount > 0
+                if not changed:
+                    # Deleted (or re-created) since the cache was loaded.
+                    image_id = None
+            if image_id is None:
+                try:
+                    cur = self._conn().execute(
+                        "INSERT INTO images "
+                        "(path, name, mtime, size, width, height, seed, model, source, description, metadata_json, "
+                        "generator, prompt, negative_prompt, steps, cfg_scale, sampler, scheduler) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        row,
+                    )
+                    image_id = cur.lastrowid
+                    changed = True
+                except sqlite3.IntegrityError:
+                    # Inserted through another connection after the cache load.
+                    existing = self.lookup_image(rel_path)
+                    if existing is None:
+                        raise
+                    cur = self._conn().execute(update_sql, (*row[1:], rel_path))
+                    image_id = existing["id"]
+                    changed = cur.rowcount > 0
+                self._path_to_id[rel_path] = int(image_id)
 
             if not tags:
-                self._connection.execute(
+                self._conn().execute(
                     "DELETE FROM tags WHERE image_id=?",
                     (image_id,),
                 )
                 return image_id, changed
 
-            existing_tags = set(
-                row["norm"]
-                for row in self._connection.execute(
-                    "SELECT norm FROM tags WHERE image_id=?",
-                    (image_id,),
-                )
-            )
+            # Full payloads so unchanged tags can skip their UPDATE (and the
+            # tags_au trigger's delete+insert into tag_index) on rescans.
+            existing_payloads: Dict[str, Set[Tuple[object, ...]]] = {}
+            for row in self._conn().execute(
+                "SELECT norm, tag, kind, emphasis, weight, raw, source FROM tags WHERE image_id=?",
+                (image_id,),
+            ):
+                existing_payloads.setdefault(row["norm"], set()).add(tuple(row)[1:])
+            existing_tags = set(existing_payloads)
             new_norms = {tag.norm for tag in tags}
 
             to_delete = existing_tags - new_norms
@@ -322,51 +651,61 @@ class LocalBooruDatabase:
             to_update = existing_tags & new_norms
 
             if to_delete:
-                self._connection.execute(
-                    "DELETE FROM tags WHERE image_id=? AND norm IN ({})".format(
-                        ",".join("?" * len(to_delete))
-                    ),
-                    (image_id, *to_delete),
+                # A fixed statement stays in the statement cache; an IN list
+                # sized per image would prepare a new one for each length.
+                self._conn().executemany(
+                    "DELETE FROM tags WHERE image_id=? AND norm=?",
+                    [(image_id, norm) for norm in to_delete],
                 )
 
+            # Both statements bind (tag, kind, emphasis, weight, raw, source,
+            # image_id, norm), so each tag's parameters are built once.
+            insert_rows = []
+            update_rows = []
             for tag in tags:
-                if tag.norm in to_insert:
-                    self._connection.execute(
-                        "INSERT INTO tags "
-                        "(image_id, tag, norm, kind, emphasis, weight, raw, source) "
-                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                        (
-                            image_id,
-                            tag.tag,
-                            tag.norm,
-                            tag.kind,
-                            tag.emphasis,
-                            tag.weight,
-                            tag.raw,
-                            tag.source or "embedded",
-                        ),
-                    )
-                elif tag.norm in to_update:
-                    self._connection.execute(
-                        "UPDATE tags SET "
-                        "tag=?, kind=?, emphasis=?, weight=?, raw=?, source=? "
-                        "WHERE image_id=? AND norm=?",
-                        (
-                            tag.tag,
-                            tag.kind,
-                            tag.emphasis,
-                            tag.weight,
-                            tag.raw,
-                            tag.source or "embedded",
-                            image_id,
-                            tag.norm,
-                        ),
-                    )
+                norm = tag.norm
+                payload = (
+                    tag.tag,
+                    tag.kind,
+                    tag.emphasis,
+                    tag.weight,
+                    tag.raw,
+                    tag.source or "embedded",
+                )
+                if norm in to_insert:
+                    insert_rows.append((*payload, image_id, norm))
+                elif norm in to_update and existing_payloads[norm] != {payload}:
+                    update_rows.append((*payload, image_id, norm))
+            if insert_rows:
+                self._conn().executemany(
+                    "INSERT INTO tags "
+                    "(tag, kind, emphasis, weight, raw, source, image_id, norm) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    insert_rows,
+                )
+            if update_rows:
+                self._conn().executemany(
+                    "UPDATE tags SET "
+                    "tag=?, kind=?, emphasis=?, weight=?, raw=?, source=? "
+                    "WHERE image_id=? AND norm=?",
+                    update_rows,
+                )
 
             changed = changed or bool(to_delete or to_insert or to_update)
 
         return image_id, changed
 
+    def delete_image(self, rel_path: str) -> int:
+        """Delete the image stored at ``rel_path``; returns the rows removed."""
+        with self._transaction() as conn:
+            deleted = conn.execute(
+                "DELETE FROM images WHERE path = ?",
+                (rel_path,),
+            ).rowcount
+        if deleted and self._path_to_id is not None:
+            self._path_to_id.pop(rel_path, None)
+        return deleted
+
     def delete_missing_images(self, existing_paths: Iterable[str]) -> int:
         """Delete images from the database that are not in the existing_paths set.
 
@@ -391,50 +730,52 @@ class LocalBooruDatabase:
             len(keep_paths_raw),
         )
 
-        with self._connection:
+        with self._transaction():
             # If nothing should be kept, clear the table entirely.
             if not keep_paths_raw:
-                cur = self._connection.execute("DELETE FROM images")
+                cur = self._conn().execute("DELETE FROM images")
                 deleted = cur.rowcount if cur.rowcount != -1 else 0
+                self._path_to_id = None
                 return deleted
 
-            rows = self._connection.execute(
-                "SELECT id, path FROM images"
-            ).fetchall()
-            missing_rows: List[Tuple[int, str]] = []
-            for row in rows:
-                stored_path = row["path"]
-                normalized_path = stored_path.replace("\\", "/")
-                if stored_path in keep_paths_raw or normalized_path in keep_paths_normalized:
-                    continue
-                missing_rows.append((int(row["id"]), stored_path))
-
-            if not missing_rows:
-                return 0
+            # Stage the keep-set in a temp table so the delete is a single
+            # indexed anti-join, independent of SQLite's variable limit.
+            # Stored paths also match on their forward-slash spelling.
+            self._conn().execute(
+                "CREATE TEMP TABLE IF NOT EXISTS keep_paths(path TEXT PRIMARY KEY)"
+            )
+            self._conn().execute("DELETE FROM keep_paths")
+            self._conn().executemany(
+                "INSERT OR IGNORE INTO keep_paths(path) VALUES (?)",
+                ((path,) for path in keep_paths_raw | keep_paths_normalized),
+            )
+            missing_clause = (
+                "FROM images WHERE path NOT IN (SELECT path FROM keep_paths) "
+                "AND replace(path, '\\', '/') NOT IN (SELECT path FROM keep_paths)"
+            )
 
             if LOGGER.isEnabledFor(logging.DEBUG):
-                sample_paths = [path for _, path in missing_rows[:5]]
-                LOGGER.debug(
-                    "Deleting %d missing images; sample paths: %s",
-                    len(missing_rows),
-                    sample_paths,
-                )
-
-            deleted = 0
-            chunk_size = 512
-            for start in range(0, len(missing_rows), chunk_size):
-                chunk = missing_rows[start : start + chunk_size]
-                ids = [image_id for image_id, _ in chunk]
-                placeholders = ",".join("?" for _ in ids)
-                cur = self._connection.execute(
-                    f"DELETE FROM images WHERE id IN ({placeholders})",
-                    ids,
-                )
-                if cur.rowcount is None or cur.rowcount < 0:
-                    deleted += len(ids)
-                else:
-                    deleted += cur.rowcount
+                sample_paths = [
+                    row["path"]
+                    for row in self._conn().execute(
+                        f"SELECT path {missing_clause} LIMIT 5"
+                    )
+                ]
+                if sample_paths:
+                    LOGGER.debug(
+                        "Deleting missing images; sample paths: %s", sample_paths
+                    )
 
+            cur = self._conn().execute(f"DELETE {missing_clause}")
+            deleted = cur.rowcount if cur.rowcount != -1 else 0
+            self._conn().execute("DELETE FROM keep_paths")
+            if deleted and self._path_to_id is not None:
+                self._path_to_id = {
+                    path: image_id
+                    for path, image_id in self._path_to_id.items()
+                    if path in keep_paths_raw
+                    or path.replace("\\", "/") in keep_paths_normalized
+                }
             return deleted
 
     # --- CLIP embedding operations ------------------------------------------------------
@@ -443,50 +784,52 @@ class LocalBooruDatabase:
         self, image_id: int, model: str, force_reset: bool = False
     ) -> None:
         now = time.time()
-        with self._connection:
-            row = self._connection.execute(
-                "SELECT model, status FROM clip_embeddings WHERE image_id=?",
-                (image_id,),
-            ).fetchone()
-            if row is None:
-                self._connection.execute(
-                    "INSERT INTO clip_embeddings(image_id, model, status, queued_at, updated_at) VALUES (?,?,?,?,?)",
-                    (image_id, model, "pending", now, now),
-                )
-            else:
-                status = row["status"]
-                should_reset = False
-                if row["model"] != model:
-                    should_reset = True
-                elif status == "missing":
-                    should_reset = True
-                elif force_reset:
-                    should_reset = True
-                if should_reset:
-                    self._connection.execute(
-                        "UPDATE clip_embeddings SET model=?, status='pending', vector=NULL, error=NULL, queued_at=?, updated_at=? WHERE image_id=?",
-                        (model, now, now, image_id),
-                    )
+        with self._transaction():
+            # Existing rows are only re-queued on a model change, a missing
+            # file, or an explicit reset; otherwise the upsert is a no-op.
+            self._conn().execute(
+                "INSERT INTO clip_embeddings(image_id, model, status, queued_at, updated_at) "
+                "VALUES (?, ?, 'pending', ?, ?) "
+                "ON CONFLICT(image_id) DO UPDATE SET model=excluded.model, status='pending', "
+                "vector=NULL, vector_scale=NULL, error=NULL, "
+                "queued_at=excluded.queued_at, updated_at=excluded.updated_at "
+                "WHERE ? OR clip_embeddings.model <> excluded.model "
+                "OR clip_embeddings.status = 'missing'",
+                (image_id, model, now, now, bool(force_reset)),
+            )
 
     def reserve_clip_batch(self, model: str, limit: int) -> List[sqlite3.Row]:
-        conn = self.new_connection()
-        try:
-            with conn:
-                rows = conn.execute(
-                    "SELECT ce.image_id, i.path, i.mtime FROM clip_embeddings ce JOIN images i ON i.id = ce.image_id "
-                    "WHERE ce.status = 'pending' AND ce.model = ? ORDER BY ce.queued_at ASC LIMIT ?",
-                    (model, limit),
-                ).fetchall()
-                if not rows:
-                    return []
-                now = time.time()
-                conn.executemany(
-                    "UPDATE clip_embeddings SET status='processing', updated_at=? WHERE image_id=?",
-                    ((now, row["image_id"]) for row in rows),
-                )
-                return rows
-        finally:
-            conn.close()
+        if not _HAS_RETURNING:
+            return self._reserve_clip_batch_legacy(model, limit)
+        with self._writer_transaction() as conn:
+            rows = conn.execute(
+                "UPDATE clip_embeddings SET status='processing', updated_at=? "
+                "WHERE image_id IN ("
+                "SELECT ce.image_id FROM clip_embeddings ce JOIN images i ON i.id = ce.image_id "
+                "WHERE ce.status = 'pending' AND ce.model = ? ORDER BY ce.queued_at ASC LIMIT ?) "
+                "RETURNING image_id, queued_at, "
+                "(SELECT path FROM images WHERE images.id = clip_embeddings.image_id) AS path, "
+                "(SELECT mtime FROM images WHERE images.id = clip_embeddings.image_id) AS mtime",
+                (time.time(), model, limit),
+            ).fetchall()
+        # RETURNING order is unspecified; keep the queue order callers expect.
+        return sorted(rows, key=lambda row: row["queued_at"])
+
+    def _reserve_clip_batch_legacy(self, model: str, limit: int) -> List[sqlite3.Row]:
+        with self._writer_transaction() as conn:
+            rows = conn.execute(
+                "SELECT ce.image_id, i.path, i.mtime FROM clip_embeddings ce JOIN images i ON i.id = ce.image_id "
+                "WHERE ce.status = 'pending' AND ce.model = ? ORDER BY ce.queued_at ASC LIMIT ?",
+                (model, limit),
+            ).fetchall()
+            if not rows:
+                return []
+            now = time.time()
+            conn.executemany(
+                "UPDATE clip_embeddings SET status='processing', updated_at=? WHERE image_id=?",
+                ((now, row["image_id"]) for row in rows),
+            )
+            return rows
 
     def mark_clip_error(self, image_id: int, error: str) -> None:
         now = time.time()
@@ -495,79 +838,240 @@ class LocalBooruDatabase:
             (error, now, image_id),
         )
 
-    def store_clip_vector(self, image_id: int, model: str, vector: bytes) -> None:
+    def store_clip_vector(
+        self, image_id: int, model: str, vector: BlobLike, scale: Optional[float] = None
+    ) -> None:
         now = time.time()
         self._execute_with_retry(
-            "UPDATE clip_embeddings SET status='ready', model=?, vector=?, updated_at=? WHERE image_id=?",
-            (model, vector, now, image_id),
+            "UPDATE clip_embeddings SET status='ready', model=?, vector=?, vector_scale=?, updated_at=? WHERE image_id=?",
+            (model, vector, scale, now, image_id),
+        )
+
+    def store_clip_vectors(
+        self, model: str, rows: Sequence[Tuple[int, BlobLike, Optional[float]]]
+    ) -> None:
+        """Store a batch of ``(image_id, vector, scale)`` rows in a single transaction."""
+        if not rows:
+            return
+        now = time.time()
+        self._execute_with_retry(
+            "UPDATE clip_embeddings SET status='ready', model=?, vector=?, vector_scale=?, updated_at=? WHERE image_id=?",
+            [(model, vector, scale, now, image_id) for image_id, vector, scale in rows],
+            many=True,
         )
 
     def reset_stuck_clip_jobs(self, model: Optional[str] = None) -> int:
         now = time.time()
-        with self._connection:
+        with self._transaction():
             if model is None:
-                result = self._connection.execute(
+                result = self._conn().execute(
                     "UPDATE clip_embeddings SET status='pending', updated_at=? WHERE status='processing'",
                     (now,),
                 )
             else:
-                result = self._connection.execute(
+                result = self._conn().execute(
                     "UPDATE clip_embeddings SET status='pending', updated_at=? WHERE status='processing' AND model=?",
                     (now, model),
                 )
         return int(result.rowcount or 0)
 
+    def release_clip_jobs(self, image_ids: Iterable[int]) -> None:
+        """Return reserved (``processing``) rows to the queue in their original order."""
+        now = time.time()
+        self._execute_with_retry(
+            "UPDATE clip_embeddings SET status='pending', updated_at=? "
+            "WHERE image_id=? AND status='processing'",
+            [(now, int(image_id)) for image_id in image_ids],
+            many=True,
+        )
+
     def clip_progress_counts(self, model: str) -> Tuple[int, int, int, int]:
         model_value = "" if not model else str(model)
         conn = self.new_connection()
         try:
-            cur = conn.execute(
-                "SELECT "
-                "COUNT(*) AS total, "
-                "SUM(CASE WHEN status='ready' THEN 1 ELSE 0 END) AS completed, "
-                "SUM(CASE WHEN status IN ('pending', 'processing') THEN 1 ELSE 0 END) AS processing, "
-                "SUM(CASE WHEN status='error' THEN 1 ELSE 0 END) AS errors "
-                "FROM clip_embeddings WHERE model=?",
-                (model_value,),
-            )
-            row = cur.fetchone()
-            if row is None:
-                return (0, 0, 0, 0)
-            return (
-                int(row["total"] or 0),
-                int(row["completed"] or 0),
-                int(row["processing"] or 0),
-                int(row["errors"] or 0),
+            return self._summarize_status_counts(
+                conn.execute(
+                    "SELECT status, COUNT(*) FROM clip_embeddings "
+                    "WHERE model=? GROUP BY status",
+                    (model_value,),
+                )
             )
         finally:
             conn.close()
 
-    def iter_clip_vectors(self, model: str) -> Iterator[Tuple[int, bytes]]:
-        for row in self._connection.execute(
-            "SELECT image_id, vector FROM clip_embeddings WHERE model=? AND status='ready' AND vector IS NOT NULL",
+    @staticmethod
+    def _summarize_status_counts(
+        rows: Iterable[Tuple[str, int]],
+    ) -> Tuple[int, int, int, int]:
+        """Fold ``(status, count)`` rows into (total, ready, queued, errors)."""
+        counts = {status: int(count or 0) for status, count in rows}
+        return (
+            sum(counts.values()),
+            counts.get("ready", 0),
+            counts.get("pending", 0) + counts.get("processing", 0),
+            counts.get("error", 0),
+        )
+
+    def iter_clip_vectors(
+        self, model: str
+    ) -> Iterator[Tuple[int, bytes, Optional[float]]]:
+        yield from self._tuple_cursor().execute(
+            "SELECT image_id, vector, vector_scale FROM clip_embeddings "
+            "WHERE model=? AND status='ready' AND vector IS NOT NULL",
             (model,),
-        ):
-            yield row["image_id"], row["vector"]
+        )
+
+    def clip_matrix_fingerprint(self, model: str) -> Tuple[int, float, int, int]:
+        """Cheap summary of the ready vectors; changes whenever a vector is written.
+
+        Returns ``(int8_count, max_updated_at, int8_id_sum, legacy_count)``,
+        read from ``clip_ready_idx`` alone without touching the vector pages.
+        """
+        row = self._conn().execute(
+            "SELECT COALESCE(SUM(vector_scale IS NOT NULL), 0), "
+            "COALESCE(MAX(updated_at), 0), "
+            "COALESCE(SUM(CASE WHEN vector_scale IS NOT NULL THEN image_id END), 0), "
+            "COALESCE(SUM(vector_scale IS NULL), 0) FROM clip_embeddings "
+            "WHERE model=? AND status='ready'",
+            (model,),
+        ).fetchone()
+        return int(row[0]), float(row[1]), int(row[2]), int(row[3])
+
+    def load_clip_ready_ids(self, model: str) -> List[int]:
+        """Ids of every ready int8 vector, read from ``clip_ready_idx`` alone."""
+        return [
+            image_id
+            for (image_id,) in self._tuple_cursor().execute(
+                "SELECT image_id FROM clip_embeddings "
+                "WHERE model=? AND status='ready' AND vector_scale IS NOT NULL",
+                (model,),
+            )
+        ]
+
+    def load_clip_matrix(
+        self,
+        model: str,
+        allowed_ids: Optional[Iterable[int]] = None,
+        *,
+        quantized: bool = True,
+        updated_since: Optional[float] = None,
+    ):
+        """Load every ready vector of one storage format as a single matrix.
+
+        Returns ``(ids, matrix, scales)``: int8 codes with float32 per-row scales
+        when ``quantized``, otherwise legacy float32 rows with ``scales=None``.
+        ``allowed_ids`` is joined through a temp table on a private connection;
+        ``updated_since`` keeps only rows with ``updated_at`` at or after it.
+        """
+        import numpy as np  # local import: numpy is only needed for CLIP search
+
+        sql = (
+            "SELECT ce.image_id, ce.vector, ce.vector_scale FROM clip_embeddings ce {join}"
+            "WHERE ce.model=? AND ce.status='ready' AND length(ce.vector) > 0 "
+            "AND ce.vector_scale IS {null_check} NULL {since}ORDER BY ce.image_id"
+        )
+        params: Tuple[object, ...] = (model,)
+        since = ""
+        if updated_since is not None:
+            since = "AND ce.updated_at >= ? "
+            params = (model, float(updated_since))
+        null_check = "NOT" if quantized else ""
+        # Stream rows into one growing buffer instead of fetchall() + join, so
+        # peak memory is roughly one copy of the matrix rather than two.
+        ids: List[int] = []
+        scales_list: List[Optional[float]] = []
+        buffer = bytearray()
+        conn = self.new_connection()
+        conn.row_factory = None
+        try:
+            if allowed_ids is None:
+                cur = conn.execute(
+                    sql.format(join="", null_check=null_check, since=since), params
+                )
+            else:
+                conn.execute(
+                    "CREATE TEMP TABLE IF NOT EXISTS clip_allowed(image_id INTEGER PRIMARY KEY)"
+                )
+                conn.executemany(
+                    "INSERT OR IGNORE INTO clip_allowed(image_id) VALUES (?)",
+                    ((int(image_id),) for image_id in allowed_ids),
+                )
+                cur = conn.execute(
+                    sql.format(
+                        join="JOIN clip_allowed a ON a.image_id = ce.image_id ",
+                        null_check=null_check,
+                        since=since,
+                    ),
+                    params,
+                )
+            for image_id, vector, scale in cur:
+                ids.append(image_id)
+                buffer += vector
+                scales_list.append(scale)
+        finally:
+            conn.close()
+
+        dtype = np.int8 if quantized else np.float32
+        id_array = np.asarray(ids, dtype=np.int64)
+        if not ids:
+            return id_array, np.empty((0, 0), dtype=dtype), None
+        matrix = np.frombuffer(buffer, dtype=dtype).reshape(len(ids), -1)
+        scales = None
+        if quantized:
+            scales = np.asarray(scales_list, dtype=np.float32)
+        return id_array, matrix, scales
 
     def purge_clip_vectors(self, model: str) -> None:
-        self._connection.execute(
+        self._conn().execute(
             "DELETE FROM clip_embeddings WHERE model=?",
             (model,),
         )
 
     def fetch_clip_vector(self, image_id: int, model: str) -> Optional[bytes]:
-        row = self._connection.execute(
+        row = self._conn().execute(
             "SELECT vector FROM clip_embeddings WHERE image_id=? AND model=? AND status='ready'",
             (image_id, model),
         ).fetchone()
         return row["vector"] if row else None
 
+    def fetch_clip_vector_record(
+        self, image_id: int, model: str
+    ) -> Optional[Tuple[bytes, Optional[float]]]:
+        """Return the stored ``(vector, scale)`` pair for ``image_id``."""
+        row = self._conn().execute(
+            "SELECT vector, vector_scale FROM clip_embeddings "
+            "WHERE image_id=? AND model=? AND status='ready' AND vector IS NOT NULL",
+            (image_id, model),
+        ).fetchone()
+        return (row["vector"], row["vector_scale"]) if row else None
+
+    def fetch_clip_vectors(
+        self, image_ids: Iterable[int], model: str
+    ) -> Dict[int, Tuple[bytes, Optional[float]]]:
+        """Return ``{image_id: (vector, scale)}`` for the ready ids among ``image_ids``."""
+        unique_ids = list(dict.fromkeys(int(image_id) for image_id in image_ids))
+        found: Dict[int, Tuple[bytes, Optional[float]]] = {}
+        chunk_size = 512
+        for start in range(0, len(unique_ids), chunk_size):
+            chunk = unique_ids[start : start + chunk_size]
+            placeholders = ",".join("?" for _ in chunk)
+            rows = self._conn().execute(
+                "SELECT image_id, vector, vector_scale FROM clip_embeddings "
+                "WHERE model=? AND status='ready' AND vector IS NOT NULL "
+                f"AND image_id IN ({placeholders})",
+                (model, *chunk),
+            ).fetchall()
+            for row in rows:
+                found[int(row["image_id"])] = (row["vector"], row["vector_scale"])
+        return found
+
     def has_ready_clip(self, image_id: int, model: str) -> bool:
-        row = self._connection.execute(
-            "SELECT 1 FROM clip_embeddings WHERE image_id=? AND model=? AND status='ready'",
+        row = self._conn().execute(
+            "SELECT EXISTS(SELECT 1 FROM clip_embeddings "
+            "WHERE image_id=? AND model=? AND status='ready')",
             (image_id, model),
         ).fetchone()
-        return bool(row and row["status"] == "ready")
+        return bool(row[0])
 
     # --- Auto-tag operations ---------------------------------------------------------
 
@@ -575,69 +1079,74 @@ class LocalBooruDatabase:
         self, image_id: int, model: str, force_reset: bool = False
     ) -> None:
         now = time.time()
-        with self._connection:
-            row = self._connection.execute(
-                "SELECT status, model FROM auto_tag_jobs WHERE image_id=?",
-                (image_id,),
-            ).fetchone()
-            if row is None:
-                self._connection.execute(
-                    "INSERT INTO auto_tag_jobs(image_id, status, model, queued_at, updated_at) VALUES (?,?,?,?,?)",
-                    (image_id, "pending", model, now, now),
-                )
-            else:
-                status = row["status"]
-                stored_model = row["model"]
-                reset_needed = False
-                if stored_model != model:
-                    reset_needed = True
-                elif status == "missing":
-                    reset_needed = True
-                elif force_reset:
-                    reset_needed = True
-
-                if reset_needed:
-                    self._connection.execute(
-                        "UPDATE auto_tag_jobs SET status='pending', model=?, error=NULL, queued_at=?, updated_at=? WHERE image_id=?",
-                        (model, now, now, image_id),
-                    )
+        with self._transaction():
+            self._conn().execute(
+                "INSERT INTO auto_tag_jobs(image_id, status, model, queued_at, updated_at) "
+                "VALUES (?, 'pending', ?, ?, ?) "
+                "ON CONFLICT(image_id) DO UPDATE SET status='pending', model=excluded.model, "
+                "error=NULL, queued_at=excluded.queued_at, updated_at=excluded.updated_at "
+                "WHERE ? OR auto_tag_jobs.model <> excluded.model "
+                "OR auto_tag_jobs.status = 'missing'",
+                (image_id, model, now, now, bool(force_reset)),
+            )
 
     def reserve_auto_tag_batch(self, limit: int) -> List[sqlite3.Row]:
-        conn = self.new_connection()
-        try:
-            with conn:
-                rows = conn.execute(
-                    "SELECT j.image_id, i.path FROM auto_tag_jobs j "
-                    "JOIN images i ON i.id = j.image_id "
-                    "WHERE j.status = 'pending' ORDER BY j.queued_at ASC LIMIT ?",
-                    (limit,),
-                ).fetchall()
-                if not rows:
-                    return []
-                now = time.time()
-                attempts = 0
-                update_params = [(now, row["image_id"]) for row in rows]
-                while True:
-                    try:
-                        conn.executemany(
-                            "UPDATE auto_tag_jobs SET status='processing', updated_at=? WHERE image_id=?",
-                            update_params,
-                        )
-                        break
-                    except sqlite3.OperationalError as exc:
-                        if "locked" in str(exc).lower() and attempts < 4:
-                            attempts += 1
-                            time.sleep(0.2 * attempts)
-                            continue
-                        raise
-                return rows
-        finally:
-            conn.close()
+        if not _HAS_RETURNING:
+            return self._reserve_auto_tag_batch_legacy(limit)
+        attempts = 0
+        while True:
+            try:
+                with self._writer_transaction() as conn:
+                    rows = conn.execute(
+                        "UPDATE auto_tag_jobs SET status='processing', updated_at=? "
+                        "WHERE image_id IN ("
+                        "SELECT j.image_id FROM auto_tag_jobs j JOIN images i ON i.id = j.image_id "
+                        "WHERE j.status = 'pending' ORDER BY j.queued_at ASC LIMIT ?) "
+                        "RETURNING image_id, queued_at, "
+                        "(SELECT path FROM images WHERE images.id = auto_tag_jobs.image_id) AS path",
+                        (time.time(), limit),
+                    ).fetchall()
+                break
+            except sqlite3.OperationalError as exc:
+                if "locked" in str(exc).lower() and attempts < 4:
+                    attempts += 1
+                    time.sleep(0.2 * attempts)
+                    continue
+                raise
+        return sorted(rows, key=lambda row: row["queued_at"])
+
+    def _reserve_auto_tag_batch_legacy(self, limit: int) -> List[sqlite3.Row]:
+        with self._writer_transaction() as conn:
+            rows = conn.execute(
+                "SELECT j.image_id, i.path FROM auto_tag_jobs j "
+                "JOIN images i ON i.id = j.image_id "
+                "WHERE j.status = 'pending' ORDER BY j.queued_at ASC LIMIT ?",
+                (limit,),
+            ).fetchall()
+            if not rows:
+                return []
+            now = time.time()
+            attempts = 0
+            update_params = [(now, row["image_id"]) for row in rows]
+            while True:
+                try:
+                    conn.executemany(
+                        "UPDATE auto_tag_jobs SET status='processing', updated_at=? WHERE image_id=?",
+                        update_params,
+                    )
+                    break
+                except sqlite3.OperationalError as exc:
+                    if "locked" in str(exc).lower() and attempts < 4:
+                        attempts += 1
+                        time.sleep(0.2 * attempts)
+                        continue
+                    raise
+            return rows
 
     def reset_stuck_auto_jobs(self) -> int:
         now = time.time()
-        with self._connection:
-            result = self._connection.execute(
+        with self._transaction():
+            result = self._conn().execute(
                 "UPDATE auto_tag_jobs SET status='pending', updated_at=? WHERE status='processing'",
                 (now,),
             )
@@ -648,28 +1157,44 @@ class LocalBooruDatabase:
         sql: str,
         params: Optional[Sequence[object]] = None,
         *,
+        many: bool = False,
         attempts: int = 6,
         initial_delay: float = 0.2,
     ) -> None:
-        """Execute a write with retry/backoff when SQLITE_BUSY occurs."""
+        """Execute a write with retry/backoff when SQLITE_BUSY occurs.
+
+        With ``many=True`` ``params`` is a sequence of parameter tuples applied
+        via ``executemany`` inside one transaction.
+        """
+        if self._in_batch():
+            # The batch connection already holds the write lock; the shared
+            # writer would just wait for it to commit.
+            with self._transaction() as conn:
+                if many:
+                    conn.executemany(sql, params or ())
+                elif params is None:
+                    conn.execute(sql)
+                else:
+                    conn.execute(sql, params)
+            return
         delay = initial_delay
         for attempt in range(attempts):
-            conn = self.new_connection()
             try:
-                with conn:
-                    if params is None:
+                with self._writer_transaction() as conn:
+                    if many:
+                        conn.executemany(sql, params or ())
+                    elif params is None:
                         conn.execute(sql)
                     else:
                         conn.execute(sql, params)
                 return
             except sqlite3.OperationalError as exc:
                 if "locked" in str(exc).lower() and attempt < attempts - 1:
+                    # Back off outside the lock so other writers can proceed.
                     time.sleep(delay)
                     delay = min(delay * 1.5, 2.0)
                     continue
                 raise
-            finally:
-                conn.close()
 
     def _execute_auto_job_update(self, sql: str, params: Tuple) -> None:
         self._execute_with_retry(sql, params)
@@ -702,18 +1227,17 @@ class LocalBooruDatabase:
         strategy: str,
         rating_scores: Optional[Dict[str, float]] = None,
     ) -> str:
+        normalized_scores, best_rating = self._normalize_scores(rating_scores)
         attempts = 0
         while True:
-            conn = self.new_connection()
             try:
-                with conn:
+                with self._writer_transaction() as conn:
                     result = self._apply_auto_tags_internal(
                         conn, image_id, tags, strategy
                     )
-                    normalized_scores = self._normalize_scores(rating_scores)
                     if normalized_scores:
                         self._apply_rating_scores_internal(
-                            conn, image_id, normalized_scores
+                            conn, image_id, normalized_scores, best_rating
                         )
                 return result
             except sqlite3.OperationalError as exc:
@@ -722,8 +1246,6 @@ class LocalBooruDatabase:
                     time.sleep(0.2 * attempts)
                     continue
                 raise
-            finally:
-                conn.close()
 
     def _apply_auto_tags_internal(
         self,
@@ -745,68 +1267,43 @@ class LocalBooruDatabase:
         ).fetchall()
         existing_tags = {(row["norm"], row["kind"]) for row in existing_rows}
 
-        if strategy == "missing":
-            to_add = [
-                tag
-                for tag in tags
-                if (tag.norm, tag.kind) not in existing_tags and tag.weight >= 0.0
-            ]
-            if not to_add:
-                return "skipped"
-        else:
-            to_add = [
-                tag
-                for tag in tags
-                if tag.weight >= 0.0 and (tag.norm, tag.kind) not in existing_tags
-            ]
+        # "missing" and "augment" share the same filter: only tags the image
+        # does not carry yet, and never negative-weight predictions.
+        rows = []
+        for tag in tags:
+            weight = tag.weight
+            if weight < 0.0:
+                continue
+            norm = tag.norm
+            kind = tag.kind
+            if (norm, kind) in existing_tags:
+                continue
+            rows.append(
+                (image_id, tag.tag, norm, kind, tag.emphasis, weight, tag.raw, "auto")
+            )
 
-        if not to_add:
+        if not rows:
             return "skipped"
 
-        for tag in to_add:
-            conn.execute(
-                "INSERT INTO tags "
-                "(image_id, tag, norm, kind, emphasis, weight, raw, source) "
-                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                (
-                    image_id,
-                    tag.tag,
-                    tag.norm,
-                    tag.kind,
-                    tag.emphasis,
-                    tag.weight,
-                    tag.raw,
-                    "auto",
-                ),
-            )
+        conn.executemany(
+            "INSERT INTO tags "
+            "(image_id, tag, norm, kind, emphasis, weight, raw, source) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
         return "applied"
 
     def auto_tag_progress_counts(self) -> Tuple[int, int, int, int]:
         conn = self.new_connection()
         try:
-            cur = conn.execute(
-                "SELECT "
-                "COUNT(*) AS total, "
-                "SUM(CASE WHEN status='ready' THEN 1 ELSE 0 END) AS completed, "
-                "SUM(CASE WHEN status IN ('pending', 'processing') THEN 1 ELSE 0 END) AS processing, "
-                "SUM(CASE WHEN status='error' THEN 1 ELSE 0 END) AS errors "
-                "FROM auto_tag_jobs",
-                (),
-            )
-            row = cur.fetchone()
-            if row is None:
-                return (0, 0, 0, 0)
-            return (
-                int(row["total"] or 0),
-                int(row["completed"] or 0),
-                int(row["processing"] or 0),
-                int(row["errors"] or 0),
+            return self._summarize_status_counts(
+                conn.execute("SELECT status, COUNT(*) FROM auto_tag_jobs GROUP BY status")
             )
         finally:
             conn.close()
 
     def rating_counts(self) -> Dict[str, int]:
-        rows = self._connection.execute(
+        rows = self._conn().execute(
             "SELECT norm, COUNT(DISTINCT image_id) AS freq FROM tags WHERE kind='rating' GROUP BY norm",
         ).fetchall()
         return {
@@ -818,13 +1315,13 @@ class LocalBooruDatabase:
         import time
 
         # Get the most recent tag modification time
-        last_modified_row = self._connection.execute(
+        last_modified_row = self._conn().execute(
             "SELECT MAX(mtime) as last_mod FROM images WHERE id IN (SELECT DISTINCT image_id FROM tags)"
         ).fetchone()
         last_modified = float(last_modified_row["last_mod"] or 0)
 
         # Get complete tag statistics
-        rows = self._connection.execute("""
+        rows = self._conn().execute("""
             SELECT tag, norm, kind, COUNT(DISTINCT image_id) as freq
             FROM tags
             GROUP BY norm, kind
@@ -862,29 +1359,32 @@ class LocalBooruDatabase:
         *,
         model: str = "wd14",
     ) -> None:
-        normalized = self._normalize_scores(scores)
+        normalized, best = self._normalize_scores(scores)
         if not normalized:
             return
-        conn = self.new_connection()
-        try:
-            with conn:
+        if self._in_batch():
+            with self._transaction() as conn:
                 self._apply_rating_scores_internal(
-                    conn, image_id, normalized, model=model
+                    conn, image_id, normalized, best, model=model
                 )
-        finally:
-            conn.close()
+            return
+        with self._writer_transaction() as conn:
+            self._apply_rating_scores_internal(
+                conn, image_id, normalized, best, model=model
+            )
 
     def _apply_rating_scores_internal(
         self,
         conn: sqlite3.Connection,
         image_id: int,
         scores: Dict[str, float],
+        best: Optional[Tuple[str, float]],
         *,
         model: str = "wd14",
     ) -> None:
-        if not scores:
+        if not scores or best is None:
             return
-        best_label, best_score = max(scores.items(), key=lambda item: item[1])
+        best_label, best_score = best
         now = time.time()
         scores_json = json.dumps(scores, sort_keys=True)
         conn.execute(
@@ -908,14 +1408,26 @@ class LocalBooruDatabase:
         )
 
     @staticmethod
-    def _normalize_scores(scores: Optional[Dict[str, float]]) -> Dict[str, float]:
-        if not scores:
-            return {}
+    def _normalize_scores(
+        scores: Optional[Dict[str, float]],
+    ) -> Tuple[Dict[str, float], Optional[Tuple[str, float]]]:
+        """Lower-case labels and drop non-numeric scores in one pass.
+
+        Returns ``(normalized, best)`` where ``best`` is the first highest
+        ``(label, score)`` pair, or ``None`` when nothing survived.
+        """
         normalized: Dict[str, float] = {}
+        best: Optional[Tuple[str, float]] = None
+        if not scores:
+            return normalized, best
         for label, value in scores.items():
             if isinstance(value, (int, float)):
-                normalized[str(label).lower()] = float(value)
-        return normalized
+                key = str(label).lower()
+                score = float(value)
+                normalized[key] = score
+                if best is None or score > best[1]:
+                    best = (key, score)
+        return normalized, best
 
     def store_rating(
         self,
@@ -925,14 +1437,9 @@ class LocalBooruDatabase:
         scores: Optional[Dict[str, float]] = None,
     ) -> None:
         now = time.time()
-        existing_scores_json = None
-        row = self._connection.execute(
-            "SELECT scores_json FROM rating_jobs WHERE image_id=?",
-            (image_id,),
-        ).fetchone()
-        if row and row["scores_json"]:
-            existing_scores_json = row["scores_json"]
-
+        # Without new scores the stored JSON is kept via COALESCE in the
+        # UPDATE below, so there is no need to read it back first.
+        scores_json = None
         if scores and isinstance(scores, dict):
             normalized = {
                 str(label).lower(): float(value)
@@ -940,57 +1447,56 @@ class LocalBooruDatabase:
                 if isinstance(value, (int, float))
             }
             scores_json = json.dumps(normalized, sort_keys=True)
-        else:
-            scores_json = existing_scores_json
 
-        with self._connection:
-            self._connection.execute(
+        with self._transaction():
+            self._conn().execute(
                 "UPDATE images SET rating=?, rating_confidence=?, rating_updated=? WHERE id=?",
                 (rating, confidence, now, image_id),
             )
-            self._connection.execute(
+            self._conn().execute(
                 "DELETE FROM tags WHERE image_id=? AND kind='rating' AND source!='auto'",
                 (image_id,),
             )
             tag = f"rating:{rating}"
             norm = rating.lower()
             raw_value = f"dbrating:{tag}:{confidence:.3f}"
-            self._connection.execute(
+            self._conn().execute(
                 """INSERT INTO tags
                    (image_id, tag, norm, kind, emphasis, weight, raw, source)
                    VALUES (?, ?, ?, 'rating', 'normal', ?, ?, 'dbrating')""",
                 (image_id, tag, norm, confidence, raw_value),
             )
-            self._connection.execute(
-                "UPDATE rating_jobs SET rating=?, confidence=?, scores_json=?, updated_at=? WHERE image_id=?",
+            self._conn().execute(
+                "UPDATE rating_jobs SET rating=?, confidence=?, "
+                "scores_json=COALESCE(?, scores_json), updated_at=? WHERE image_id=?",
                 (rating, confidence, scores_json, now, image_id),
             )
 
     # --- Query helpers -----------------------------------------------------------------
 
     def get_auto_job_status(self, image_id: int) -> Optional[str]:
-        row = self._connection.execute(
+        row = self._conn().execute(
             "SELECT status FROM auto_tag_jobs WHERE image_id=?",
             (image_id,),
         ).fetchone()
         return row["status"] if row else None
 
     def has_auto_tags(self, image_id: int) -> bool:
-        row = self._connection.execute(
-            "SELECT 1 FROM tags WHERE image_id=? AND source='auto' LIMIT 1",
+        row = self._conn().execute(
+            "SELECT EXISTS(SELECT 1 FROM tags WHERE image_id=? AND source='auto')",
             (image_id,),
         ).fetchone()
-        return bool(row)
+        return bool(row[0])
 
     def has_rating_tag(self, image_id: int) -> bool:
-        row = self._connection.execute(
-            "SELECT 1 FROM tags WHERE image_id=? AND kind='rating' LIMIT 1",
+        row = self._conn().execute(
+            "SELECT EXISTS(SELECT 1 FROM tags WHERE image_id=? AND kind='rating')",
             (image_id,),
         ).fetchone()
-        return bool(row)
+        return bool(row[0])
 
     def get_auto_job_details(self, image_id: int) -> Optional[Dict[str, object]]:
-        row = self._connection.execute(
+        row = self._conn().execute(
             "SELECT status, model, error, queued_at, updated_at FROM auto_tag_jobs WHERE image_id=?",
             (image_id,),
         ).fetchone()
@@ -1005,29 +1511,46 @@ class LocalBooruDatabase:
         }
 
     def load_auto_tag_jobs(self) -> Dict[int, Tuple[str, Optional[str]]]:
-        jobs: Dict[int, Tuple[str, Optional[str]]] = {}
-        for row in self._connection.execute(
-            "SELECT image_id, status, model FROM auto_tag_jobs",
-            (),
-        ):
-            jobs[row["image_id"]] = (row["status"], row["model"])
-        return jobs
+        return {
+            image_id: (status, model)
+            for image_id, status, model in self._tuple_cursor().execute(
+                "SELECT image_id, status, model FROM auto_tag_jobs"
+            )
+        }
 
     def load_auto_tagged_ids(self) -> Set[int]:
         return {
-            row["image_id"]
-            for row in self._connection.execute(
-                "SELECT DISTINCT image_id FROM tags WHERE source='auto'",
-                (),
+            image_id
+            for (image_id,) in self._tuple_cursor().execute(
+                "SELECT DISTINCT image_id FROM tags WHERE source='auto'"
+            )
+        }
+
+    def load_rated_ids(self) -> Set[int]:
+        return {
+            image_id
+            for (image_id,) in self._tuple_cursor().execute(
+                "SELECT DISTINCT image_id FROM tags WHERE kind='rating'"
             )
         }
 
     # --- General query helpers ---------------------------------------------------------
 
+    @staticmethod
+    def _iter_fetchmany(
+        cur: sqlite3.Cursor, size: int = 1000
+    ) -> Iterator[sqlite3.Row]:
+        """Yield rows from ``cur`` in ``fetchmany`` chunks of ``size``."""
+        cur.arraysize = size
+        while True:
+            batch = cur.fetchmany()
+            if not batch:
+                return
+            yield from batch
+
     def iter_image_paths(self) -> Iterator[str]:
-        for row in self._connection.execute(
-            "SELECT path FROM images ORDER BY mtime DESC"
-        ):
+        cur = self._conn().execute("SELECT path FROM images ORDER BY mtime DESC")
+        for row in self._iter_fetchmany(cur):
             yield row["path"]
 
     def iter_images(self, limit: int = 0, offset: int = 0) -> Iterator[sqlite3.Row]:
@@ -1036,5 +1559,4 @@ class LocalBooruDatabase:
         if limit > 0:
             sql += " LIMIT ? OFFSET ?"
             params = (limit, offset)
-        for row in self._connection.execute(sql, params):
-            yield row
+        yield from self._iter_fetchmany(self._conn().execute(sql, params))
@@ -6,8 +6,9 @@ import json
 import logging
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple, Any
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
+from . import jsonfast
 from .tags import TagRecord, read_image_metadata
 
 LOGGER = logging.getLogger(__name__)
@@ -51,6 +52,29 @@ class EnhancedImageMetadata:
     comment_meta: Optional[Dict[str, Any]] = None
 
 
+# Sampler parameter aliases per metadata field, in order of preference.
+_SAMPLER_PARAMETER_ALIASES: Tuple[
+    Tuple[str, Callable[[Any], Any], Tuple[str, ...]], ...
+] = (
+    ("seed", str, ("seed", "Seed")),
+    ("cfg_scale", float, ("cfg_scale", "CFG scale", "cfg", "CFG")),
+    ("steps", int, ("steps", "Steps", "step", "Step")),
+    ("scheduler", str, ("scheduler", "Schedule type", "schedule")),
+    (
+        "denoising_strength",
+        float,
+        ("denoise", "Denoising strength", "denoising_strength"),
+    ),
+    ("clip_skip", int, ("clip_skip", "Clip skip", "clipskip")),
+)
+# Flattened to key -> (field, coercer, preference) for a single pass over params.
+_SAMPLER_PARAMETER_FIELDS: Dict[str, Tuple[str, Callable[[Any], Any], int]] = {
+    key: (field, coerce, preference)
+    for field, coerce, keys in _SAMPLER_PARAMETER_ALIASES
+    for preference, key in enumerate(keys)
+}
+
+
 def extract_enhanced_metadata(path: Path) -> EnhancedImageMetadata:
     """Extract comprehensive metadata from an image using sd-parsers with fallback."""
     metadata = EnhancedImageMetadata()
@@ -136,55 +160,7 @@ def _extract_with_sd_parsers(path: Path, metadata: EnhancedImageMetadata) -> Non
         metadata.sampler = sampler.name
 
         # Extract common parameters with more flexible key matching
-        params = sampler.parameters or {}
-
-        # Seed extraction
-        for key in ["seed", "Seed"]:
-            if key in params and params[key] is not None:
-                metadata.seed = str(params[key])
-                break
-
-        # CFG Scale extraction
-        for key in ["cfg_scale", "CFG scale", "cfg", "CFG"]:
-            if key in params and params[key] is not None:
-                try:
-                    metadata.cfg_scale = float(params[key])
-                    break
-                except (ValueError, TypeError):
-                    pass
-
-        # Steps extraction
-        for key in ["steps", "Steps", "step", "Step"]:
-            if key in params and params[key] is not None:
-                try:
-                    metadata.steps = int(params[key])
-                    break
-                except (ValueError, TypeError):
-                    pass
-
-        # Scheduler extraction
-        for key in ["scheduler", "Schedule type", "schedule"]:
-            if key in params and params[key] is not None:
-                metadata.scheduler = str(params[key])
-                break
-
-        # Denoising strength extraction
-        for key in ["denoise", "Denoising strength", "denoising_strength"]:
-            if key in params and params[key] is not None:
-                try:
-                    metadata.denoising_strength = float(params[key])
-                    break
-                except (ValueError, TypeError):
-                    pass
-
-        # Clip skip extraction
-        for key in ["clip_skip", "Clip skip", "clipskip"]:
-            if key in params and params[key] is not None:
-                try:
-                    metadata.clip_skip = int(params[key])
-                    break
-                except (ValueError, TypeError):
-                    pass
+        _apply_sampler_parameters(metadata, sampler.parameters or {})
 
     # Also check raw_parameters for additional extraction (NovelAI JSON comment)
     if hasattr(result, "raw_parameters") and result.raw_parameters:
@@ -193,9 +169,7 @@ def _extract_with_sd_parsers(path: Path, metadata: EnhancedImageMetadata) -> Non
         # Extract from JSON comment (NovelAI style)
         if "Comment" in raw:
             try:
-                import json
-
-                comment_data = json.loads(raw["Comment"])
+                comment_data = jsonfast.loads(raw["Comment"])
 
                 # Extract steps from comment if not already set
                 if not metadata.steps and "steps" in comment_data:
@@ -230,6 +204,31 @@ def _extract_with_sd_parsers(path: Path, metadata: EnhancedImageMetadata) -> Non
                 pass
 
 
+def _apply_sampler_parameters(
+    metadata: EnhancedImageMetadata, params: Dict[str, Any]
+) -> None:
+    """Copy known sampler parameters onto *metadata* in one pass.
+
+    When several aliases of a field are present the most preferred one that
+    converts cleanly wins.
+    """
+    chosen: Dict[str, Tuple[int, Any]] = {}
+    for key, value in params.items():
+        entry = _SAMPLER_PARAMETER_FIELDS.get(key)
+        if entry is None or value is None:
+            continue
+        field, coerce, preference = entry
+        current = chosen.get(field)
+        if current is not None and current[0] < preference:
+            continue
+        try:
+            chosen[field] = (preference, coerce(value))
+        except (ValueError, TypeError):
+            pass
+    for field, (_, value) in chosen.items():
+        setattr(metadata, field, value)
+
+
 def _extract_with_legacy_parser(path: Path, metadata: EnhancedImageMetadata) -> None:
     """Extract metadata using existing LocalBooru PNG parser as fallback."""
     from .tags import collect_tags
@@ -336,7 +335,7 @@ def _serialize_extended_metadata(metadata: EnhancedImageMetadata) -> Optional[st
         return None
 
     try:
-        return json.dumps(extended)
+        return jsonfast.dumps(extended)
     except Exception as exc:
         LOGGER.warning("Failed to serialize extended metadata: %s", exc)
         return None
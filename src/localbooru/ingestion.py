@@ -2,16 +2,33 @@
 
 from __future__ import annotations
 
-import json
+import fnmatch
 import logging
+import os
+import re
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext
 from dataclasses import dataclass
 from pathlib import Path
-from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
+from stat import S_ISREG
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 from .auto_tagging import AutoTaggingUnavailable, generate_wd14_tags
-from .config import LocalBooruConfig
+from .config import AutoTagMode, LocalBooruConfig
 from .database import LocalBooruDatabase
+from . import jsonfast
 from .enhanced_metadata import (
+    EnhancedImageMetadata,
     extract_enhanced_metadata,
     metadata_to_dict,
     get_prompt_tags_from_metadata,
@@ -23,6 +40,15 @@ if TYPE_CHECKING:
 
 LOGGER = logging.getLogger(__name__)
 
+# Images ingested per database transaction during a full scan. Large enough to
+# amortize commits, small enough that worker threads waiting on the write lock
+# are not starved past the busy timeout.
+SCAN_COMMIT_INTERVAL = 64
+
+# Threads reading embedded metadata ahead of the scan loop. PNG chunk reads and
+# sd-parsers work overlap here while the scan thread keeps all DB writes.
+SCAN_PARSE_WORKERS = min(8, os.cpu_count() or 4)
+
 # Supported image file patterns - PNG first for NovelAI metadata priority
 IMAGE_PATTERNS: Sequence[str] = (
     "*.png",
@@ -48,14 +74,18 @@ IMAGE_PATTERNS: Sequence[str] = (
 class IngestAutoContext:
     jobs: Dict[int, Tuple[str, Optional[str]]]
     auto_tagged: set[int]
+    # None when rating tags were not prefetched; callers then ask the database.
+    rated: Optional[set[int]]
 
     def __init__(
         self,
         jobs: Optional[Dict[int, Tuple[str, Optional[str]]]] = None,
         auto_tagged: Optional[set[int]] = None,
+        rated: Optional[set[int]] = None,
     ):
         self.jobs = jobs or {}
         self.auto_tagged = auto_tagged or set()
+        self.rated = rated
 
     def job_info(self, image_id: int) -> Optional[Tuple[str, Optional[str]]]:
         return self.jobs.get(image_id)
@@ -82,6 +112,26 @@ class IngestAutoContext:
     def remove_auto_tags(self, image_id: int) -> None:
         self.auto_tagged.discard(image_id)
 
+    def has_rating(self, image_id: int) -> Optional[bool]:
+        if self.rated is None:
+            return None
+        return image_id in self.rated
+
+    def set_rating(self, image_id: int, present: bool) -> None:
+        if self.rated is None:
+            return
+        if present:
+            self.rated.add(image_id)
+        else:
+            self.rated.discard(image_id)
+
+
+def _has_rating(
+    db: LocalBooruDatabase, context: Optional[IngestAutoContext], image_id: int
+) -> bool:
+    known = context.has_rating(image_id) if context is not None else None
+    return db.has_rating_tag(image_id) if known is None else known
+
 
 def ingest_path(
     db: LocalBooruDatabase,
@@ -89,38 +139,50 @@ def ingest_path(
     path: Path,
     *,
     context: Optional[IngestAutoContext] = None,
+    metadata: Optional[EnhancedImageMetadata] = None,
+    file_stat: Optional[os.stat_result] = None,
+    existing_stats: Optional[Mapping[str, Tuple[float, int, int]]] = None,
 ) -> Optional[int]:
     root = config.root
-    if not path.is_file():
+    if file_stat is None:
+        if not path.is_file():
+            return None
+        stat = path.stat()
+    elif not S_ISREG(file_stat.st_mode):
         return None
+    else:
+        stat = file_stat
     try:
         rel_path = path.relative_to(root).as_posix()
     except ValueError:
         # Fallback for extra roots - compute relative with respect to path drive
         rel_path = path.as_posix()
-    stat = path.stat()
-    existing = db.lookup_image(rel_path)
-    unchanged = False
-    if existing is not None:
-        if (
-            abs(existing["mtime"] - stat.st_mtime) < 1e-6
-            and existing["size"] == stat.st_size
-        ):
-            unchanged = True
+    # (mtime, size, id) from the scan's prefetched snapshot, else one lookup
+    if existing_stats is not None:
+        known = existing_stats.get(rel_path)
+    else:
+        row = db.lookup_image(rel_path)
+        known = (row["mtime"], row["size"], row["id"]) if row is not None else None
+    # SQLite REAL is an IEEE double, so the stored st_mtime round-trips
+    # exactly and can be compared for equality.
+    unchanged = (
+        known is not None and known[0] == stat.st_mtime and known[1] == stat.st_size
+    )
 
     if unchanged:
-        image_id = existing["id"]
+        image_id = known[2]
         changed = False
         tags = []
-        description_text = (
-            existing["description"] if "description" in existing.keys() else None
-        )
+        description_text = None
         comment_meta = {}
         chunks = {}
         enhanced_metadata = None
     else:
-        # Use enhanced metadata extraction with sd-parsers
-        enhanced_metadata = extract_enhanced_metadata(path)
+        # Use enhanced metadata extraction with sd-parsers, unless the scan
+        # already parsed this file on a worker thread
+        enhanced_metadata = (
+            metadata if metadata is not None else extract_enhanced_metadata(path)
+        )
 
         # Get tags from enhanced metadata or fallback to legacy parsing
         tags = get_prompt_tags_from_metadata(enhanced_metadata)
@@ -131,18 +193,18 @@ def ingest_path(
         chunks = enhanced_metadata.raw_chunks or {}
 
     auto_enabled = config.auto_tag_missing
-    auto_mode = (config.auto_tag_mode or "missing").lower()
+    auto_mode = config.auto_tag_mode
     auto_tags: List[TagRecord] = []
     manual_tags_present = bool(tags)
 
     auto_rating_scores: Optional[Dict[str, float]] = None
     if auto_enabled and not config.auto_tag_background:
         if unchanged:
-            missing_auto_rating = not db.has_rating_tag(image_id)
+            missing_auto_rating = not _has_rating(db, context, image_id)
         else:
             missing_auto_rating = True
         should_generate = (
-            auto_mode == "augment" or not manual_tags_present or missing_auto_rating
+            auto_mode is AutoTagMode.AUGMENT or not manual_tags_present or missing_auto_rating
         )
         if should_generate:
             try:
@@ -205,7 +267,7 @@ def ingest_path(
                 or comment_meta.get("Source")
                 or comment_meta.get("source")
             )
-            metadata_blob = json.dumps(comment_meta) if comment_meta else None
+            metadata_blob = jsonfast.dumps(comment_meta) if comment_meta else None
 
         image_id, changed = db.upsert_image_record(
             rel_path=rel_path,
@@ -230,9 +292,6 @@ def ingest_path(
             sampler=enhanced_metadata.sampler if enhanced_metadata else None,
             scheduler=enhanced_metadata.scheduler if enhanced_metadata else None,
         )
-    else:
-        image_id = existing["id"]
-        changed = False
     if auto_rating_scores:
         db.update_rating_from_scores(image_id, auto_rating_scores)
     if auto_enabled:
@@ -243,7 +302,13 @@ def ingest_path(
         else:
             job_status = db.get_auto_job_status(image_id)
             existing_auto_tags = db.has_auto_tags(image_id)
-        missing_auto_rating = not db.has_rating_tag(image_id)
+        if changed or auto_rating_scores:
+            has_rating = db.has_rating_tag(image_id)
+            if context is not None:
+                context.set_rating(image_id, has_rating)
+        else:
+            has_rating = _has_rating(db, context, image_id)
+        missing_auto_rating = not has_rating
 
         if config.auto_tag_background:
             if job_status in {"pending", "processing"} and existing_auto_tags:
@@ -260,7 +325,7 @@ def ingest_path(
                 needs_job = False
                 if job_status in {"ready", "skipped"} and not changed:
                     needs_job = False
-                elif auto_mode == "augment":
+                elif auto_mode is AutoTagMode.AUGMENT:
                     if changed or missing_auto_rating:
                         needs_job = True
                     elif (
@@ -341,6 +406,58 @@ def _safe_int(value: object) -> Optional[int]:
         return None
 
 
+def _iter_image_entries(
+    root: Path, patterns: Sequence[str]
+) -> Iterator[Tuple[int, Path, os.stat_result]]:
+    """Walk *root* once, yielding ``(pattern_index, path, stat)`` for matches.
+
+    Like ``Path.rglob`` this does not descend into symlinked directories,
+    skips directories it cannot read, and matches case-insensitively where
+    the platform's paths are (``os.path.normcase`` folds case).
+    """
+    flags = re.IGNORECASE if os.path.normcase("A") == "a" else 0
+    matchers = [
+        re.compile(fnmatch.translate(pattern), flags).match for pattern in patterns
+    ]
+    stack = [os.fspath(root)]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                            continue
+                    except OSError:
+                        continue
+                    for index, match in enumerate(matchers):
+                        if match(entry.name):
+                            try:
+                                yield index, Path(entry.path), entry.stat()
+                            except OSError:
+                                pass
+                            break
+        except OSError:
+            continue
+
+
+def _metadata_is_stale(
+    existing_stats: Mapping[str, Tuple[float, int, int]],
+    config: LocalBooruConfig,
+    path: Path,
+    file_stat: os.stat_result,
+) -> bool:
+    """Whether ``ingest_path`` would re-read the embedded metadata of *path*."""
+    try:
+        rel_path = path.relative_to(config.root).as_posix()
+    except ValueError:
+        rel_path = path.as_posix()
+    known = existing_stats.get(rel_path)
+    if known is None:
+        return True
+    return not (known[0] == file_stat.st_mtime and known[1] == file_stat.st_size)
+
+
 def scan_images(
     db: LocalBooruDatabase,
     config: LocalBooruConfig,
@@ -348,48 +465,107 @@ def scan_images(
     progress: Optional["ScanProgress"] = None,
 ) -> None:
     roots = list(config.roots)
-    all_candidates: list[Path] = []
+    all_candidates: list[Tuple[Path, os.stat_result]] = []
     seen_candidates: set[str] = set()
     observed_paths: set[str] = set()
     context: Optional[IngestAutoContext] = None
     if config.auto_tag_missing:
         jobs = db.load_auto_tag_jobs()
         tagged_ids = db.load_auto_tagged_ids()
-        context = IngestAutoContext(jobs=jobs, auto_tagged=tagged_ids)
+        context = IngestAutoContext(
+            jobs=jobs, auto_tagged=tagged_ids, rated=db.load_rated_ids()
+        )
+    # One snapshot of stored (mtime, size, id) replaces a lookup per file.
+    existing_stats = db.load_image_stats()
+    # Use configurable image patterns from config
+    patterns = getattr(config, "image_patterns", IMAGE_PATTERNS)
     for root in roots:
-        # Use configurable image patterns from config
-        patterns = getattr(config, "image_patterns", IMAGE_PATTERNS)
-        for pattern in patterns:
-            for path in Path(root).rglob(pattern):
-                key = path.as_posix()
-                if key in seen_candidates:
-                    continue
-                seen_candidates.add(key)
-                all_candidates.append(path)
+        # One directory walk per root; bucket by pattern so earlier patterns
+        # (PNG first) are still ingested first.
+        buckets: list[list[Tuple[Path, os.stat_result]]] = [[] for _ in patterns]
+        for index, path, file_stat in _iter_image_entries(Path(root), patterns):
+            key = path.as_posix()
+            if key in seen_candidates:
+                continue
+            seen_candidates.add(key)
+            buckets[index].append((path, file_stat))
+        for bucket in buckets:
+            all_candidates.extend(bucket)
 
     if progress is not None:
         progress.begin(len(all_candidates))
 
-    for path in all_candidates:
-        if progress is not None:
-            progress.step_start(path.as_posix())
-        encountered_error = False
-        try:
-            ingest_path(db, config, path, context=context)
-            try:
-                rel_path = path.relative_to(config.root).as_posix()
-            except ValueError:
-                rel_path = path.as_posix()
-                observed_paths.add(rel_path)
-            else:
-                observed_paths.add(rel_path)
-                observed_paths.add(path.as_posix())
-        except Exception as exc:  # pragma: no cover - defensive
-            encountered_error = True
-            LOGGER.exception("Failed to ingest %s: %s", path, exc)
-        finally:
-            if progress is not None:
-                progress.step_finish(error=encountered_error)
+    # An initial import writes every tag; build the FTS index once at the end
+    # instead of maintaining it row by row.
+    import_scope = db.bulk_import() if not db.has_images() else nullcontext()
+    parse_pool = ThreadPoolExecutor(
+        max_workers=SCAN_PARSE_WORKERS, thread_name_prefix="scan-parse"
+    )
+
+    def submit_parses(
+        chunk: Sequence[Tuple[Path, os.stat_result]]
+    ) -> Dict[Path, Future]:
+        return {
+            path: parse_pool.submit(extract_enhanced_metadata, path)
+            for path, file_stat in chunk
+            if S_ISREG(file_stat.st_mode)
+            and _metadata_is_stale(existing_stats, config, path, file_stat)
+        }
+
+    chunks = [
+        all_candidates[start : start + SCAN_COMMIT_INTERVAL]
+        for start in range(0, len(all_candidates), SCAN_COMMIT_INTERVAL)
+    ]
+    # Inline WD14 inference runs inside ingest_path; holding a batch's write
+    # lock across it would stall the background writers, so commit per image.
+    inline_tagging = config.auto_tag_missing and not config.auto_tag_background
+    with import_scope, parse_pool:
+        parsed = submit_parses(chunks[0]) if chunks else {}
+        for index, chunk in enumerate(chunks):
+            # Queue the next chunk's parses so they run during this commit.
+            upcoming = (
+                submit_parses(chunks[index + 1]) if index + 1 < len(chunks) else {}
+            )
+            # Wait for this chunk's parses before taking the write lock.
+            results: Dict[Path, Union[EnhancedImageMetadata, Exception]] = {}
+            for path, future in parsed.items():
+                try:
+                    results[path] = future.result()
+                except Exception as exc:  # re-raised in the per-image handler
+                    results[path] = exc
+            with nullcontext() if inline_tagging else db.batch():
+                for path, file_stat in chunk:
+                    if progress is not None:
+                        progress.step_start(path.as_posix())
+                    encountered_error = False
+                    try:
+                        metadata = results.pop(path, None)
+                        if isinstance(metadata, Exception):
+                            raise metadata
+                        ingest_path(
+                            db,
+                            config,
+                            path,
+                            context=context,
+                            metadata=metadata,
+                            file_stat=file_stat,
+                            existing_stats=existing_stats,
+                        )
+                        try:
+                            rel_path = path.relative_to(config.root).as_posix()
+                        except ValueError:
+                            rel_path = path.as_posix()
+                            observed_paths.add(rel_path)
+                        else:
+                            observed_paths.add(rel_path)
+                            observed_paths.add(path.as_posix())
+                    except Exception as exc:  # pragma: no cover - defensive
+                        encountered_error = True
+                        LOGGER.exception("Failed to ingest %s: %s", path, exc)
+                    finally:
+                        if progress is not None:
+                            progress.step_finish(error=encountered_error)
+            parsed = upcoming
     if progress is not None:
         progress.finish()
     if observed_paths:
@@ -0,0 +1,33 @@
+"""JSON encode/decode via orjson when installed, the stdlib otherwise."""
+
+from __future__ import annotations
+
+import json
+from typing import Any, Union
+
+try:  # pragma: no cover - optional orjson dependency
+    import orjson
+except ModuleNotFoundError:  # pragma: no cover - fallback path
+    orjson = None  # type: ignore[assignment]
+
+
+def dumps(value: Any) -> str:
+    """Serialize *value* to a JSON string."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(value).decode("utf-8")
+        except TypeError:
+            # Non-str keys and out-of-range ints: let the stdlib decide.
+            pass
+    return json.dumps(value)
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    """Parse JSON text; raises ``json.JSONDecodeError`` on invalid input."""
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # The stdlib also accepts NaN/Infinity literals.
+            pass
+    return json.loads(data)
@@ -6,7 +6,7 @@ import logging
 import threading
 import time
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional
+from typing import List, NamedTuple, Optional
 
 from pathlib import Path
 
@@ -19,6 +19,18 @@ from .ingestion import scan_images
 LOGGER = logging.getLogger(__name__)
 
 
+class ScanSnapshot(NamedTuple):
+    total: int
+    processed: int
+    errors: int
+    state: str
+    current_path: Optional[str]
+    started_at: Optional[float]
+    last_update: Optional[float]
+    rate_per_min: float
+    eta_seconds: Optional[float]
+
+
 @dataclass
 class ScanProgress:
     total: int = 0
@@ -68,21 +80,20 @@ class ScanProgress:
             self.current_path = None
             self.last_update = time.time()
 
-    def snapshot(self) -> Dict[str, object]:
+    def snapshot(self) -> ScanSnapshot:
         with self._lock:
-            data = {
-                "total": self.total,
-                "processed": self.processed,
-                "errors": self.errors,
-                "state": self.state,
-                "current_path": self.current_path,
-                "started_at": self.started_at,
-                "last_update": self.last_update,
-            }
             rate_per_min, eta_seconds = self._compute_rate_eta()
-            data["rate_per_min"] = rate_per_min
-            data["eta_seconds"] = eta_seconds
-            return data
+            return ScanSnapshot(
+                total=self.total,
+                processed=self.processed,
+                errors=self.errors,
+                state=self.state,
+                current_path=self.current_path,
+                started_at=self.started_at,
+                last_update=self.last_update,
+                rate_per_min=rate_per_min,
+                eta_seconds=eta_seconds,
+            )
 
     def _compute_rate_eta(self) -> tuple[float, Optional[float]]:
         if len(self.history) < 2:
@@ -191,12 +202,7 @@ class Scanner(threading.Thread):
             rel_path = path.relative_to(self.config.root).as_posix()
         except ValueError:
             rel_path = path.as_posix()
-        conn = self.db.connection
-        with conn:
-            deleted_count = conn.execute(
-                "DELETE FROM images WHERE path = ?",
-                (rel_path,),
-            ).rowcount
+        deleted_count = self.db.delete_image(rel_path)
         if deleted_count > 0:
             LOGGER.info("Marked %s as deleted (%d rows)", path, deleted_count)
         else:
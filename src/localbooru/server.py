@@ -315,7 +315,9 @@ class LocalBooruRequestHandler(BaseHTTPRequestHandler):
         progress: ClipProgress = self.server.progress  # type: ignore[attr-defined]
         payload = progress.snapshot(self.server.db)  # type: ignore[attr-defined]
         config: Optional[LocalBooruConfig] = getattr(self.server, "config", None)
-        payload["enabled"] = bool(config and getattr(config, "clip_enabled", False))
+        payload["enabled"] = bool(
+            config and getattr(config, "clip_enabled", False) and not progress.disabled
+        )
         blob = json.dumps(payload).encode("utf-8")
         self.send_response(HTTPStatus.OK)
         self.send_header("Content-Type", "application/json")
@@ -730,7 +732,10 @@ class LocalBooruRequestHandler(BaseHTTPRequestHandler):
         auto_enabled = False
         config: Optional[LocalBooruConfig] = getattr(self.server, "config", None)  # type: ignore[attr-defined]
         if config:
-            clip_enabled = bool(getattr(config, "clip_enabled", False))
+            progress: Optional[ClipProgress] = getattr(self.server, "progress", None)  # type: ignore[attr-defined]
+            clip_enabled = bool(getattr(config, "clip_enabled", False)) and not (
+                progress is not None and progress.disabled
+            )
             auto_enabled = bool(
                 getattr(config, "auto_tag_background", False)
                 or getattr(config, "auto_tag_missing", False)
@@ -1016,7 +1021,10 @@ class LocalBooruRequestHandler(BaseHTTPRequestHandler):
 
     def _handle_clip_embed(self) -> None:
         config: LocalBooruConfig = self.server.config  # type: ignore[attr-defined]
-        if not getattr(config, "clip_enabled", False):
+        progress: Optional[ClipProgress] = getattr(self.server, "progress", None)  # type: ignore[attr-defined]
+        if not getattr(config, "clip_enabled", False) or (
+            progress is not None and progress.disabled
+        ):
             self.send_error(HTTPStatus.BAD_REQUEST, "CLIP indexing disabled")
             return
 
@@ -8,8 +8,14 @@ import re
 from pathlib import Path
 from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 
+from . import jsonfast
+
 PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
 
+# Only these chunk bodies are read; pixel data and everything else is skipped.
+# Text chunks may legally follow IDAT, so the walk still runs to IEND.
+PNG_METADATA_CHUNKS = frozenset({b"IHDR", b"tEXt", b"iTXt", b"zTXt"})
+
 # JPEG file signatures
 JPEG_SIGNATURES = (
     b"\xff\xd8\xff\xe0",  # JFIF
@@ -381,18 +387,25 @@ def parse_prompt_tags(prompt: str, kind: str = "prompt") -> List[TagRecord]:
 def read_png_metadata(path: Path) -> Dict[str, str]:
     """Read PNG chunk metadata (for NovelAI images)."""
     out: Dict[str, str] = {}
-    with path.open("rb") as fh:
+    # Unbuffered: skipped chunks are seeked over rather than pulled into a
+    # read buffer, so only chunk headers and metadata bodies are read.
+    with path.open("rb", buffering=0) as fh:
         signature = fh.read(8)
         if signature != PNG_SIGNATURE:
             return out
         while True:
-            length_bytes = fh.read(4)
-            if not length_bytes:
+            header = fh.read(8)
+            if len(header) < 8:
+                break
+            length = int.from_bytes(header[:4], "big")
+            chunk_type = header[4:]
+            if chunk_type == b"IEND":
                 break
-            length = int.from_bytes(length_bytes, "big")
-            chunk_type = fh.read(4)
+            if chunk_type not in PNG_METADATA_CHUNKS:
+                fh.seek(length + 4, 1)  # body and CRC
+                continue
             data = fh.read(length)
-            fh.read(4)  # CRC
+            fh.seek(4, 1)  # CRC
             if chunk_type == b"IHDR" and length >= 8:
                 width = int.from_bytes(data[0:4], "big")
                 height = int.from_bytes(data[4:8], "big")
@@ -448,8 +461,6 @@ def read_png_metadata(path: Path) -> Dict[str, str]:
                 except Exception:
                     value = text.decode("utf-8", "replace")
                 out[key.decode("latin-1")] = value
-            elif chunk_type == b"IEND":
-                break
     return out
 
 
@@ -458,7 +469,7 @@ def load_comment_metadata(chunks: Dict[str, str]) -> Dict[str, object]:
     if not comment:
         return {}
     try:
-        return json.loads(comment)
+        return jsonfast.loads(comment)
     except json.JSONDecodeError:
         return {}
 
@@ -0,0 +1,33 @@
+"""Shared test helpers."""
+
+from __future__ import annotations
+
+from typing import Any, Dict
+
+from localbooru.database import LocalBooruDatabase
+
+
+def image_record(rel_path: str, **overrides: Any) -> Dict[str, Any]:
+    """Keyword arguments for ``upsert_image_record`` with neutral defaults."""
+    fields: Dict[str, Any] = dict(
+        rel_path=rel_path,
+        name=rel_path,
+        mtime=0.0,
+        size=1,
+        width=1,
+        height=1,
+        seed=None,
+        model=None,
+        source=None,
+        description=None,
+        metadata_json=None,
+        tags=[],
+    )
+    fields.update(overrides)
+    return fields
+
+
+def insert_image(db: LocalBooruDatabase, rel_path: str, **overrides: Any) -> int:
+    """Upsert an image row built by :func:`image_record` and return its id."""
+    image_id, _ = db.upsert_image_record(**image_record(rel_path, **overrides))
+    return image_id
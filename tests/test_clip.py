@@ -0,0 +1,254 @@
+from __future__ import annotations
+
+import sys
+import threading
+import types
+import time
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from localbooru import clip
+from localbooru.clip import (
+    ClipIndexer,
+    ClipProgress,
+    decode_clip_vector,
+    quantize_clip_vectors,
+)
+from localbooru.config import LocalBooruConfig
+from localbooru.database import LocalBooruDatabase
+
+from helpers import insert_image
+
+
+class _FakeModel:
+    feature_dim = 4
+
+    def __init__(self) -> None:
+        self.calls: list[int] = []
+
+    def compute_image_features(self, images):
+        self.calls.append(len(images))
+        rows = []
+        for img in images:
+            red, green, blue = img.getpixel((0, 0))
+            rows.append([red, green, blue, 1.0])
+        matrix = np.asarray(rows, dtype=np.float32)
+        return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+def _add_image(db: LocalBooruDatabase, root: Path, name: str, color) -> int:
+    path = root / name
+    Image.new("RGB", (2, 2), color=color).save(path)
+    return insert_image(db, name, width=2, height=2)
+
+
+def test_clip_indexer_stores_vectors_and_flags_missing_files(tmp_path):
+    root = tmp_path / "gallery"
+    root.mkdir()
+    config = LocalBooruConfig(
+        root=root,
+        db_path=tmp_path / "db.sqlite",
+        thumb_cache=tmp_path / "thumbs",
+        clip_batch_size=2,
+        auto_tag_missing=False,
+    )
+    db = LocalBooruDatabase(config.db_path)
+    try:
+        colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255)]
+        image_ids = [
+            _add_image(db, root, f"img_{index}.png", color)
+            for index, color in enumerate(colors)
+        ]
+        missing_id = _add_image(db, root, "gone.png", (1, 1, 1))
+        (root / "gone.png").unlink()
+        for image_id in [*image_ids, missing_id]:
+            db.ensure_clip_entry(image_id, config.clip_model_key)
+
+        progress = ClipProgress(model_key=config.clip_model_key)
+        indexer = ClipIndexer(db=db, config=config, progress=progress)
+        model = _FakeModel()
+        indexer._model = model
+        indexer.process_until_empty()
+
+        assert db.clip_progress_counts(config.clip_model_key) == (4, 3, 0, 1)
+        for image_id, color in zip(image_ids, colors):
+            blob, scale = db.fetch_clip_vector_record(image_id, config.clip_model_key)
+            assert len(blob) == 4
+            vector = decode_clip_vector(blob, scale)
+            expected = np.asarray([*color, 1.0], dtype=np.float32)
+            np.testing.assert_allclose(
+                vector, expected / np.linalg.norm(expected), atol=0.01
+            )
+        assert sum(model.calls) == 3
+    finally:
+        db.close()
+
+
+def test_clip_indexer_releases_prefetched_batch(tmp_path):
+    root = tmp_path / "gallery"
+    root.mkdir()
+    config = LocalBooruConfig(
+        root=root,
+        db_path=tmp_path / "db.sqlite",
+        thumb_cache=tmp_path / "thumbs",
+        clip_batch_size=1,
+        auto_tag_missing=False,
+    )
+    db = LocalBooruDatabase(config.db_path)
+    try:
+        image_ids = [
+            _add_image(db, root, f"img_{index}.png", (index, 0, 0)) for index in range(2)
+        ]
+        for image_id in image_ids:
+            db.ensure_clip_entry(image_id, config.clip_model_key)
+
+        progress = ClipProgress(model_key=config.clip_model_key)
+        indexer = ClipIndexer(db=db, config=config, progress=progress)
+        indexer._model = _FakeModel()
+        assert indexer._process_batch()
+        assert indexer._next_batch is not None
+
+        # Stopping or pausing hands the prefetched row back to the queue.
+        indexer._release_prefetched()
+        assert indexer._next_batch is None
+        assert db.clip_progress_counts(config.clip_model_key) == (2, 1, 1, 0)
+        status = db.connection.execute(
+            "SELECT status FROM clip_embeddings WHERE image_id=?", (image_ids[1],)
+        ).fetchone()[0]
+        assert status == "pending"
+    finally:
+        db.close()
+
+
+def test_quantize_clip_vectors_round_trips_within_one_step():
+    rng = np.random.default_rng(0)
+    matrix = rng.standard_normal((5, 16)).astype(np.float32)
+    matrix[2] = 0.0
+    codes, scales = quantize_clip_vectors(matrix)
+
+    assert codes.dtype == np.int8
+    assert np.abs(codes).max() == 127
+    for row, code, scale in zip(matrix, codes, scales):
+        decoded = decode_clip_vector(code.tobytes(), float(scale))
+        np.testing.assert_allclose(decoded, row, atol=float(scale) / 2 + 1e-6)
+
+
+def test_decode_clip_vector_reads_legacy_float32_blobs():
+    vector = np.asarray([0.25, -0.5, 1.0], dtype=np.float32)
+    np.testing.assert_array_equal(decode_clip_vector(vector.tobytes(), None), vector)
+
+
+def test_get_clip_model_loads_once_under_concurrency(tmp_path, monkeypatch):
+
+    created = []
+    barrier = threading.Barrier(4)
+
+    class _SlowModel:
+        def __init__(self, **kwargs):
+            created.append(kwargs)
+            time.sleep(0.05)
+
+    monkeypatch.setattr(clip, "_OpenClipModel", _SlowModel)
+    monkeypatch.setattr(clip, "_MODEL_CACHE", {})
+    config = LocalBooruConfig(
+        root=tmp_path, db_path=tmp_path / "db.sqlite", thumb_cache=tmp_path / "t"
+    )
+    results = []
+
+    def worker():
+        barrier.wait()
+        results.append(clip.get_clip_model(config))
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(created) == 1
+    assert all(model is results[0] for model in results)
+
+
+def test_open_rgb_decodes_jpeg_with_turbojpeg_when_available(tmp_path, monkeypatch):
+    decoded = []
+
+    class _FakeTurbo:
+        def decode(self, data, pixel_format):
+            decoded.append(len(data))
+            return np.full((2, 3, 3), 7, dtype=np.uint8)
+
+    fake_module = types.SimpleNamespace(TurboJPEG=_FakeTurbo, TJPF_RGB=0)
+    monkeypatch.setitem(sys.modules, "turbojpeg", fake_module)
+    monkeypatch.setattr(clip, "_TURBOJPEG", None)
+    jpeg_path = tmp_path / "photo.jpg"
+    png_path = tmp_path / "art.png"
+    Image.new("RGB", (4, 4), color=(1, 2, 3)).save(jpeg_path)
+    Image.new("RGB", (4, 4), color=(1, 2, 3)).save(png_path)
+
+    jpeg = clip._open_rgb(jpeg_path)
+    png = clip._open_rgb(png_path)
+
+    assert len(decoded) == 1
+    assert jpeg.size == (3, 2) and jpeg.getpixel((0, 0)) == (7, 7, 7)
+    assert png.size == (4, 4) and png.getpixel((0, 0)) == (1, 2, 3)
+
+
+def test_clip_progress_rate_uses_newest_sample_older_than_a_second(monkeypatch):
+    progress = ClipProgress(model_key="test", queued=30)
+    clock = iter([100.0, 100.4, 101.0, 101.6, 102.0, 102.5])
+    monkeypatch.setattr(clip.time, "time", lambda: next(clock))
+    for completed in (0, 2, 4, 4, 10):
+        progress._record_history(completed)
+
+    assert progress.history == [(100.0, 0), (100.4, 2), (101.6, 4), (102.0, 10)]
+    rate, eta = progress._compute_rate_eta()
+    # (10 - 2) over (102.0 - 100.4) seconds.
+    assert rate == pytest.approx(8 / 1.6 * 60.0)
+    assert eta == pytest.approx(30 / rate * 60.0)
+    assert progress.snapshot()["history"] == progress.history
+
+
+def test_clip_progress_rate_survives_count_reset(monkeypatch):
+    progress = ClipProgress(model_key="test", queued=5)
+    clock = iter([10.0, 12.0, 14.0])
+    monkeypatch.setattr(clip.time, "time", lambda: next(clock))
+    for completed in (3, 50, 5):
+        progress._record_history(completed)
+
+    rate, _ = progress._compute_rate_eta()
+    assert rate == pytest.approx((5 - 3) / 4.0 * 60.0)
+
+
+def test_compiled_encoder_first_call_is_serialized_and_falls_back(tmp_path):
+    active = []
+    overlaps = []
+
+    def compiled(tensors):
+        active.append(tensors)
+        overlaps.append(len(active))
+        time.sleep(0.02)
+        active.pop()
+        raise RuntimeError("dynamo failed")
+
+    model = clip._OpenClipModel.__new__(clip._OpenClipModel)
+    model._model = types.SimpleNamespace(encode_image=lambda tensors: ("eager", tensors))
+    model._encode_image = compiled
+    model._compile_lock = threading.Lock()
+    model._compiled_warm = False
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda i=i: results.append(model._encode(i)))
+        for i in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert overlaps == [1]
+    assert sorted(results) == [("eager", i) for i in range(4)]
+    assert model._encode_image is model._model.encode_image
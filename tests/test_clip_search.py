@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+import sys
+import types
+
+import numpy as np
+
+from localbooru import clip_search
+from localbooru.clip import quantize_clip_vectors
+from localbooru.config import LocalBooruConfig
+from localbooru.database import LocalBooruDatabase
+
+from helpers import insert_image
+
+
+class _FakeModel:
+    feature_dim = 3
+
+    def compute_text_features(self, queries):
+        return np.asarray([[1.0, 0.0, 0.0]] * len(queries), dtype=np.float32)
+
+
+def _add_image(db: LocalBooruDatabase, name: str, model: str) -> int:
+    image_id = insert_image(db, name)
+    db.ensure_clip_entry(image_id, model)
+    return image_id
+
+
+def test_perform_clip_search_ranks_quantized_and_legacy_rows(tmp_path, monkeypatch):
+    config = LocalBooruConfig(
+        root=tmp_path, db_path=tmp_path / "db.sqlite", thumb_cache=tmp_path / "t"
+    )
+    monkeypatch.setattr(clip_search, "get_clip_model", lambda _config: _FakeModel())
+    key = config.clip_model_key
+    db = LocalBooruDatabase(config.db_path)
+    try:
+        vectors = np.asarray(
+            [[1.0, 0.0, 0.0], [0.6, 0.8, 0.0], [0.0, 0.0, 1.0]], dtype=np.float32
+        )
+        ids = [_add_image(db, f"img_{i}.png", key) for i in range(len(vectors))]
+        codes, scales = quantize_clip_vectors(vectors[:2])
+        db.store_clip_vectors(
+            key,
+            [
+                (ids[0], codes[0].tobytes(), float(scales[0])),
+                (ids[1], codes[1].tobytes(), float(scales[1])),
+            ],
+        )
+        db.store_clip_vector(ids[2], key, vectors[2].tobytes())
+
+        results = clip_search.perform_clip_search(db, config, positive_text=["red"])
+        assert [image_id for image_id, _ in results] == ids
+        assert abs(results[0][1] - 1.0) < 1e-5
+        assert abs(results[1][1] - 0.6) < 0.01
+
+        restricted = clip_search.perform_clip_search(
+            db, config, positive_text=["red"], restrict_to_ids=[ids[2]], limit=5
+        )
+        assert [image_id for image_id, _ in restricted] == [ids[2]]
+
+        similar = clip_search.perform_clip_search(
+            db, config, positive_images=[ids[1]], limit=1
+        )
+        assert [image_id for image_id, _ in similar] == [ids[1]]
+    finally:
+        db.close()
+
+
+def test_clip_matrix_cache_rebuilds_after_vector_writes(tmp_path):
+    db = LocalBooruDatabase(tmp_path / "db.sqlite")
+    try:
+        ids = [_add_image(db, f"img_{i}.png", "test") for i in range(2)]
+        codes, scales = quantize_clip_vectors(
+            np.asarray([[1.0, 0.0], [0.0, 1.0]], dtype=np.float32)
+        )
+        db.store_clip_vectors("test", [(ids[0], codes[0].tobytes(), float(scales[0]))])
+
+        cache = clip_search.ClipMatrixCache.for_database(db, "test")
+        cached_ids, cached_codes, _, legacy = cache.load(db, "test")
+        assert cached_ids.tolist() == [ids[0]]
+        assert legacy == 0
+        assert (cache.directory / "codes.npy").exists()
+
+        reopened = clip_search.ClipMatrixCache(cache.directory)
+        assert reopened.load(db, "test")[0].tolist() == [ids[0]]
+
+        db.store_clip_vectors("test", [(ids[1], codes[1].tobytes(), float(scales[1]))])
+        cached_ids, cached_codes, _, _ = cache.load(db, "test")
+        assert cached_ids.tolist() == ids
+        assert cached_codes.tolist() == codes.tolist()
+    finally:
+        db.close()
+
+
+def test_clip_matrix_cache_merges_deltas_without_full_reload(tmp_path, monkeypatch):
+    db = LocalBooruDatabase(tmp_path / "db.sqlite")
+    try:
+        ids = [_add_image(db, f"img_{i}.png", "test") for i in range(3)]
+        codes, scales = quantize_clip_vectors(
+            np.asarray([[1.0, 0.0], [0.0, 1.0], [1.0, 1.0]], dtype=np.float32)
+        )
+        rows = [(i, c.tobytes(), float(s)) for i, c, s in zip(ids, codes, scales)]
+        db.store_clip_vectors("test", rows[:2])
+        cache = clip_search.ClipMatrixCache.for_database(db, "test")
+        cache.load(db, "test")
+
+        full_loads = []
+        original = db.load_clip_matrix
+
+        def tracking(model, allowed_ids=None, **kwargs):
+            if kwargs.get("updated_since") is None:
+                full_loads.append(model)
+            return original(model, allowed_ids, **kwargs)
+
+        monkeypatch.setattr(db, "load_clip_matrix", tracking)
+        db.store_clip_vectors("test", rows[2:])
+        cached_ids, cached_codes, _, _ = cache.load(db, "test")
+        assert sorted(cached_ids.tolist()) == ids
+        assert full_loads == []
+
+        # Re-queued rows leave the matrix without a full reload as well.
+        db.ensure_clip_entry(ids[0], "test", force_reset=True)
+        cached_ids, _, _, _ = cache.load(db, "test")
+        assert sorted(cached_ids.tolist()) == ids[1:]
+        assert full_loads == []
+
+        # A fresh cache starts from the files on disk and catches up by delta.
+        reopened = clip_search.ClipMatrixCache(cache.directory)
+        assert sorted(reopened.load(db, "test")[0].tolist()) == ids[1:]
+        assert full_loads == []
+    finally:
+        db.close()
+
+
+class _FakeFaissIndex:
+    def __init__(self, inner=None):
+        self.ids = np.empty(0, dtype=np.int64)
+        self.matrix = None
+
+    def add_with_ids(self, matrix, ids):
+        if self.matrix is None:
+            self.matrix, self.ids = matrix, ids
+        else:
+            self.matrix = np.concatenate([self.matrix, matrix])
+            self.ids = np.concatenate([self.ids, ids])
+
+    def remove_ids(self, ids):
+        keep = ~np.isin(self.ids, ids)
+        self.matrix, self.ids = self.matrix[keep], self.ids[keep]
+
+    def search(self, queries, k):
+        scores = queries @ self.matrix.T
+        order = np.argsort(-scores, axis=1)[:, :k]
+        return np.take_along_axis(scores, order, axis=1), self.ids[order]
+
+
+def test_perform_clip_search_uses_faiss_when_available(tmp_path, monkeypatch):
+    fake_faiss = types.SimpleNamespace(
+        IndexFlatIP=lambda dim: None, IndexIDMap2=_FakeFaissIndex
+    )
+    monkeypatch.setitem(sys.modules, "faiss", fake_faiss)
+    monkeypatch.setattr(clip_search, "get_clip_model", lambda _config: _FakeModel())
+    config = LocalBooruConfig(
+        root=tmp_path, db_path=tmp_path / "db.sqlite", thumb_cache=tmp_path / "t"
+    )
+    key = config.clip_model_key
+    db = LocalBooruDatabase(config.db_path)
+    try:
+        vectors = np.asarray(
+            [[0.0, 1.0, 0.0], [1.0, 0.0, 0.0], [0.6, 0.8, 0.0]], dtype=np.float32
+        )
+        ids = [_add_image(db, f"img_{i}.png", key) for i in range(len(vectors))]
+        codes, scales = quantize_clip_vectors(vectors)
+        db.store_clip_vectors(
+            key,
+            [(i, c.tobytes(), float(s)) for i, c, s in zip(ids, codes, scales)],
+        )
+
+        results = clip_search.perform_clip_search(
+            db, config, positive_text=["red"], limit=2
+        )
+        assert [image_id for image_id, _ in results] == [ids[1], ids[2]]
+        cache = clip_search.get_clip_matrix_cache(db, key)
+        index = cache.faiss_index()
+        assert isinstance(index, _FakeFaissIndex)
+
+        # Later writes update the same index in place.
+        db.store_clip_vectors(key, [(ids[0], codes[1].tobytes(), float(scales[1]))])
+        results = clip_search.perform_clip_search(
+            db, config, positive_text=["red"], limit=2
+        )
+        assert cache.faiss_index() is index
+        assert sorted(image_id for image_id, _ in results) == [ids[0], ids[1]]
+        assert sorted(index.ids.tolist()) == ids
+    finally:
+        db.close()
+
+
+def test_normalize_ids_accepts_ints_and_numeric_strings():
+    values = [3, "4", " -5 ", "+6", "x", "", "1.5", None, 7.0, True]
+    assert clip_search._normalize_ids(values) == [3, 4, -5, 6, 7, 1]
@@ -1,9 +1,12 @@
 from __future__ import annotations
 
+import argparse
+import dataclasses
 from pathlib import Path
 
-from localbooru.cli import build_parser
+from localbooru.cli import build_parser, main
 from localbooru.config import (
+    AutoTagMode,
     LocalBooruConfig,
     load_config_file,
     render_default_config_template,
@@ -29,11 +32,21 @@ def test_config_defaults_without_file(monkeypatch, tmp_path):
     assert config.db_path == Path("gallery.db").resolve()
     expected_cache = (cache_root / "localbooru" / "thumbs").resolve()
     assert config.thumb_cache == expected_cache
-    assert config.extra_roots == []
+    assert config.extra_roots == ()
     assert config.watch is False
     assert config.config_file is None
 
 
+def test_default_cache_dir_follows_home(monkeypatch, tmp_path):
+    monkeypatch.delenv("XDG_CACHE_HOME", raising=False)
+    for name in ("a", "b"):
+        monkeypatch.setenv("HOME", str(tmp_path / name))
+        args = _make_args(["--db", str(tmp_path / "db.sqlite")])
+        config = LocalBooruConfig.from_sources(args)
+        expected = (tmp_path / name / ".cache" / "localbooru" / "thumbs").resolve()
+        assert config.thumb_cache == expected
+
+
 def test_config_file_relative_roots(monkeypatch, tmp_path):
     cache_root = tmp_path / "cache"
     state_root = tmp_path / "state"
@@ -160,3 +173,54 @@ def test_render_default_config_template(monkeypatch, tmp_path):
     assert f'thumb_cache = "{expected_cache}"' in template
     assert 'clip_device = "cpu"' in template
     assert "auto_tag_mode = \"augment\"" in template
+
+
+def test_clip_model_key_follows_replace(tmp_path):
+    config = LocalBooruConfig(
+        root=tmp_path, db_path=tmp_path / "db.sqlite", thumb_cache=tmp_path / "t"
+    )
+    assert config.clip_model_key == "ViT-B-32-quickgelu:openai"
+    updated = dataclasses.replace(config, clip_checkpoint="laion2b")
+    assert updated.clip_model_key == "ViT-B-32-quickgelu:laion2b"
+
+
+def test_auto_tag_mode_is_parsed_to_enum(tmp_path):
+    args = _make_args(["--root", str(tmp_path), "--auto-tag-mode", "missing"])
+    config = LocalBooruConfig.from_sources(args)
+    assert config.auto_tag_mode is AutoTagMode.MISSING
+    assert config.auto_tag_mode == "missing"
+
+    from_file = LocalBooruConfig.from_sources(
+        _make_args(["--root", str(tmp_path)]),
+        file_options={"auto_tag_mode": "AUGMENT"},
+    )
+    assert from_file.auto_tag_mode is AutoTagMode.AUGMENT
+
+    typo = LocalBooruConfig.from_sources(
+        _make_args(["--root", str(tmp_path)]),
+        file_options={"auto_tag_mode": "augmnet"},
+    )
+    assert typo.auto_tag_mode is AutoTagMode.MISSING
+    assert AutoTagMode.parse(AutoTagMode.AUGMENT) is AutoTagMode.AUGMENT
+
+
+def test_config_is_hashable(tmp_path):
+    args = _make_args(["--root", str(tmp_path), "--extra-root", str(tmp_path / "b")])
+    first = LocalBooruConfig.from_sources(args)
+    second = LocalBooruConfig.from_sources(args)
+    assert hash(first) == hash(second)
+    assert len({first, second}) == 1
+
+
+def test_partial_namespace_uses_toggle_defaults(tmp_path):
+    args = argparse.Namespace(root=str(tmp_path))
+    config = LocalBooruConfig.from_sources(
+        args, file_options={"auto_tag_background": False}
+    )
+    assert config.auto_tag_missing is True
+    assert config.auto_tag_background is False
+
+
+def test_print_config_writes_template_with_trailing_newline(capsys):
+    assert main(["--print-config"]) == 0
+    assert capsys.readouterr().out == render_default_config_template() + "\n"
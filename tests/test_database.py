@@ -1,10 +1,17 @@
 from __future__ import annotations
 
 import sqlite3
+import subprocess
+import sys
+import threading
 
-from localbooru.database import LocalBooruDatabase
+import pytest
+
+from localbooru.database import BULK_IMPORT_KEY, SCHEMA_VERSION, LocalBooruDatabase
 from localbooru.tags import TagRecord
 
+from helpers import image_record, insert_image
+
 
 def test_delete_missing_images_handles_large_batches(tmp_path):
     db_path = tmp_path / "gallery.db"
@@ -13,19 +20,12 @@ def test_delete_missing_images_handles_large_batches(tmp_path):
     keep_paths = set()
     for index in range(total):
         rel_path = f"img_{index}.png"
-        db.upsert_image_record(
-            rel_path=rel_path,
+        insert_image(
+            db,
+            rel_path,
             name=f"Image {index}",
             mtime=float(index),
             size=index + 100,
-            width=None,
-            height=None,
-            seed=None,
-            model=None,
-            source=None,
-            description=None,
-            metadata_json=None,
-            tags=[],
         )
         if index % 2 == 0:
             keep_paths.add(rel_path)
@@ -53,20 +53,7 @@ def test_delete_missing_images_clears_tags_and_index(tmp_path):
         source="embedded",
     )
 
-    db.upsert_image_record(
-        rel_path="img.png",
-        name="img.png",
-        mtime=0.0,
-        size=1,
-        width=None,
-        height=None,
-        seed=None,
-        model=None,
-        source=None,
-        description=None,
-        metadata_json=None,
-        tags=[tag],
-    )
+    insert_image(db, "img.png", tags=[tag])
 
     assert (
         db.connection.execute("SELECT COUNT(*) FROM tags").fetchone()[0] == 1
@@ -109,20 +96,7 @@ def test_clip_progress_counts_safe_defaults(tmp_path):
 def test_apply_auto_tags_retries_when_locked(monkeypatch, tmp_path):
     db_path = tmp_path / "retry.db"
     db = LocalBooruDatabase(db_path)
-    image_id, _ = db.upsert_image_record(
-        rel_path="img.png",
-        name="img.png",
-        mtime=0.0,
-        size=1,
-        width=1,
-        height=1,
-        seed=None,
-        model=None,
-        source=None,
-        description=None,
-        metadata_json=None,
-        tags=[],
-    )
+    image_id = insert_image(db, "img.png")
 
     original = LocalBooruDatabase._apply_auto_tags_internal
     call_state = {"attempts": 0}
@@ -157,20 +131,7 @@ def test_store_clip_vector_retries_when_locked(monkeypatch, tmp_path):
     db_path = tmp_path / "clip_retry.db"
     db = LocalBooruDatabase(db_path)
     try:
-        image_id, _ = db.upsert_image_record(
-            rel_path="img2.png",
-            name="img2.png",
-            mtime=0.0,
-            size=1,
-            width=1,
-            height=1,
-            seed=None,
-            model=None,
-            source=None,
-            description=None,
-            metadata_json=None,
-            tags=[],
-        )
+        image_id = insert_image(db, "img2.png")
         db.ensure_clip_entry(image_id, model="test", force_reset=True)
 
         call_state = {"attempts": 0}
@@ -217,3 +178,798 @@ def test_store_clip_vector_retries_when_locked(monkeypatch, tmp_path):
         assert row == b"\x00\x01"
     finally:
         db.close()
+
+
+def test_store_clip_vectors_marks_batch_ready(tmp_path):
+    db = LocalBooruDatabase(tmp_path / "clip_batch.db")
+    try:
+        image_ids = []
+        for index in range(3):
+            image_id = insert_image(db, f"batch_{index}.png")
+            db.ensure_clip_entry(image_id, model="test")
+            image_ids.append(image_id)
+
+        db.store_clip_vectors(
+            "test", [(image_id, bytes([image_id]), 0.5) for image_id in image_ids]
+        )
+
+        assert db.clip_progress_counts("test") == (3, 3, 0, 0)
+        for image_id in image_ids:
+            assert db.fetch_clip_vector_record(image_id, "test") == (
+                bytes([image_id]),
+                0.5,
+            )
+    finally:
+        db.close()
+
+
+def test_load_clip_matrix_splits_formats_and_filters_ids(tmp_path):
+    np = pytest.importorskip("numpy")
+    db = LocalBooruDatabase(tmp_path / "clip_matrix.db")
+    try:
+        image_ids = []
+        for index in range(3):
+            image_id = insert_image(db, f"m_{index}.png")
+            db.ensure_clip_entry(image_id, model="test")
+            image_ids.append(image_id)
+        db.store_clip_vectors(
+            "test",
+            [
+                (image_ids[0], bytes([1, 2]), 0.5),
+                (image_ids[1], bytes([3, 4]), 0.25),
+            ],
+        )
+        legacy = np.asarray([1.0, 0.0], dtype=np.float32)
+        db.store_clip_vector(image_ids[2], "test", legacy.tobytes())
+
+        ids, codes, scales = db.load_clip_matrix("test")
+        assert ids.tolist() == image_ids[:2]
+        assert codes.tolist() == [[1, 2], [3, 4]]
+        assert scales.tolist() == [0.5, 0.25]
+
+        ids, matrix, scales = db.load_clip_matrix("test", quantized=False)
+        assert ids.tolist() == [image_ids[2]]
+        assert matrix.tolist() == [[1.0, 0.0]]
+        assert scales is None
+
+        ids, _, _ = db.load_clip_matrix("test", [image_ids[1], image_ids[2]])
+        assert ids.tolist() == [image_ids[1]]
+    finally:
+        db.close()
+
+
+def test_connections_apply_tuning_pragmas(tmp_path):
+    db = LocalBooruDatabase(tmp_path / "pragmas.db")
+    extra = db.new_connection()
+    try:
+        for conn in (db.connection, extra):
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+            assert conn.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+            assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+            assert conn.execute("PRAGMA temp_store").fetchone()[0] == 2
+            assert conn.execute("PRAGMA cache_size").fetchone()[0] == -65536
+    finally:
+        extra.close()
+        db.close()
+
+
+def test_fetch_clip_vectors_returns_ready_rows_only(tmp_path):
+    db = LocalBooruDatabase(tmp_path / "clip_fetch.db")
+    try:
+        image_ids = []
+        for index in range(3):
+            image_id = insert_image(db, f"f_{index}.png")
+            db.ensure_clip_entry(image_id, model="test")
+            image_ids.append(image_id)
+        db.store_clip_vector(image_ids[0], "test", b"\x01", 0.5)
+        db.store_clip_vector(image_ids[1], "test", b"\x02\x00\x00\x00")
+
+        found = db.fetch_clip_vectors([*image_ids, image_ids[0], 999], "test")
+        assert found == {
+            image_ids[0]: (b"\x01", 0.5),
+            image_ids[1]: (b"\x02\x00\x00\x00", None),
+        }
+        assert db.fetch_clip_vectors([], "test") == {}
+    finally:
+        db.close()
+
+
+def test_upsert_image_record_skips_unchanged_tag_updates(tmp_path):
+    db = LocalBooruDatabase(tmp_path / "tag_diff.db")
+    try:
+        tags = [
+            TagRecord(
+                tag=name,
+                norm=name,
+                kind="prompt",
+                emphasis="normal",
+                weight=1.0,
+                raw=name,
+                source="embedded",
+            )
+            for name in ("masterpiece", "scenery")
+        ]
+        insert_image(db, "img.png", tags=tags)
+
+        statements = []
+        db.connection.set_trace_callback(statements.append)
+        tags[1] = TagRecord(**{**tags[1].__dict__, "weight": 1.2})
+        insert_image(db, "img.png", tags=tags)
+        db.connection.set_trace_callback(None)
+
+        tag_updates = [sql for sql in statements if sql.startswith("UPDATE tags")]
+        assert tag_updates
+        assert all("norm='scenery'" in sql for sql in tag_updates)
+        weights = dict(
+            db.connection.execute("SELECT norm, weight FROM tags").fetchall()
+        )
+        assert weights == {"masterpiece": 1.0, "scenery": 1.2}
+    finally:
+        db.close()
+
+
+def test_schema_migrations_run_once_per_database(monkeypatch, tmp_path):
+    db_path = tmp_path / "legacy.db"
+    db = LocalBooruDatabase(db_path)
+    db.connection.execute("DROP INDEX clip_ready_idx")
+    db.connection.execute("ALTER TABLE clip_embeddings DROP COLUMN vector_scale")
+    db.connection.execute("PRAGMA user_version=0")
+    db.connection.commit()
+    db.close()
+
+    db = LocalBooruDatabase(db_path)
+    try:
+        version = db.connection.execute("PRAGMA user_version").fetchone()[0]
+        assert version == SCHEMA_VERSION
+        clip_cols = {
+            row[1]
+            for row in db.connection.execute("PRAGMA table_info(clip_embeddings)")
+        }
+        assert "vector_scale" in clip_cols
+    finally:
+        db.close()
+
+    calls = []
+    original = LocalBooruDatabase._migrate_schema
+
+    def tracking(self, cur):
+        calls.append(True)
+        return original(self, cur)
+
+    monkeypatch.setattr(LocalBooruDatabase, "_migrate_schema", tracking)
+    LocalBooruDatabase(db_path).close()
+    assert calls == []
+
+
+@pytest.mark.parametrize("returning", [True, False])
+def test_reserve_batches_claim_pending_rows_in_queue_order(
+    monkeypatch, tmp_path, returning
+):
+    monkeypatch.setattr("localbooru.database._HAS_RETURNING", returning)
+    db = LocalBooruDatabase(tmp_path / "reserve.db")
+    try:
+        image_ids = []
+        for index in range(3):
+            image_id = insert_image(db, f"r_{index}.png", mtime=float(index))
+            image_ids.append(image_id)
+        for image_id in reversed(image_ids):
+            db.ensure_clip_entry(image_id, model="test")
+            db.ensure_auto_tag_job(image_id, model="tagger")
+
+        clip_rows = db.reserve_clip_batch("test", 2)
+        assert [row["image_id"] for row in clip_rows] == image_ids[:0:-1]
+        assert [row["path"] for row in clip_rows] == ["r_2.png", "r_1.png"]
+        assert [row["mtime"] for row in clip_rows] == [2.0, 1.0]
+        statuses = dict(
+            db.connection.execute(
+                "SELECT image_id, status FROM clip_embeddings"
+            ).fetchall()
+        )
+        assert statuses[image_ids[0]] == "pending"
+        assert statuses[image_ids[2]] == "processing"
+        assert [row["image_id"] for row in db.reserve_clip_batch("test", 5)] == [
+            image_ids[0]
+        ]
+        assert db.reserve_clip_batch("test", 5) == []
+
+        auto_rows = db.reserve_auto_tag_batch(2)
+        assert [row["image_id"] for row in auto_rows] == image_ids[:0:-1]
+        assert [row["path"] for row in auto_rows] == ["r_2.png", "r_1.png"]
+        assert len(db.reserve_auto_tag_batch(5)) == 1
+    finally:
+        db.close()
+
+
+def test_pending_reservations_use_partial_indexes(tmp_path):
+    db = LocalBooruDatabase(tmp_path / "plan.db")
+    try:
+        clip_plan = " ".join(
+            row["detail"]
+            for row in db.connection.execute(
+                "EXPLAIN QUERY PLAN SELECT image_id FROM clip_embeddings "
+                "WHERE status = 'pending' AND model = ? ORDER BY queued_at LIMIT 5",
+                ("test",),
+            )
+        )
+        assert "clip_pending_idx" in clip_plan
+        assert "TEMP B-TREE" not in clip_plan
+        auto_plan = " ".join(
+            row["detail"]
+            for row in db.connection.execute(
+                "EXPLAIN QUERY PLAN SELECT image_id FROM auto_tag_jobs "
+                "WHERE status = 'pending' ORDER BY queued_at LIMIT 5"
+            )
+        )
+        assert "auto_tag_status_idx" in auto_plan
+        assert "TEMP B-TREE" not in auto_plan
+    finally:
+        db.close()
+
+
+def test_delete_missing_images_matches_backslash_paths(tmp_path):
+    db = LocalBooruDatabase(tmp_path / "slashes.db")
+    try:
+        for rel_path in ("sub\\a.png", "sub/b.png", "sub/c.png"):
+            insert_image(db, rel_path)
+
+        assert db.delete_missing_images(["sub/a.png", "sub\\b.png"]) == 1
+        remaining = {
+            row["path"] for row in db.connection.execute("SELECT path FROM images")
+        }
+        assert remaining == {"sub\\a.png", "sub/b.png"}
+        assert db.delete_missing_images(["sub/a.png", "sub\\b.png"]) == 0
+    finally:
+        db.close()
+
+
+def test_tag_index_tracks_tag_changes_as_external_content(tmp_path):
+    db_path = tmp_path / "fts.db"
+    db = LocalBooruDatabase(db_path)
+    # Simulate a database created with the old self-contained tag_index.
+    db.connection.execute("DROP TABLE tag_index")
+    db.connection.execute(
+        "CREATE VIRTUAL TABLE tag_index USING fts5(norm, tag, kind UNINDEXED, "
+        "image_id UNINDEXED)"
+    )
+    db.close()
+
+    db = LocalBooruDatabase(db_path)
+    try:
+        sql = db.connection.execute(
+            "SELECT sql FROM sqlite_master WHERE name='tag_index'"
+        ).fetchone()[0]
+        assert "content='tags'" in sql
+
+        def tag(name, weight=1.0):
+            return TagRecord(
+                tag=name,
+                norm=name,
+                kind="prompt",
+                emphasis="normal",
+                weight=weight,
+                raw=name,
+                source="embedded",
+            )
+
+        insert_image(db, "img.png", tags=[tag("red_hair"), tag("smile")])
+        insert_image(db, "img.png", tags=[tag("red_hair", 1.3), tag("night")])
+        db.connection.execute(
+            "INSERT INTO tag_index(tag_index, rank) VALUES ('integrity-check', 1)"
+        )
+
+        def matches(term):
+            return [
+                row[0]
+                for row in db.connection.execute(
+                    "SELECT norm FROM tag_index WHERE tag_index MATCH ?", (term,)
+                )
+            ]
+
+        assert matches('"red_hair"') == ["red_hair"]
+        assert matches('"night"') == ["night"]
+        assert matches('"smile"') == []
+    finally:
+        db.close()
+
+
+def test_upsert_image_record_recovers_from_stale_path_cache(tmp_path):
+    db = LocalBooruDatabase(tmp_path / "path_cache.db")
+    other = LocalBooruDatabase(tmp_path / "path_cache.db")
+    try:
+        first_id = insert_image(db, "img.png")
+        assert insert_image(db, "img.png") == first_id
+
+        with db.connection:
+            db.connection.execute("DELETE FROM images WHERE path='img.png'")
+        other_id = insert_image(other, "other.png")
+
+        new_id, changed = db.upsert_image_record(**image_record("img.png"))
+        assert changed
+        assert new_id != other_id
+        assert db.lookup_image("img.png")["id"] == new_id
+
+        # Inserted through another connection after this cache was loaded.
+        assert insert_image(db, "other.png") == other_id
+        count = db.connection.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+        assert count == 2
+    finally:
+        other.close()
+        db.close()
+
+
+def test_ensure_queue_entries_only_requeue_on_reset_conditions(tmp_path):
+    db = LocalBooruDatabase(tmp_path / "ensure.db")
+    try:
+        image_id = insert_image(db, "img.png")
+
+        def clip_row():
+            return db.connection.execute(
+                "SELECT model, status, vector FROM clip_embeddings WHERE image_id=?",
+                (image_id,),
+            ).fetchone()
+
+        def auto_row():
+            return db.connection.execute(
+                "SELECT model, status FROM auto_tag_jobs WHERE image_id=?",
+                (image_id,),
+            ).fetchone()
+
+        db.ensure_clip_entry(image_id, model="a")
+        db.store_clip_vector(image_id, "a", b"\x01", 0.5)
+        db.ensure_clip_entry(image_id, model="a")
+        assert tuple(clip_row()) == ("a", "ready", b"\x01")
+        db.ensure_clip_entry(image_id, model="b")
+        assert tuple(clip_row()) == ("b", "pending", None)
+        db.store_clip_vector(image_id, "b", b"\x02", 0.5)
+        db.ensure_clip_entry(image_id, model="b", force_reset=True)
+        assert tuple(clip_row()) == ("b", "pending", None)
+
+        db.ensure_auto_tag_job(image_id, model="tagger")
+        db.mark_auto_tag_ready(image_id)
+        db.ensure_auto_tag_job(image_id, model="tagger")
+        assert tuple(auto_row()) == ("tagger", "ready")
+        with db.connection:
+            db.connection.execute(
+                "UPDATE auto_tag_jobs SET status='missing' WHERE image_id=?",
+                (image_id,),
+            )
+        db.ensure_auto_tag_job(image_id, model="tagger")
+        assert tuple(auto_row()) == ("tagger", "pending")
+    finally:
+        db.close()
+
+
+def test_store_clip_vectors_accepts_memoryview_rows(tmp_path):
+    np = pytest.importorskip("numpy")
+    db = LocalBooruDatabase(tmp_path / "clip_views.db")
+    try:
+        image_ids = []
+        for index in range(2):
+            image_id = insert_image(db, f"v_{index}.png")
+            db.ensure_clip_entry(image_id, model="test")
+            image_ids.append(image_id)
+
+        codes = np.asarray([[1, -2, 3], [-4, 5, -6]], dtype=np.int8)
+        view = memoryview(codes).cast("B")
+        db.store_clip_vectors(
+            "test",
+            [(image_ids[i], view[i * 3 : (i + 1) * 3], 0.5) for i in range(2)],
+        )
+
+        ids, loaded, scales = db.load_clip_matrix("test")
+        assert ids.tolist() == image_ids
+        assert loaded.tolist() == codes.tolist()
+        assert scales.tolist() == [0.5, 0.5]
+    finally:
+        db.close()
+
+
+def test_reopening_database_leaves_schema_cookie_untouched(tmp_path):
+    db_path = tmp_path / "cookie.db"
+    LocalBooruDatabase(db_path).close()
+    db = LocalBooruDatabase(db_path)
+    try:
+        before = db.connection.execute("PRAGMA schema_version").fetchone()[0]
+        triggers = {
+            row[0]
+            for row in db.connection.execute(
+                "SELECT name FROM sqlite_master WHERE type='trigger'"
+            )
+        }
+        assert triggers == {"tags_ai", "tags_ad", "tags_au"}
+    finally:
+        db.close()
+    db = LocalBooruDatabase(db_path)
+    try:
+        after = db.connection.execute("PRAGMA schema_version").fetchone()[0]
+        assert after == before
+    finally:
+        db.close()
+
+
+def test_tag_lookups_are_served_by_covering_indexes(tmp_path):
+    db = LocalBooruDatabase(tmp_path / "tag_plan.db")
+    try:
+        indexes = {
+            row[0]
+            for row in db.connection.execute(
+                "SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='tags'"
+            )
+        }
+        assert "tags_kind_norm_idx" not in indexes
+
+        for sql, params in (
+            ("SELECT norm, kind FROM tags WHERE image_id=?", (1,)),
+            ("SELECT image_id FROM tags WHERE kind=? AND norm=?", ("prompt", "x")),
+            ("SELECT DISTINCT image_id FROM tags WHERE source='auto'", ()),
+        ):
+            plan = " ".join(
+                row["detail"]
+                for row in db.connection.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            )
+            assert "COVERING INDEX" in plan
+    finally:
+        db.close()
+
+
+def test_store_rating_keeps_scores_without_reading_them_back(tmp_path):
+    db = LocalBooruDatabase(tmp_path / "rating.db")
+    try:
+        image_id = insert_image(db, "img.png")
+        db.update_rating_from_scores(image_id, {"General": 0.7, "explicit": 0.3})
+
+        def stored_scores():
+            return db.connection.execute(
+                "SELECT scores_json FROM rating_jobs WHERE image_id=?", (image_id,)
+            ).fetchone()[0]
+
+        original = stored_scores()
+        assert original == '{"explicit": 0.3, "general": 0.7}'
+
+        db.store_rating(image_id, "explicit", 0.9)
+        assert stored_scores() == original
+
+        db.store_rating(image_id, "sensitive", 0.8, {"Sensitive": 0.8})
+        assert stored_scores() == '{"sensitive": 0.8}'
+    finally:
+        db.close()
+
+
+def test_single_row_writes_reuse_one_writer_connection(monkeypatch, tmp_path):
+    db = LocalBooruDatabase(tmp_path / "writer.db")
+    try:
+        image_ids = []
+        for index in range(3):
+            image_id = insert_image(db, f"w_{index}.png")
+            db.ensure_clip_entry(image_id, model="test")
+            image_ids.append(image_id)
+
+        opened = []
+        original_new_connection = LocalBooruDatabase.new_connection
+
+        def counting_new_connection(self):
+            conn = original_new_connection(self)
+            opened.append(conn)
+            return conn
+
+        monkeypatch.setattr(
+            LocalBooruDatabase, "new_connection", counting_new_connection
+        )
+        db.store_clip_vector(image_ids[0], "test", b"\x01", 0.5)
+        db.store_clip_vector(image_ids[1], "test", b"\x02", 0.5)
+        db.mark_clip_error(image_ids[2], "boom")
+        assert len(opened) == 1
+        assert db.clip_progress_counts("test") == (3, 2, 0, 1)
+    finally:
+        db.close()
+
+
+def test_queue_workers_reuse_the_writer_connection(monkeypatch, tmp_path):
+    db = LocalBooruDatabase(tmp_path / "queue_writer.db")
+    try:
+        image_id = insert_image(db, "queue.png")
+        db.ensure_clip_entry(image_id, model="test")
+        db.ensure_auto_tag_job(image_id, model="wd14")
+
+        opened = []
+        original_new_connection = LocalBooruDatabase.new_connection
+
+        def counting_new_connection(self):
+            conn = original_new_connection(self)
+            opened.append(conn)
+            return conn
+
+        monkeypatch.setattr(
+            LocalBooruDatabase, "new_connection", counting_new_connection
+        )
+        assert [row["image_id"] for row in db.reserve_clip_batch("test", 4)] == [
+            image_id
+        ]
+        assert [row["image_id"] for row in db.reserve_auto_tag_batch(4)] == [
+            image_id
+        ]
+        tag = TagRecord(
+            tag="cat",
+            norm="cat",
+            kind="prompt",
+            emphasis="normal",
+            weight=0.9,
+            raw="auto:cat",
+            source="auto",
+        )
+        assert db.apply_auto_tags(image_id, [tag], strategy="augment") == "applied"
+        db.update_rating_from_scores(image_id, {"general": 0.9})
+        db.mark_auto_tag_ready(image_id)
+        assert len(opened) == 1
+        assert db.has_auto_tags(image_id)
+    finally:
+        db.close()
+
+
+def test_progress_counts_scan_status_indexes(tmp_path):
+    db = LocalBooruDatabase(tmp_path / "progress_plan.db")
+    try:
+        for sql, params, index in (
+            (
+                "SELECT status, COUNT(*) FROM clip_embeddings "
+                "WHERE model=? GROUP BY status",
+                ("test",),
+                "clip_ready_idx",
+            ),
+            (
+                "SELECT COALESCE(SUM(vector_scale IS NOT NULL), 0), "
+                "COALESCE(MAX(updated_at), 0), "
+                "COALESCE(SUM(CASE WHEN vector_scale IS NOT NULL THEN image_id END), 0), "
+                "COALESCE(SUM(vector_scale IS NULL), 0) FROM clip_embeddings "
+                "WHERE model=? AND status='ready'",
+                ("test",),
+                "clip_ready_idx",
+            ),
+            (
+                "SELECT status, COUNT(*) FROM auto_tag_jobs GROUP BY status",
+                (),
+                "auto_tag_status_idx",
+            ),
+        ):
+            plan = " ".join(
+                row["detail"]
+                for row in db.connection.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            )
+            assert f"COVERING INDEX {index}" in plan
+            assert "TEMP B-TREE" not in plan
+    finally:
+        db.close()
+
+
+def test_queue_position_counts_use_status_indexes(tmp_path):
+    db = LocalBooruDatabase(tmp_path / "position_plan.db")
+    try:
+        for table, index in (
+            ("auto_tag_jobs", "auto_tag_status_idx"),
+            ("rating_jobs", "rating_status_idx"),
+        ):
+            plan = " ".join(
+                row["detail"]
+                for row in db.connection.execute(
+                    "EXPLAIN QUERY PLAN SELECT COUNT(*) FROM "
+                    f"{table} WHERE status='pending' AND queued_at <= ?",
+                    (0.0,),
+                )
+            )
+            assert f"COVERING INDEX {index} (status=? AND queued_at<?)" in plan
+    finally:
+        db.close()
+
+
+def test_iter_images_streams_across_fetch_batches(tmp_path):
+    db = LocalBooruDatabase(tmp_path / "iter.db")
+    try:
+        for index in range(5):
+            insert_image(db, f"i_{index}.png", mtime=float(index))
+        expected = [f"i_{index}.png" for index in reversed(range(5))]
+        cur = db.connection.execute("SELECT path FROM images ORDER BY mtime DESC")
+        assert [row[0] for row in db._iter_fetchmany(cur, size=2)] == expected
+        assert list(db.iter_image_paths()) == expected
+        paged = db.iter_images(limit=2, offset=1)
+        assert [row["path"] for row in paged] == expected[1:3]
+    finally:
+        db.close()
+
+
+def test_existence_helpers(tmp_path):
+    db = LocalBooruDatabase(tmp_path / "exists.db")
+    try:
+        image_id = insert_image(db, "img.png")
+        db.ensure_clip_entry(image_id, model="test")
+        assert not db.has_ready_clip(image_id, "test")
+        db.store_clip_vector(image_id, "test", b"\x01", 0.5)
+        assert db.has_ready_clip(image_id, "test")
+        assert not db.has_ready_clip(image_id, "other")
+
+        assert not db.has_auto_tags(image_id)
+        assert not db.has_rating_tag(image_id)
+        auto_tag = TagRecord(
+            tag="smile",
+            norm="smile",
+            kind="prompt",
+            emphasis="normal",
+            weight=0.8,
+            raw="auto:smile",
+            source="auto",
+        )
+        db.apply_auto_tags(image_id, [auto_tag], strategy="augment")
+        db.store_rating(image_id, "general", 0.9)
+        assert db.has_auto_tags(image_id)
+        assert db.has_rating_tag(image_id)
+    finally:
+        db.close()
+
+
+def test_normalize_scores_tracks_best_label_in_one_pass():
+    normalized, best = LocalBooruDatabase._normalize_scores(
+        {"General": 0.2, "Explicit": 0.7, "bogus": "x", "sensitive": 0.7}
+    )
+    assert normalized == {"general": 0.2, "explicit": 0.7, "sensitive": 0.7}
+    assert best == ("explicit", 0.7)
+    assert LocalBooruDatabase._normalize_scores(None) == ({}, None)
+    assert LocalBooruDatabase._normalize_scores({"x": None}) == ({}, None)
+
+
+def test_batch_commits_once_and_isolates_failed_calls(tmp_path):
+    db = LocalBooruDatabase(tmp_path / "batch.db")
+    reader = sqlite3.connect(tmp_path / "batch.db")
+    try:
+        broken_tag = TagRecord(
+            tag="x",
+            norm="x",
+            kind="prompt",
+            emphasis="normal",
+            weight=1.0,
+            raw="x",
+            source="embedded",
+        )
+        with db.batch():
+            image_id = insert_image(db, "a.png")
+            db.ensure_clip_entry(image_id, model="test")
+            # Routed through the batch instead of waiting on a second connection.
+            db.mark_clip_error(image_id, "boom")
+            db.update_rating_from_scores(image_id, {"general": 0.9})
+            with pytest.raises(AttributeError):
+                insert_image(db, "b.png", tags=[broken_tag, None])
+            assert reader.execute("SELECT COUNT(*) FROM images").fetchone()[0] == 0
+
+        paths = [row[0] for row in reader.execute("SELECT path FROM images")]
+        assert paths == ["a.png"]
+        assert db.clip_progress_counts("test") == (1, 0, 0, 1)
+        assert reader.execute("SELECT rating FROM images").fetchone()[0] == "general"
+    finally:
+        reader.close()
+        db.close()
+
+
+def test_batch_is_not_ended_by_writes_from_other_threads(tmp_path):
+    db = LocalBooruDatabase(tmp_path / "batch_threads.db")
+    try:
+        other = threading.Thread(target=insert_image, args=(db, "c.png"))
+        with pytest.raises(RuntimeError):
+            with db.batch():
+                insert_image(db, "a.png")
+                other.start()
+                # The other thread waits on the write lock instead of
+                # committing the batch's pending rows.
+                other.join(0.2)
+                insert_image(db, "b.png")
+                raise RuntimeError("scan failed")
+        other.join()
+        paths = [row["path"] for row in db.iter_images()]
+        assert paths == ["c.png"]
+    finally:
+        db.close()
+
+
+def test_bulk_import_rebuilds_tag_index_on_exit_and_after_crash(tmp_path):
+    db_path = tmp_path / "bulk.db"
+
+    def tagged(db, rel_path, norm):
+        insert_image(
+            db,
+            rel_path,
+            tags=[
+                TagRecord(
+                    tag=norm,
+                    norm=norm,
+                    kind="prompt",
+                    emphasis="normal",
+                    weight=1.0,
+                    raw=norm,
+                    source="embedded",
+                )
+            ],
+        )
+
+    def matches(db, term):
+        return db.connection.execute(
+            "SELECT COUNT(*) FROM tag_index WHERE tag_index MATCH ?", (f'"{term}"',)
+        ).fetchone()[0]
+
+    db = LocalBooruDatabase(db_path)
+    assert not db.has_images()
+    with db.bulk_import():
+        tagged(db, "a.png", "sunset")
+        assert matches(db, "sunset") == 0
+    assert matches(db, "sunset") == 1
+    assert db.has_images()
+
+    # Simulate a process dying inside the block: triggers gone, index stale.
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    with db.connection:
+        for name in ("tags_ai", "tags_ad", "tags_au"):
+            db.connection.execute(f"DROP TRIGGER {name}")
+        db.connection.execute(
+            "INSERT INTO localbooru_meta(key, value) VALUES (?, ?)",
+            (BULK_IMPORT_KEY, str(dead.pid)),
+        )
+    tagged(db, "b.png", "forest")
+    assert matches(db, "forest") == 0
+    db.close()
+
+    db = LocalBooruDatabase(db_path)
+    try:
+        assert matches(db, "forest") == 1
+        markers = db.connection.execute("SELECT COUNT(*) FROM localbooru_meta")
+        assert markers.fetchone()[0] == 0
+        tagged(db, "c.png", "river")
+        assert matches(db, "river") == 1
+        db.connection.execute(
+            "INSERT INTO tag_index(tag_index, rank) VALUES ('integrity-check', 1)"
+        )
+    finally:
+        db.close()
+
+
+def test_opening_during_bulk_import_leaves_triggers_dropped(tmp_path):
+    db_path = tmp_path / "bulk_concurrent.db"
+    db = LocalBooruDatabase(db_path)
+    try:
+        with db.bulk_import():
+            # Even a migrating open must not restore the triggers mid-import.
+            db.connection.execute("PRAGMA user_version=0")
+            LocalBooruDatabase(db_path).close()
+            triggers = db.connection.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE type='trigger'"
+            ).fetchone()[0]
+            assert triggers == 0
+        triggers = db.connection.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type='trigger'"
+        ).fetchone()[0]
+        assert triggers == 3
+    finally:
+        db.close()
+
+
+def test_bulk_readers_return_plain_values(tmp_path):
+    db = LocalBooruDatabase(tmp_path / "bulk_read.db")
+    try:
+        image_id = insert_image(db, "img.png")
+        db.ensure_auto_tag_job(image_id, model="tagger")
+        db.ensure_clip_entry(image_id, model="test")
+        db.store_clip_vector(image_id, "test", b"\x01", 0.5)
+        auto_tag = TagRecord(
+            tag="smile",
+            norm="smile",
+            kind="prompt",
+            emphasis="normal",
+            weight=0.8,
+            raw="auto:smile",
+            source="auto",
+        )
+        db.apply_auto_tags(image_id, [auto_tag], strategy="augment")
+
+        assert db.load_auto_tag_jobs() == {image_id: ("pending", "tagger")}
+        assert db.load_auto_tagged_ids() == {image_id}
+        assert list(db.iter_clip_vectors("test")) == [(image_id, b"\x01", 0.5)]
+        # The shared connection keeps handing out sqlite3.Row objects.
+        assert db.lookup_image("img.png")["id"] == image_id
+    finally:
+        db.close()
@@ -0,0 +1,33 @@
+"""Tests for sd-parsers sampler parameter extraction."""
+
+from __future__ import annotations
+
+from localbooru.enhanced_metadata import (
+    EnhancedImageMetadata,
+    _apply_sampler_parameters,
+)
+
+
+def test_sampler_parameters_prefer_earlier_aliases() -> None:
+    metadata = EnhancedImageMetadata()
+    _apply_sampler_parameters(
+        metadata,
+        {
+            "CFG": "9",
+            "cfg_scale": "5.5",
+            "Steps": "not a number",
+            "step": 28,
+            "Seed": 1234,
+            "Schedule type": "Karras",
+            "denoise": None,
+            "Denoising strength": "0.4",
+            "Clip skip": "2",
+            "sampler_name": "ignored",
+        },
+    )
+    assert metadata.cfg_scale == 5.5
+    assert metadata.steps == 28
+    assert metadata.seed == "1234"
+    assert metadata.scheduler == "Karras"
+    assert metadata.denoising_strength == 0.4
+    assert metadata.clip_skip == 2
@@ -0,0 +1,40 @@
+"""Tests for the ingestion directory walk."""
+
+from __future__ import annotations
+
+import ntpath
+import os
+
+from localbooru.ingestion import IMAGE_PATTERNS, _iter_image_entries
+
+
+def test_iter_image_entries_matches_patterns_without_following_links(tmp_path) -> None:
+    root = tmp_path / "gallery"
+    nested = root / "nested" / "deeper"
+    nested.mkdir(parents=True)
+    (root / "a.jpg").write_bytes(b"jpg")
+    (nested / "b.PNG").write_bytes(b"png")
+    (root / "notes.txt").write_text("skip")
+    outside = tmp_path / "outside"
+    outside.mkdir()
+    (outside / "linked.png").write_bytes(b"png")
+    (root / "link").symlink_to(outside, target_is_directory=True)
+
+    entries = list(_iter_image_entries(root, IMAGE_PATTERNS))
+    found = {
+        path.relative_to(root).as_posix(): (IMAGE_PATTERNS[index], stat.st_size)
+        for index, path, stat in entries
+    }
+    assert found == {
+        "a.jpg": ("*.jpg", 3),
+        "nested/deeper/b.PNG": ("*.PNG", 3),
+    }
+
+
+def test_iter_image_entries_ignores_case_where_paths_do(tmp_path, monkeypatch) -> None:
+    (tmp_path / "IMG.PNG").write_bytes(b"png")
+
+    # Windows path rules, as on a case-insensitive filesystem.
+    monkeypatch.setattr(os.path, "normcase", ntpath.normcase)
+    entries = list(_iter_image_entries(tmp_path, ("*.png",)))
+    assert [path.name for _, path, _ in entries] == ["IMG.PNG"]
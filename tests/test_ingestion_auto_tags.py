@@ -8,11 +8,14 @@ from typing import Tuple
 from PIL import Image
 
 from localbooru import auto_tagging
-from localbooru.config import LocalBooruConfig
+from localbooru.config import AutoTagMode, LocalBooruConfig
 from localbooru.database import LocalBooruDatabase
-from localbooru.ingestion import ingest_path
+from localbooru.enhanced_metadata import EnhancedImageMetadata
+from localbooru.ingestion import ingest_path, scan_images
 from localbooru.tags import TagRecord
 
+from helpers import insert_image
+
 
 def _make_png(path: Path) -> None:
     Image.new("RGB", (1, 1), color=(255, 0, 0)).save(path)
@@ -167,6 +170,43 @@ def test_ingest_background_enqueues_job(monkeypatch, tmp_path) -> None:
         db.close()
 
 
+def test_default_augment_mode_queues_jobs_for_tagged_rated_images(tmp_path) -> None:
+    root = tmp_path / "gallery_default_mode"
+    root.mkdir()
+    image_path = root / "tagged.png"
+    _make_png(image_path)
+
+    config = LocalBooruConfig(
+        root=root,
+        db_path=tmp_path / "db_default_mode.sqlite",
+        thumb_cache=tmp_path / "thumbs_default_mode",
+        clip_enabled=False,
+    )
+    assert config.auto_tag_mode is AutoTagMode.AUGMENT
+    # Embedded prompt and rating tags: only augment mode still queues a job.
+    metadata = EnhancedImageMetadata(
+        tags=[
+            TagRecord("sunset", "sunset", "prompt", "normal", 1.0, "sunset", "embedded"),
+            TagRecord(
+                "rating:general",
+                "general",
+                "rating",
+                "normal",
+                1.0,
+                "rating:general",
+                "embedded",
+            ),
+        ]
+    )
+
+    db = LocalBooruDatabase(config.db_path)
+    try:
+        image_id = ingest_path(db, config, image_path, metadata=metadata)
+        assert db.get_auto_job_status(image_id) == "pending"
+    finally:
+        db.close()
+
+
 def test_existing_auto_tags_mark_job_ready(tmp_path) -> None:
     root = tmp_path / "gallery_ready"
     root.mkdir()
@@ -228,18 +268,11 @@ def test_apply_auto_tags_augments_and_skips(tmp_path) -> None:
             ),
         ]
         ingest_path(db, config, image_path)
-        db.upsert_image_record(
-            rel_path="has_tags.png",
-            name="has_tags.png",
+        insert_image(
+            db,
+            "has_tags.png",
             mtime=image_path.stat().st_mtime + 1.0,
             size=image_path.stat().st_size,
-            width=1,
-            height=1,
-            seed=None,
-            model=None,
-            source=None,
-            description=None,
-            metadata_json=None,
             tags=embedded,
         )
         image_row = db.lookup_image("has_tags.png")
@@ -343,3 +376,98 @@ def test_generate_wd14_tags_accepts_tuple(monkeypatch, tmp_path) -> None:
     assert lookup["masterpiece"].source == "auto"
     assert lookup["alice"].kind == "character"
     assert scores == {"explicit": 0.91}
+
+
+def test_ingest_path_skips_unchanged_file(monkeypatch, tmp_path) -> None:
+    root = tmp_path / "gallery_unchanged"
+    root.mkdir()
+    image_path = root / "same.png"
+    _make_png(image_path)
+    config = LocalBooruConfig(
+        root=root,
+        db_path=tmp_path / "unchanged.sqlite",
+        thumb_cache=tmp_path / "thumbs_unchanged",
+        clip_enabled=False,
+        auto_tag_missing=False,
+        auto_tag_background=False,
+    )
+
+    db = LocalBooruDatabase(config.db_path)
+    try:
+        first_id = ingest_path(db, config, image_path)
+        stored = db.lookup_image("same.png")
+        assert stored["mtime"] == image_path.stat().st_mtime
+
+        def fail_extract(*_: object, **__: object) -> None:
+            raise AssertionError("unchanged files should not be re-parsed")
+
+        monkeypatch.setattr(
+            "localbooru.ingestion.extract_enhanced_metadata", fail_extract
+        )
+        assert ingest_path(db, config, image_path) == first_id
+    finally:
+        db.close()
+
+
+def test_scan_images_parses_ahead_and_skips_unchanged(monkeypatch, tmp_path) -> None:
+    root = tmp_path / "gallery_scan"
+    root.mkdir()
+    for name in ("a.png", "b.png", "c.png"):
+        _make_png(root / name)
+    config = LocalBooruConfig(
+        root=root,
+        db_path=tmp_path / "scan.sqlite",
+        thumb_cache=tmp_path / "thumbs_scan",
+        clip_enabled=False,
+        auto_tag_missing=False,
+        auto_tag_background=False,
+    )
+    monkeypatch.setattr("localbooru.ingestion.SCAN_COMMIT_INTERVAL", 2)
+
+    db = LocalBooruDatabase(config.db_path)
+    try:
+        scan_images(db, config)
+        assert sorted(db.iter_image_paths()) == ["a.png", "b.png", "c.png"]
+
+        parsed: list[Path] = []
+        monkeypatch.setattr(
+            "localbooru.ingestion.extract_enhanced_metadata", parsed.append
+        )
+        scan_images(db, config)
+        assert parsed == []
+        assert sorted(db.iter_image_paths()) == ["a.png", "b.png", "c.png"]
+    finally:
+        db.close()
+
+
+def test_rescan_uses_prefetched_stats_and_ratings(monkeypatch, tmp_path) -> None:
+    root = tmp_path / "gallery_rescan"
+    root.mkdir()
+    for name in ("a.png", "b.png"):
+        _make_png(root / name)
+    config = LocalBooruConfig(
+        root=root,
+        db_path=tmp_path / "rescan.sqlite",
+        thumb_cache=tmp_path / "thumbs_rescan",
+        clip_enabled=False,
+        auto_tag_missing=True,
+        auto_tag_background=True,
+    )
+
+    db = LocalBooruDatabase(config.db_path)
+    try:
+        scan_images(db, config)
+        jobs_before = db.load_auto_tag_jobs()
+
+        per_file_queries: list[str] = []
+        for name in ("lookup_image", "has_rating_tag"):
+            monkeypatch.setattr(
+                LocalBooruDatabase,
+                name,
+                lambda self, *_args, _name=name: per_file_queries.append(_name),
+            )
+        scan_images(db, config)
+        assert per_file_queries == []
+        assert db.load_auto_tag_jobs() == jobs_before
+    finally:
+        db.close()
@@ -0,0 +1,28 @@
+"""Tests for the optional orjson wrapper."""
+
+from __future__ import annotations
+
+import json
+import math
+
+import pytest
+
+from localbooru import jsonfast
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_jsonfast_round_trips_and_matches_stdlib_edge_cases(
+    monkeypatch, use_orjson: bool
+) -> None:
+    if use_orjson:
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(jsonfast, "orjson", None)
+
+    payload = {"prompt": "1girl, ✨", "steps": 28, "scale": 5.5}
+    assert jsonfast.loads(jsonfast.dumps(payload)) == payload
+    # Shapes orjson rejects fall back to the stdlib behaviour.
+    assert json.loads(jsonfast.dumps({1: "a"})) == {"1": "a"}
+    assert math.isnan(jsonfast.loads('{"x": NaN}')["x"])
+    with pytest.raises(json.JSONDecodeError):
+        jsonfast.loads("{not json")
@@ -0,0 +1,25 @@
+from __future__ import annotations
+
+from localbooru.scanner import ScanProgress
+
+
+def test_scan_snapshot_eta_is_float_or_none(monkeypatch):
+    clock = {"now": 1000.0}
+    monkeypatch.setattr("localbooru.scanner.time.time", lambda: clock["now"])
+
+    progress = ScanProgress()
+    progress.begin(10)
+    snapshot = progress.snapshot()
+    assert snapshot.eta_seconds is None
+    assert isinstance(snapshot.rate_per_min, float)
+
+    clock["now"] += 2.0
+    progress.step_finish()
+    clock["now"] += 2.0
+    progress.step_finish()
+    snapshot = progress.snapshot()
+
+    assert snapshot.processed == 2
+    assert type(snapshot.rate_per_min) is float
+    assert type(snapshot.eta_seconds) is float
+    assert snapshot.eta_seconds > 0
@@ -7,6 +7,8 @@ from types import SimpleNamespace
 from localbooru.database import LocalBooruDatabase
 from localbooru.server import LocalBooruRequestHandler
 
+from helpers import insert_image
+
 
 class _StubHandler(LocalBooruRequestHandler):
     """Thin test double that skips BaseHTTPRequestHandler setup."""
@@ -48,19 +50,13 @@ def test_image_detail_uses_comment_meta_for_characters(tmp_path) -> None:
             }
         },
     }
-    image_id, _changed = db.upsert_image_record(
-        rel_path="hero.png",
-        name="hero.png",
-        mtime=0.0,
+    image_id = insert_image(
+        db,
+        "hero.png",
         size=123,
         width=512,
         height=512,
-        seed=None,
-        model=None,
-        source=None,
-        description=None,
         metadata_json=json.dumps(metadata_payload),
-        tags=[],
     )
 
     handler = _StubHandler(db)
@@ -2,10 +2,13 @@
 from __future__ import annotations
 
 import math
+import zlib
 
 import pytest
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
 
-from localbooru.tags import TagRecord, parse_prompt
+from localbooru.tags import TagRecord, parse_prompt, read_png_metadata
 
 
 def _record_map(records: list[TagRecord]) -> dict[str, TagRecord]:
@@ -150,3 +153,28 @@ def test_parse_prompt_nested_braces_with_open_weight() -> None:
     rec = _record_map(records)["soft_glow"]
     assert rec.emphasis == "weighted"
     assert rec.weight == pytest.approx((1.1**2) * 1.2)
+
+
+def test_read_png_metadata_skips_pixel_data(tmp_path) -> None:
+    path = tmp_path / "meta.png"
+    info = PngInfo()
+    info.add_text("Description", "before idat")
+    Image.new("RGB", (3, 2)).save(path, pnginfo=info)
+
+    # Text chunks may also follow the image data; splice one in before IEND.
+    payload = path.read_bytes()
+    body = b"Comment\x00after idat"
+    chunk = (
+        len(body).to_bytes(4, "big")
+        + b"tEXt"
+        + body
+        + zlib.crc32(b"tEXt" + body).to_bytes(4, "big")
+    )
+    path.write_bytes(payload[:-12] + chunk + payload[-12:])
+
+    assert read_png_metadata(path) == {
+        "Width": "3",
+        "Height": "2",
+        "Description": "before idat",
+        "Comment": "after idat",
+    }